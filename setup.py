@@ -40,19 +40,21 @@ setup(
         'Operating System :: OS Independent',
         'Programming Language :: Python',
         'Programming Language :: Python :: 3',
-        'Programming Language :: Python :: 3.3',
-        'Programming Language :: Python :: 3.4',
-        'Programming Language :: Python :: 3.5',
+        'Programming Language :: Python :: 3.7',
+        'Programming Language :: Python :: 3.8',
+        'Programming Language :: Python :: 3.9',
         'Topic :: Software Development :: Libraries',
     ],
 
     # Packages and dependencies
     package_dir={'': 'src'},
     packages=find_packages('src'),
+    python_requires='>=3.7',
     install_requires=[
         'lazyutils',
         'iospec>=0.3.11',
-        'boxed>=0.3.9'
+        'boxed>=0.3.9',
+        'psutil',
     ],
     extras_require={
         'dev': [
@@ -1,5 +1,5 @@
 from .__meta__ import __version__, __author__
 from .registry_class import registry
 from .exceptions import BuildError, MissingInputError, EarlyTerminationError
-from .functions import run, grade, exec
+from .functions import run, grade, grade_many, iter_run, iter_grade, exec
 from . import langs as _langs
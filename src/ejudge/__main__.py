@@ -1,8 +1,17 @@
 import argparse
+import glob
+import json
+import logging
+import os
+import sys
 
 import ejudge
 import iospec
 from ejudge import __version__
+from ejudge.inputs import InputDirectory
+from ejudge.server import Client, DEFAULT_QUEUE_DEPTH, default_socket_path, \
+    serve
+from ejudge.util import USAGE_META
 
 
 def make_parser():
@@ -27,12 +36,14 @@ def make_parser():
     run_parser.add_argument('file', help='input source code')
     run_parser.add_argument(
         '--inputs', '-r',
-        help='a file with raw inputs to run with the program'
+        help='a file with raw inputs to run with the program or a directory '
+             'with one .in file per test case'
     )
     run_parser.add_argument(
         '--iospec', '-i',
         help='a file with iospec interactions to test with the program'
     )
+    add_connect_argument(run_parser)
     run_parser.set_defaults(func=command_run)
 
     # ejudge grade <source> <inputs>
@@ -42,11 +53,77 @@ def make_parser():
     )
     grade_parser.add_argument('file', help='input source code')
     grade_parser.add_argument('inputs', help='IoSpec interaction')
+    add_connect_argument(grade_parser)
     grade_parser.set_defaults(func=command_grade)
 
+    # ejudge batch <iospec> <dir-or-glob> ...
+    batch_parser = subparsers.add_parser(
+        'batch',
+        help='grade all submissions in a directory or glob pattern'
+    )
+    batch_parser.add_argument('iospec', help='a file with the iospec template')
+    batch_parser.add_argument(
+        'submissions', nargs='+',
+        help='directories or glob patterns with the submission files'
+    )
+    batch_parser.add_argument(
+        '--jobs', '-j', type=int, default=os.cpu_count() or 1,
+        help='number of submissions graded in parallel'
+    )
+    batch_parser.add_argument(
+        '--output', '-o',
+        help='append results to this JSON lines file. Submissions already '
+             'present in the file are skipped'
+    )
+    batch_parser.add_argument(
+        '--timeout', '-t', type=float,
+        help='time limit (in seconds) for each submission'
+    )
+    batch_parser.set_defaults(func=command_batch)
+
+    # ejudge serve
+    serve_parser = subparsers.add_parser(
+        'serve',
+        help='start a server that executes jobs sent by clients'
+    )
+    serve_parser.add_argument(
+        '--socket', '-s',
+        help='path of the Unix socket (default: %s)' % default_socket_path()
+    )
+    serve_parser.add_argument(
+        '--queue-depth', '-q', type=int, default=DEFAULT_QUEUE_DEPTH,
+        help='maximum number of pending jobs'
+    )
+    serve_parser.add_argument(
+        '--workers', '-j', type=int,
+        help='maximum number of jobs executed concurrently'
+    )
+    serve_parser.add_argument(
+        '--lang', '-l', action='append', default=[],
+        help='start worker pools for this language ahead of time (can be '
+             'given several times)'
+    )
+    serve_parser.add_argument(
+        '--sandbox', action='store_true',
+        help='execute jobs in the sandbox by default'
+    )
+    serve_parser.set_defaults(func=command_serve)
+
     return parser
 
 
+def add_connect_argument(parser):
+    """
+    Add the --connect option that sends the job to an ejudge server.
+    """
+
+    parser.add_argument(
+        '--connect', '-c', nargs='?', const=default_socket_path(),
+        metavar='SOCKET',
+        help='execute job in a server started by "ejudge serve"'
+    )
+
+
 def command_run(args):
     """
     Implements "ejudge run <source> <inputs>" command.
@@ -56,6 +133,8 @@ def command_run(args):
     if args.iospec:
         with open(args.iospec) as F:
             input_data = iospec.parse(F)
+    elif args.inputs and os.path.isdir(args.inputs):
+        input_data = InputDirectory(args.inputs)
     elif args.inputs:
         with open(args.inputs) as F:
             input_data = F.read()
@@ -63,13 +142,19 @@ def command_run(args):
             input_data = input_data[:-1]
         input_data = input_data.splitlines()
     else:
+        if args.connect:
+            raise SystemExit('error: --connect requires --inputs or --iospec')
         with open(args.file) as F:
             source = F.read()
         lang = ejudge.registry.language_from_filename(args.file)
         ejudge.exec(source, lang=lang)
         return
 
-    result = ejudge.run(source, input_data, lang=lang)
+    if args.connect:
+        with Client(args.connect) as client:
+            result = client.run(source, input_data, lang=lang)
+    else:
+        result = ejudge.run(source, input_data, lang=lang)
     print(result.source())
 
 
@@ -80,10 +165,155 @@ def command_grade(args):
 
     source, lang = get_source_and_lang(args.file)
     input_data = iospec.parse(args.inputs)
-    feedback = ejudge.grade(source, input_data, lang=lang)
+    if args.connect:
+        with Client(args.connect) as client:
+            feedback = client.grade(source, input_data, lang=lang)
+    else:
+        feedback = ejudge.grade(source, input_data, lang=lang)
     print(feedback.render_text())
 
 
+def command_serve(args):
+    """
+    Implements "ejudge serve" command.
+    """
+
+    logging.basicConfig(level=logging.INFO)
+    serve(args.socket, queue_depth=args.queue_depth, workers=args.workers,
+          langs=args.lang, sandbox=args.sandbox)
+
+
+def command_batch(args):
+    """
+    Implements "ejudge batch <iospec> <dir-or-glob> ..." command.
+
+    Writes one JSON object per line for each submission.
+    """
+
+    with open(args.iospec) as F:
+        answer_key = iospec.parse(F)
+
+    done = set()
+    if args.output:
+        done = load_graded_submissions(args.output)
+
+    submissions = []
+    errors = []
+    for path in find_submissions(args.submissions):
+        if path in done:
+            continue
+        try:
+            lang = ejudge.registry.language_from_filename(path)
+        except ValueError:
+            print('skipping %s: unknown language' % path, file=sys.stderr)
+            continue
+        try:
+            with open(path) as F:
+                submissions.append((path, F.read(), lang))
+        except UnicodeDecodeError as ex:
+            errors.append(batch_error_record(path, lang, 'encoding', ex))
+
+    output = open(args.output, 'a') if args.output else sys.stdout
+    try:
+        for data in errors:
+            output.write(json.dumps(data) + '\n')
+        output.flush()
+        langs = {path: lang for path, _, lang in submissions}
+        graded = ejudge.grade_many(submissions, answer_key, workers=args.jobs,
+                                   timeout=args.timeout, results=True)
+        for path, feedback, result in graded:
+            data = batch_record(path, langs[path], feedback, result)
+            output.write(json.dumps(data) + '\n')
+            output.flush()
+    finally:
+        if output is not sys.stdout:
+            output.close()
+
+
+def batch_record(path, lang, feedback, result):
+    """
+    Return a JSON-like dictionary with the results of a single submission.
+    """
+
+    testcase = feedback.testcase
+    data = {
+        'submission': path,
+        'lang': lang,
+        'status': feedback.status,
+        'grade': float(feedback.grade),
+        'error_type': getattr(testcase, 'error_type', None),
+        'error_kind': testcase.meta.get('error_kind'),
+    }
+    for key in USAGE_META:
+        data[key] = result.meta.get(key)
+    return data
+
+
+def batch_error_record(path, lang, error_kind, error):
+    """
+    Return a JSON-like dictionary for a submission that could not be graded
+    (e.g., a source file that is not valid UTF-8).
+    """
+
+    data = {
+        'submission': path,
+        'lang': lang,
+        'status': 'build-error',
+        'grade': 0.0,
+        'error_type': 'build',
+        'error_kind': error_kind,
+        'error_message': str(error),
+    }
+    for key in USAGE_META:
+        data[key] = None
+    return data
+
+
+def find_submissions(patterns):
+    """
+    Return a list of files from a list of directories or glob patterns.
+    """
+
+    paths = []
+    for pattern in patterns:
+        if os.path.isdir(pattern):
+            for root, dirs, files in os.walk(pattern):
+                dirs.sort()
+                paths.extend(os.path.join(root, f) for f in sorted(files))
+        else:
+            paths.extend(sorted(glob.glob(pattern, recursive=True)))
+    paths = [path for path in paths if os.path.isfile(path)]
+    return list(dict.fromkeys(paths))
+
+
+def load_graded_submissions(path):
+    """
+    Return the set of submissions already recorded in a JSON lines file.
+
+    A truncated last line (e.g., from an interrupted run) is removed from the
+    file.
+    """
+
+    try:
+        F = open(path, 'rb+')
+    except FileNotFoundError:
+        return set()
+
+    with F:
+        data = F.read()
+        if data and not data.endswith(b'\n'):
+            data = data[:data.rfind(b'\n') + 1]
+            F.truncate(len(data))
+
+    graded = set()
+    for line in data.decode('utf8').splitlines():
+        try:
+            graded.add(json.loads(line)['submission'])
+        except (ValueError, KeyError, TypeError):
+            pass
+    return graded
+
+
 def get_source_and_lang(path):
     """
     Return a tuple with (source, lang) for the given input file path.
@@ -0,0 +1,416 @@
+"""
+Asyncio interface to ejudge.
+
+The :func:`run` and :func:`grade` coroutines accept the same arguments as their
+blocking counterparts in :mod:`ejudge.functions`, but never block the event
+loop:
+
+* builds run in the default executor of the event loop;
+* external programs are driven by non-blocking pipes (see
+  :meth:`ejudge.execution_manager.ExecutionManager.run_async`);
+* integrated languages execute each test case in a process forked from a
+  zygote (see :mod:`ejudge.zygote`), which is awaited from a worker thread;
+* sandboxed runs are dispatched to the sandbox pool from a worker thread.
+
+:func:`iter_run` and :func:`iter_grade` are async iterators that yield each
+test case (or its feedback) as soon as it finishes.
+
+The number of programs executed concurrently by each event loop is limited by
+:func:`set_concurrency_limit`. Cancelling a task kills all running test cases
+of the corresponding program.
+"""
+
+import asyncio
+import logging
+import os
+import time
+import weakref
+
+from ejudge import functions, registry
+from ejudge.exceptions import BuildError
+from ejudge.matching import get_feedback
+from ejudge.util import aggregate_usage_meta
+from iospec import parse as ioparse, ErrorTestCase, IoSpec, TestCase
+
+logger = logging.getLogger('ejudge')
+
+inf = float('inf')
+
+#: Default maximum number of programs executed concurrently.
+DEFAULT_CONCURRENCY_LIMIT = 4 * (os.cpu_count() or 1)
+
+_concurrency_limit = DEFAULT_CONCURRENCY_LIMIT
+_semaphores = weakref.WeakKeyDictionary()
+
+
+def set_concurrency_limit(limit):
+    """
+    Set the maximum number of calls to :func:`run` or :func:`grade` that
+    execute concurrently in each event loop. Other calls wait for a free slot.
+    """
+
+    global _concurrency_limit
+
+    if limit < 1:
+        raise ValueError('limit must be positive, got: %s' % limit)
+    _concurrency_limit = limit
+    _semaphores.clear()
+
+
+def get_concurrency_limit():
+    """
+    Return the maximum number of concurrent programs.
+    """
+
+    return _concurrency_limit
+
+
+def _semaphore():
+    loop = asyncio.get_event_loop()
+    try:
+        return _semaphores[loop]
+    except KeyError:
+        semaphore = _semaphores[loop] = asyncio.Semaphore(_concurrency_limit)
+        return semaphore
+
+
+async def run(source, inputs, lang=None, *,
+              fast=False, timeout=None, raises=False, path=None, sandbox=True,
+              compare_streams=False, fake_sandbox=False, debug=False,
+              workers=1, case_timeout=None, cpu_limit=None,
+              memory_limit=None, output_limit=None, cache=None, problem=None):
+    """
+    Coroutine version of :func:`ejudge.functions.run`.
+
+    Accepts the same arguments and returns the same :class:`iospec.IoSpec`
+    instance.
+    """
+
+    return await _run(
+        source, inputs, lang,
+        fast=fast, timeout=timeout, raises=raises, path=path, sandbox=sandbox,
+        compare_streams=compare_streams, fake_sandbox=fake_sandbox,
+        debug=debug, workers=workers, case_timeout=case_timeout,
+        cpu_limit=cpu_limit, memory_limit=memory_limit,
+        output_limit=output_limit, cache=cache, problem=problem,
+    )
+
+
+async def _run(source, inputs, lang, cache=None, problem=None, **kwargs):
+    if cache is not None:
+        return await _run_cached(cache, problem, source, inputs, lang,
+                                 **kwargs)
+
+    async with _semaphore():
+        if kwargs['sandbox']:
+            loop = asyncio.get_event_loop()
+            result, _ = await loop.run_in_executor(
+                None,
+                lambda: functions.run_worker(source, inputs, lang, **kwargs)
+            )
+            return result
+        return await _run_local(source, inputs, lang, **kwargs)
+
+
+async def _run_cached(cache, problem, source, inputs, lang, **kwargs):
+    # Coroutine version of functions.run_cached(). The cache is accessed from
+    # a worker thread since it may read and write files.
+    loop = asyncio.get_event_loop()
+    key, source, inputs, lang, result = await loop.run_in_executor(
+        None, functions.cache_lookup, cache, problem, source, inputs, lang,
+        kwargs
+    )
+    if result is not None:
+        return result
+
+    result = await _run(source, inputs, lang, **kwargs)
+    await loop.run_in_executor(None, cache.put, key, result, problem)
+    return result
+
+
+async def _run_local(source, inputs, lang, *, fast, timeout, raises, path,
+                     compare_streams, workers, case_timeout=None,
+                     cpu_limit=None, memory_limit=None, output_limit=None,
+                     answer_key=None, early_abort=True, **kwargs):
+    inputs = functions.normalize_inputs(inputs)
+    functions.validate_limits(timeout, case_timeout, cpu_limit, memory_limit,
+                              output_limit)
+    if workers < 1:
+        raise ValueError('workers must be positive, got: %s' % workers)
+
+    try:
+        build_manager = await _build(lang, source, path, compare_streams)
+    except BuildError as ex:
+        if raises:
+            raise
+        return IoSpec([ErrorTestCase.build(error_message=str(ex))])
+
+    with build_manager:
+        data = await run_test_cases(build_manager, inputs, timeout=timeout,
+                                    fast=fast, workers=workers,
+                                    answer_key=answer_key,
+                                    early_abort=early_abort,
+                                    case_timeout=case_timeout,
+                                    cpu_limit=cpu_limit,
+                                    memory_limit=memory_limit,
+                                    output_limit=output_limit)
+
+    build_manager.log('info', 'executed all %s testcases in %s sec' %
+                      (len(data), build_manager.execution_duration))
+    result = IoSpec(data)
+    result.set_meta('lang', build_manager.language)
+    aggregate_usage_meta(result)
+    return result
+
+
+async def _build(lang, source, path, compare_streams):
+    # Return a built build manager. The build runs in a worker thread that
+    # cannot be interrupted. If we are cancelled, we only close the build
+    # manager after the thread finishes.
+    build_manager = registry.build_manager_from_path(
+        lang, source, path,
+        is_sandboxed=False,
+        compare_streams=compare_streams,
+    )
+    loop = asyncio.get_event_loop()
+    build = loop.run_in_executor(None, build_manager.build)
+    try:
+        await asyncio.shield(build)
+    except asyncio.CancelledError:
+        build.add_done_callback(lambda _: build_manager.close())
+        raise
+    except BuildError:
+        build_manager.close()
+        raise
+    return build_manager
+
+
+def iter_run(source, inputs, lang=None, *,
+             fast=False, timeout=None, raises=False, path=None, sandbox=True,
+             compare_streams=False, fake_sandbox=False, debug=False,
+             workers=1, case_timeout=None, cpu_limit=None, memory_limit=None,
+             output_limit=None):
+    """
+    Async iterator version of :func:`ejudge.functions.iter_run`.
+
+    Yields each :class:`iospec.TestCase` as soon as it finishes.
+    """
+
+    return _iter_run(
+        source, inputs, lang,
+        fast=fast, timeout=timeout, raises=raises, path=path, sandbox=sandbox,
+        compare_streams=compare_streams, fake_sandbox=fake_sandbox,
+        debug=debug, workers=workers, case_timeout=case_timeout,
+        cpu_limit=cpu_limit, memory_limit=memory_limit,
+        output_limit=output_limit,
+    )
+
+
+async def _iter_run(source, inputs, lang, **kwargs):
+    async with _semaphore():
+        if kwargs['sandbox']:
+            stream = functions.iter_run_worker(source, inputs, lang, **kwargs)
+            async for case in _iter_in_executor(stream):
+                yield case
+            return
+
+        inputs = functions.normalize_inputs(inputs)
+        functions.validate_limits(kwargs['timeout'], kwargs['case_timeout'],
+                                  kwargs['cpu_limit'], kwargs['memory_limit'],
+                                  kwargs['output_limit'])
+        if kwargs['workers'] < 1:
+            raise ValueError('workers must be positive, got: %s'
+                             % kwargs['workers'])
+        try:
+            build_manager = await _build(lang, source, kwargs['path'],
+                                         kwargs['compare_streams'])
+        except BuildError as ex:
+            if kwargs['raises']:
+                raise
+            yield ErrorTestCase.build(error_message=str(ex))
+            return
+
+        with build_manager:
+            stream = iter_test_cases(
+                build_manager, inputs,
+                timeout=kwargs['timeout'], fast=kwargs['fast'],
+                workers=kwargs['workers'],
+                answer_key=kwargs.get('answer_key'),
+                early_abort=kwargs.get('early_abort', True),
+                case_timeout=kwargs['case_timeout'],
+                cpu_limit=kwargs['cpu_limit'],
+                memory_limit=kwargs['memory_limit'],
+                output_limit=kwargs['output_limit'],
+            )
+            try:
+                async for case in stream:
+                    yield case
+            finally:
+                await stream.aclose()
+
+
+async def _iter_in_executor(iterator):
+    # Consume a blocking iterator from worker threads. If we are cancelled
+    # while the iterator is running, it is closed as soon as it returns.
+    loop = asyncio.get_event_loop()
+    future = None
+    try:
+        while True:
+            future = loop.run_in_executor(None, next, iterator, None)
+            item = await asyncio.shield(future)
+            if item is None:
+                break
+            yield item
+    finally:
+        if future is not None and not future.done():
+            future.add_done_callback(lambda _: iterator.close())
+        else:
+            iterator.close()
+
+
+async def run_test_cases(build_manager, inputs, timeout=None, fast=False,
+                         workers=1, answer_key=None, case_timeout=None,
+                         cpu_limit=None, memory_limit=None, output_limit=None,
+                         early_abort=True):
+    """
+    Coroutine version of :func:`ejudge.functions.run_test_cases`.
+    """
+
+    return [case async for case in iter_test_cases(
+        build_manager, inputs, timeout=timeout, fast=fast, workers=workers,
+        answer_key=answer_key, case_timeout=case_timeout, cpu_limit=cpu_limit,
+        memory_limit=memory_limit, output_limit=output_limit,
+        early_abort=early_abort,
+    )]
+
+
+async def iter_test_cases(build_manager, inputs, timeout=None, fast=False,
+                          workers=1, answer_key=None, case_timeout=None,
+                          cpu_limit=None, memory_limit=None,
+                          output_limit=None, early_abort=True):
+    """
+    Async iterator version of :func:`ejudge.functions.iter_test_cases`.
+    """
+
+    managers = functions.iter_execution_managers(
+        build_manager, inputs, answer_key,
+        cpu_limit=cpu_limit, memory_limit=memory_limit,
+        output_limit=output_limit, early_abort=early_abort,
+    )
+    semaphore = asyncio.Semaphore(workers)
+    deadline = None if timeout is None else time.monotonic() + timeout
+
+    async def run_case(ctrl):
+        async with semaphore:
+            case_timeout_ = case_timeout
+            if deadline is not None:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return ErrorTestCase.timeout()
+                case_timeout_ = min(case_timeout or remaining, remaining)
+            return await ctrl.run_async(case_timeout_)
+
+    # Execution managers are created lazily and at most window test cases are
+    # scheduled or waiting to be yielded at any time.
+    window = 2 * workers
+    indexes = {}
+    results = {}
+    stop = inf
+    next_idx = submitted = 0
+    pending = set()
+    try:
+        while True:
+            while submitted - next_idx < window and submitted <= stop:
+                ctrl = next(managers, None)
+                if ctrl is None:
+                    break
+                task = asyncio.ensure_future(run_case(ctrl))
+                indexes[task] = submitted
+                pending.add(task)
+                submitted += 1
+            if not pending:
+                break
+
+            done, pending = await asyncio.wait(
+                pending, return_when=asyncio.FIRST_COMPLETED
+            )
+            for task in done:
+                idx = indexes.pop(task)
+                if task.cancelled():
+                    continue
+                result = results[idx] = task.result()
+                assert isinstance(result, TestCase)
+
+                # In fast mode, we cancel all test cases after the first error
+                if fast and result.is_error_test_case and idx < stop:
+                    stop = idx
+                    for other in pending:
+                        if indexes[other] > idx:
+                            other.cancel()
+            while next_idx in results and next_idx <= stop:
+                yield results.pop(next_idx)
+                next_idx += 1
+            if next_idx > stop:
+                break
+    finally:
+        for task in pending:
+            task.cancel()
+
+
+async def grade(source, iospec, lang=None, *,
+                fast=True, path=None, raises=False, sandbox=False,
+                timeout=None, compare_streams=False, workers=1,
+                early_abort=False, case_timeout=None, cpu_limit=None,
+                memory_limit=None, output_limit=None, cache=None,
+                problem=None):
+    """
+    Coroutine version of :func:`ejudge.functions.grade`.
+
+    Accepts the same arguments and returns the same :class:`ejudge.Feedback`
+    instance.
+    """
+
+    if isinstance(iospec, str):
+        iospec = ioparse(iospec)
+    result = await _run(
+        source, iospec, lang,
+        fast=fast, path=path, raises=raises, sandbox=sandbox, timeout=timeout,
+        compare_streams=compare_streams, workers=workers,
+        case_timeout=case_timeout, cpu_limit=cpu_limit,
+        memory_limit=memory_limit, output_limit=output_limit,
+        answer_key=iospec if early_abort or compare_streams else None,
+        early_abort=early_abort, cache=cache, problem=problem,
+    )
+    return get_feedback(result, iospec, stream=compare_streams)
+
+
+async def iter_grade(source, iospec, lang=None, *,
+                     fast=True, path=None, raises=False, sandbox=False,
+                     timeout=None, compare_streams=False, workers=1,
+                     early_abort=False, case_timeout=None, cpu_limit=None,
+                     memory_limit=None, output_limit=None):
+    """
+    Async iterator version of :func:`ejudge.functions.iter_grade`.
+
+    Yields the :class:`ejudge.Feedback` of each test case as soon as it
+    finishes.
+    """
+
+    if isinstance(iospec, str):
+        iospec = ioparse(iospec)
+    stream = _iter_run(
+        source, iospec, lang,
+        fast=fast, path=path, raises=raises, sandbox=sandbox, timeout=timeout,
+        compare_streams=compare_streams, workers=workers,
+        case_timeout=case_timeout, cpu_limit=cpu_limit,
+        memory_limit=memory_limit, output_limit=output_limit,
+        answer_key=iospec if early_abort or compare_streams else None,
+        early_abort=early_abort,
+    )
+    answer_keys = iter(iospec)
+    try:
+        async for case in stream:
+            answer_key = next(answer_keys)
+            yield get_feedback(case, answer_key, stream=compare_streams)
+    finally:
+        await stream.aclose()
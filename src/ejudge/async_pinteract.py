@@ -0,0 +1,241 @@
+"""
+Asyncio counterparts of :class:`ejudge.pinteract.Pinteract` and
+:class:`ejudge.pinteract.Process`.
+
+The child process is attached to a pseudo-terminal, just like Pinteract does,
+so programs keep their interactive (line buffered) behavior. The master side
+of the terminal is a non-blocking file descriptor watched by the event loop,
+hence a single thread can drive many interactions at once.
+
+Child processes are reaped with os.wait4() instead of relying on the asyncio
+child watchers, so their resource usage is available after they finish.
+"""
+
+import asyncio
+import os
+import time
+
+from ejudge.pinteract import BasePinteract, BaseProcess
+from ejudge.util import OutputBuffer
+
+
+class AsyncPinteract(BasePinteract):
+    """
+    Interact with a child process from asyncio code.
+
+    Instances must be started with ``await AsyncPinteract.spawn(...)``. It
+    has the same interface as :class:`ejudge.pinteract.Pinteract`, but
+    receive(), send() and finish() are coroutines. See
+    :class:`ejudge.pinteract.BasePinteract` for the accepted arguments.
+    """
+
+    def __init__(self, command, **kwargs):
+        super().__init__(command, **kwargs)
+        self._event = asyncio.Event()
+
+    @classmethod
+    async def spawn(cls, command, **kwargs):
+        """
+        Create a new instance and start the child process.
+        """
+
+        new = cls(command, **kwargs)
+        await new.start()
+        return new
+
+    async def start(self):
+        """
+        Start child process.
+        """
+
+        self._spawn(AsyncProcess)
+        asyncio.get_event_loop().add_reader(self._master, self._on_readable)
+
+    def _on_readable(self):
+        if not self._read_output():
+            return
+        if self._eof:
+            asyncio.get_event_loop().remove_reader(self._master)
+        self._event.set()
+
+    async def burn(self, duration):
+        """
+        Wait at most the given time (in seconds) for the process to leave the
+        "running" status.
+        """
+
+        end = time.monotonic() + max(min(duration, self.remaining_time()), 0)
+        while time.monotonic() < end and not self._eof:
+            status = self.status()
+            if status in ['running', 'disk-sleep']:
+                await asyncio.sleep(0.005)
+            elif status in ['sleeping', 'zombie', 'dead']:
+                break
+            else:
+                raise RuntimeError('status: %s' % status)
+
+    async def receive(self):
+        """
+        Read the output of the child process.
+        """
+
+        if not self._is_burnt:
+            self._is_burnt = True
+            await self.burn(1 if self.timeout is None else self.timeout)
+
+        while not self._eof:
+            if self.remaining_time() < 0:
+                raise TimeoutError
+            self._event.clear()
+            try:
+                await asyncio.wait_for(self._event.wait(), self.poll_interval)
+            except asyncio.TimeoutError:
+                status = self.status()
+                if status == 'running' and self.remaining_time() <= 0:
+                    raise TimeoutError
+                elif status == 'running' and self.wait_running:
+                    continue
+                break
+
+        return self._take_output()
+
+    async def send(self, data, end='\n'):
+        """
+        Write some input string of data to the child process.
+        """
+
+        if self.is_dead():
+            raise RuntimeError('trying to send message to a closed process')
+
+        try:
+            await write_all(self._master, (data + end).encode(self.encoding))
+        except OSError:
+            raise RuntimeError('trying to send message to a closed process')
+
+    async def finish(self):
+        """
+        Finish process execution and return any unread output.
+        """
+
+        try:
+            return await self.receive()
+        finally:
+            await self.close()
+
+    async def close(self):
+        """
+        Kill child process and release the terminal.
+        """
+
+        if self.process is None:
+            return
+        self.process.kill()
+        await self.process.wait()
+        if self._master is not None:
+            asyncio.get_event_loop().remove_reader(self._master)
+            os.close(self._master)
+            self._master = None
+
+
+class AsyncProcess(BaseProcess):
+    """
+    A child process that is awaited and reaped by the event loop.
+
+    The constructor accepts the same arguments as :class:`subprocess.Popen`
+    and must be called with a running event loop. See
+    :class:`ejudge.pinteract.BaseProcess` for the attributes set after the
+    process finishes.
+    """
+
+    def __init__(self, args, **kwargs):
+        super().__init__(args, **kwargs)
+        self._exited = asyncio.Event()
+        self._pidfd = None
+        self._poller = None
+        try:
+            self._pidfd = os.pidfd_open(self.pid)
+        except (AttributeError, OSError):
+            self._poller = asyncio.ensure_future(self._poll())
+        else:
+            asyncio.get_event_loop().add_reader(self._pidfd, self._reap)
+
+    def _reap(self, flags=0):
+        if not super()._reap(flags):
+            return False
+        if self._pidfd is not None:
+            asyncio.get_event_loop().remove_reader(self._pidfd)
+            os.close(self._pidfd)
+            self._pidfd = None
+        self._exited.set()
+        return True
+
+    async def _poll(self):
+        while not self._reap(os.WNOHANG):
+            await asyncio.sleep(self.poll_interval)
+
+    async def wait(self):
+        """
+        Wait for the process to finish and return its exit status.
+        """
+
+        await self._exited.wait()
+        return self.returncode
+
+    async def communicate(self, data=b'', limit=None, sink=None, keep=4096):
+        """
+        Coroutine version of :meth:`ejudge.pinteract.Process.communicate`.
+
+        It does not accept a timeout: use asyncio.wait_for() instead.
+        """
+
+        loop = asyncio.get_event_loop()
+        out_fd = self.popen.stdout.fileno()
+        os.set_blocking(out_fd, False)
+        buffer = OutputBuffer(keep, b'')
+        eof = loop.create_future()
+
+        def on_readable():
+            if not self._read_output(out_fd, buffer, limit, sink):
+                loop.remove_reader(out_fd)
+                if not eof.done():
+                    eof.set_result(None)
+
+        loop.add_reader(out_fd, on_readable)
+        stdin = self.popen.stdin
+        try:
+            if stdin is not None:
+                try:
+                    await write_all(stdin.fileno(), data)
+                except OSError:
+                    pass  # the program stopped reading its input
+                stdin.close()
+            await eof
+        finally:
+            loop.remove_reader(out_fd)
+            self.popen.stdout.close()
+            if stdin is not None and not stdin.closed:
+                stdin.close()
+        await self.wait()
+        self.output_omitted = buffer.omitted
+        return buffer.take()
+
+
+async def write_all(fd, data):
+    """
+    Write all bytes to the given file descriptor, waiting for it to become
+    writable when necessary.
+    """
+
+    view = memoryview(data)
+    loop = asyncio.get_event_loop()
+    os.set_blocking(fd, False)
+    while view:
+        try:
+            view = view[os.write(fd, view):]
+        except BlockingIOError:
+            writable = loop.create_future()
+            loop.add_writer(fd, writable.set_result, None)
+            try:
+                await writable
+            finally:
+                loop.remove_writer(fd)
@@ -0,0 +1,260 @@
+"""
+On-disk caches for build artifacts.
+
+Compiling the same source with the same compiler and flags always produces an
+equivalent executable. The :class:`ExecutableCache` stores executables keyed by
+a hash of all these ingredients so repeated submissions (re-gradings,
+resubmissions or the same code graded against several problem variants) skip
+the compiler altogether.
+"""
+
+import hashlib
+import logging
+import os
+import shutil
+import subprocess
+import tempfile
+import threading
+
+logger = logging.getLogger('ejudge')
+
+#: Default maximum size (in bytes) of the executable cache.
+DEFAULT_MAX_SIZE = 256 * 1024 * 1024
+
+#: Prefix of temporary files of entries that are still being written.
+TEMP_PREFIX = '.tmp-'
+
+#: Permissions of cached executables. Entries are hard linked into build
+#: directories, so they must be readable and executable by everyone (including
+#: the sandbox user) and must never be changed afterwards.
+ENTRY_MODE = 0o555
+
+_compiler_identities = {}
+
+
+def default_cache_path(*parts):
+    """
+    Return the root of ejudge's on-disk caches.
+
+    The location is controlled by the $EJUDGE_CACHE_DIR environment variable
+    and defaults to ~/.cache/ejudge. Extra arguments are joined to the
+    resulting path.
+    """
+
+    root = os.environ.get('EJUDGE_CACHE_DIR')
+    if not root:
+        root = os.path.join(os.path.expanduser('~'), '.cache', 'ejudge')
+    return os.path.join(root, *parts)
+
+
+def compiler_identity(compiler):
+    """
+    Return a string that uniquely identifies the given compiler executable.
+
+    The identity is composed by the resolved path of the executable and the
+    output of ``compiler --version``. Results are memoized for the lifetime of
+    the process.
+    """
+
+    try:
+        return _compiler_identities[compiler]
+    except KeyError:
+        pass
+
+    path = shutil.which(compiler) or compiler
+    try:
+        path = os.path.realpath(path)
+        mtime = os.path.getmtime(path)
+    except OSError:
+        mtime = None
+
+    try:
+        version = subprocess.check_output(
+            [path, '--version'],
+            stderr=subprocess.STDOUT,
+            timeout=10,
+        )
+    except subprocess.CalledProcessError as ex:
+        # Some compilers such as tcc do not understand --version but still
+        # print something useful
+        version = ex.output
+    except (OSError, subprocess.TimeoutExpired):
+        version = b''
+
+    version = version.decode('utf8', 'replace').strip()
+    identity = '%s (%s)\n%s' % (path, mtime, version)
+    _compiler_identities[compiler] = identity
+    return identity
+
+
+class ExecutableCache:
+    """
+    A content-addressed on-disk cache of compiled executables.
+
+    Entries are keyed by a hash of the source code, the list of build arguments
+    and the identity of the compiler. Least recently used entries are evicted
+    when the total size of the cache exceeds ``max_size`` bytes.
+
+    Args:
+        path (str):
+            Directory in which executables are stored. Defaults to the
+            "executables" folder inside :func:`default_cache_path`.
+        max_size (int):
+            Maximum size of the cache, in bytes.
+    """
+
+    def __init__(self, path=None, max_size=DEFAULT_MAX_SIZE):
+        self.path = path or default_cache_path('executables')
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._disk_size = None
+        self._lock = threading.Lock()
+
+    def __repr__(self):
+        return '<ExecutableCache %r (hits=%s, misses=%s)>' % (
+            self.path, self.hits, self.misses
+        )
+
+    def key(self, source, build_args, compiler=None):
+        """
+        Return the cache key for the given source and build arguments.
+
+        The compiler defaults to the first element of build_args.
+        """
+
+        compiler = compiler or build_args[0]
+        data = '\0'.join([
+            compiler_identity(compiler),
+            '\0'.join(build_args),
+            source,
+        ])
+        return hashlib.sha256(data.encode('utf8')).hexdigest()
+
+    def entry_path(self, key):
+        """
+        Return the path to the cache entry for the given key.
+        """
+
+        return os.path.join(self.path, key[:2], key)
+
+    def get(self, key, dest):
+        """
+        Copy the executable for the given key to the dest path.
+
+        Return True in case of a cache hit, and False otherwise. Whenever
+        possible, the file is hard linked instead of copied. In both cases,
+        dest has the permissions given by :data:`ENTRY_MODE` and must not be
+        modified since it may share its inode with the cache entry.
+        """
+
+        entry = self.entry_path(key)
+        try:
+            try:
+                os.link(entry, dest)
+            except OSError:
+                if not os.path.exists(entry):
+                    raise FileNotFoundError(entry)
+                shutil.copy2(entry, dest)
+            os.utime(entry)
+        except FileNotFoundError:
+            with self._lock:
+                self.misses += 1
+            return False
+
+        with self._lock:
+            self.hits += 1
+        return True
+
+    def put(self, key, src):
+        """
+        Store a copy of the executable at src under the given key.
+        """
+
+        entry = self.entry_path(key)
+        os.makedirs(os.path.dirname(entry), exist_ok=True)
+
+        # Copy to a temporary file first and move it to its final location so
+        # concurrent readers never see a partially written executable.
+        fd, tmp_path = tempfile.mkstemp(prefix=TEMP_PREFIX,
+                                        dir=os.path.dirname(entry))
+        os.close(fd)
+        try:
+            shutil.copy2(src, tmp_path)
+            os.chmod(tmp_path, ENTRY_MODE)
+            size = os.path.getsize(tmp_path)
+            try:
+                size -= os.path.getsize(entry)
+            except FileNotFoundError:
+                pass
+            os.replace(tmp_path, entry)
+        except OSError:
+            if os.path.exists(tmp_path):
+                os.unlink(tmp_path)
+            raise
+
+        # The size of the cache is only computed from the disk when it is
+        # unknown or when it may exceed max_size.
+        with self._lock:
+            if self._disk_size is not None:
+                self._disk_size += size
+            must_evict = (self._disk_size is None or
+                          self._disk_size > self.max_size)
+        if must_evict:
+            self.evict()
+
+    def evict(self):
+        """
+        Remove the least recently used entries until the cache fits in
+        max_size.
+        """
+
+        entries = []
+        total = 0
+        for dirpath, _, filenames in os.walk(self.path):
+            for name in filenames:
+                # Temporary files belong to concurrent writers
+                if name.startswith(TEMP_PREFIX):
+                    continue
+                path = os.path.join(dirpath, name)
+                try:
+                    st = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                entries.append((st.st_mtime, st.st_size, path))
+                total += st.st_size
+
+        entries.sort()
+        for _, size, path in entries:
+            if total <= self.max_size:
+                break
+            try:
+                os.unlink(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+
+        with self._lock:
+            self._disk_size = total
+
+    def clear(self):
+        """
+        Remove all entries from the cache and reset statistics.
+        """
+
+        shutil.rmtree(self.path, ignore_errors=True)
+        with self._lock:
+            self._disk_size = None
+            self.hits = self.misses = 0
+
+    def stats(self):
+        """
+        Return a dictionary with the number of cache hits and misses.
+        """
+
+        total = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_ratio': self.hits / total if total else 0.0,
+        }
@@ -1,10 +1,11 @@
 import logging
+import marshal
 import os
 import stat
 import subprocess
-import tempfile
 import time
 
+from ejudge.build_pool import get_build_pool
 from ejudge.exceptions import BuildError
 
 logger = logging.getLogger('ejudge')
@@ -13,8 +14,13 @@ logger = logging.getLogger('ejudge')
 class BuildManager:
     """
     Stores information about a program build.
+
+    Subclasses that set single_pass_build = True skip the separate
+    syntax_check() step and must detect syntax errors during the build itself.
     """
 
+    single_pass_build = False
+
     @classmethod
     def from_json(cls, json):
         return cls(**json)
@@ -56,12 +62,21 @@ class BuildManager:
         """
 
         self.__t0 = time.time()
+        if self.single_pass_build:
+            return
         try:
             self.syntax_check()
         except SyntaxError as ex:
-            self.log('debug', '%s: invalid syntax!' % self.__class__.__name__)
-            msg = str(ex)
-            raise BuildError(msg)
+            self.raise_syntax_error(ex)
+
+    def raise_syntax_error(self, ex):
+        """
+        Raise a BuildError from the given SyntaxError instance.
+        """
+
+        self.log('debug', '%s: invalid syntax!' % self.__class__.__name__)
+        msg = str(ex)
+        raise BuildError(msg) from ex
 
     def _build_end(self, _log=True):
         """
@@ -80,6 +95,12 @@ class BuildManager:
 
         self.is_closed = True
 
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
     def to_json(self):
         """
         A JSON compatible representation of object.
@@ -110,17 +131,40 @@ class IntegratedBuildManager(BuildManager):
 
     These languages can provide a locals and a globals dictionary for passing
     symbols to be used during execution.
+
+    Subclasses may store a compiled code object in the code attribute during
+    the build. Execution managers reuse it for all test cases instead of
+    compiling the source again.
     """
 
+    code = None
+
     def __init__(self, source, locals=None, globals=None, **kwargs):
         super().__init__(source, **kwargs)
         self.locals = locals
         self.globals = globals
 
+    def __getstate__(self):
+        # Code objects cannot be pickled, but can be marshalled
+        state = self.__dict__.copy()
+        if state.get('code') is not None:
+            state['code'] = marshal.dumps(state['code'])
+        return state
+
+    def __setstate__(self, state):
+        if isinstance(state.get('code'), bytes):
+            state['code'] = marshal.loads(state['code'])
+        self.__dict__.update(state)
+
     def build(self, _log=True):
         self._build_start(_log)
         self._build_end(_log)
 
+    def to_json(self):
+        json = super().to_json()
+        json.pop('code', None)
+        return json
+
 
 class ExternalProgramBuildManager(BuildManager):
     """
@@ -130,7 +174,9 @@ class ExternalProgramBuildManager(BuildManager):
     """
 
     build_path = None
+    build_pool = None
     source_extension = None
+    _pooled_build_path = None
 
     def build(self, _log=True):
         self._build_start(_log)
@@ -145,23 +191,27 @@ class ExternalProgramBuildManager(BuildManager):
     def build_tempdir(self):
         """
         Creates a temporary directory for storing files.
-        """
 
-        # Make tmp directory readable and writable by everyone, if in sandboxed
-        # mode.
-        temp_dir = tempfile.mkdtemp()
-        if self.is_sandboxed:
-            os.chmod(
-                temp_dir,
-                stat.S_IEXEC | stat.S_IREAD | stat.S_IWRITE |
-                stat.S_IXOTH | stat.S_IROTH | stat.S_IWOTH |
-                stat.S_IXGRP | stat.S_IRGRP | stat.S_IWGRP
-            )
+        Directories are obtained from the build_pool attribute or from the
+        default :class:`ejudge.build_pool.BuildDirPool` and are given back to
+        the pool when the manager is closed. In sandboxed mode, the directory
+        is readable and writable by everyone.
+        """
 
+        pool = self.build_pool or get_build_pool()
+        temp_dir = pool.acquire(sandboxed=self.is_sandboxed)
+        self._pooled_build_path = temp_dir
         self.build_path = temp_dir
         self.log('debug', 'temporary build path at %r' % temp_dir)
         return temp_dir
 
+    def close(self):
+        if self._pooled_build_path is not None:
+            pool = self.build_pool or get_build_pool()
+            pool.release(self._pooled_build_path)
+            self._pooled_build_path = None
+        super().close()
+
     def write(self, path, data):
         """
         Write contents of the "data" string into the absolute "path".
@@ -231,23 +281,37 @@ class ExternalProgramBuildManager(BuildManager):
 class CompiledLanguageBuildManager(ExternalProgramBuildManager):
     """
     Basic support for languages that require a separate compiling step.
+
+    If the executable_cache attribute is set to an
+    :class:`ejudge.build_cache.ExecutableCache` instance, executables are
+    fetched from the cache instead of being rebuilt when the same source is
+    compiled with the same compiler and arguments.
     """
 
     build_args = None
     executable_name = 'main.exe'
+    executable_cache = None
 
     def _build_run(self):
         super()._build_run()
         self.compile_files()
 
     def compile_files(self):
-        self.log('info', 'building: %s' % ' '.join(self.build_args))
+        executable_name = os.path.join(self.build_path, self.executable_name)
+        cache = self.executable_cache
+        if cache is not None:
+            key = cache.key(self.source, self.get_cache_args())
+            # Cached executables are already executable by everyone and may
+            # be hard linked, hence we must not change their permissions.
+            if cache.get(key, executable_name):
+                self.log('info', 'executable fetched from cache (%s)' % key)
+                return
+
+        build_args = self.get_build_args()
+        self.log('info', 'building: %s' % ' '.join(build_args))
         try:
             source_name = self.get_source_filename(absolute=True)
-            executable_name = os.path.join(self.build_path,
-                                           self.executable_name)
             assert os.path.exists(source_name)
-            build_args = self.get_build_args()
             env = os.environ.get
             subprocess.check_output(
                 build_args,
@@ -261,22 +325,50 @@ class CompiledLanguageBuildManager(ExternalProgramBuildManager):
                 },
             )
 
-            # Make executable readable and executable by everyone in sandbox
-            # mode so the `nobody` can execute this file
-            if self.is_sandboxed:
-                os.chmod(
-                    executable_name,
-                    stat.S_IREAD | stat.S_IROTH | stat.S_IRGRP |
-                    stat.S_IEXEC | stat.S_IXOTH | stat.S_IXGRP
-                )
+            self.set_executable_permissions(executable_name)
         except TimeoutError:
             error_msg = 'compilation is taking too long'
             raise BuildError(error_msg)
         except subprocess.CalledProcessError as ex:
             error_msg = ex.output.decode('utf8')
-            raise BuildError(error_msg)
+            error = self.classify_build_error(error_msg)
+            if isinstance(error, SyntaxError):
+                self.raise_syntax_error(error)
+            raise error
         self.log('debug', 'executable created at %r' % executable_name)
 
+        if cache is not None:
+            try:
+                cache.put(key, executable_name)
+            except OSError as ex:
+                self.log('warning', 'could not save executable to cache: %s'
+                         % ex)
+
+    def set_executable_permissions(self, path):
+        """
+        Make executable readable and executable by everyone in sandbox mode so
+        the `nobody` user can execute this file.
+        """
+
+        if self.is_sandboxed:
+            os.chmod(
+                path,
+                stat.S_IREAD | stat.S_IROTH | stat.S_IRGRP |
+                stat.S_IEXEC | stat.S_IXOTH | stat.S_IXGRP
+            )
+
+    def classify_build_error(self, output):
+        """
+        Return an exception instance that describes a failed compilation from
+        the compiler output.
+
+        Returns a SyntaxError if the compiler rejected the source code or a
+        BuildError for any other failure (e.g., linking errors). The default
+        implementation always return a BuildError.
+        """
+
+        return BuildError(output)
+
     def get_build_args(self):
         """
         Return a list with the build args to be passed to the compiler process.
@@ -294,6 +386,17 @@ class CompiledLanguageBuildManager(ExternalProgramBuildManager):
 
         return list(self.build_args)
 
+    def get_cache_args(self):
+        """
+        Return the list of build args that identify the executable in the
+        executable cache.
+
+        Must be cheap to compute. The default implementation simply returns
+        the result of :meth:`get_build_args`.
+        """
+
+        return self.get_build_args()
+
 
 class InterpretedLanguageBuildManager(ExternalProgramBuildManager):
     """
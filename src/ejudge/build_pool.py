@@ -0,0 +1,301 @@
+"""
+A pool of reusable build directories.
+
+Each ExternalProgramBuildManager needs a private directory to store sources
+and executables. Creating (and later forgetting to remove) a fresh temporary
+directory for each build wastes syscalls and eventually exhausts the inodes of
+the temporary file system under sustained load. The :class:`BuildDirPool`
+recycles a small number of pre-created directories, preferably on a RAM-backed
+file system, and periodically removes directories orphaned by crashed
+processes.
+"""
+
+import atexit
+import logging
+import os
+import shutil
+import stat
+import tempfile
+import threading
+
+logger = logging.getLogger('ejudge')
+
+SANDBOX_DIR_MODE = (
+    stat.S_IEXEC | stat.S_IREAD | stat.S_IWRITE |
+    stat.S_IXOTH | stat.S_IROTH | stat.S_IWOTH |
+    stat.S_IXGRP | stat.S_IRGRP | stat.S_IWGRP
+)
+
+_default_pool = None
+
+
+def default_build_root():
+    """
+    Return the default root directory for build directories.
+
+    The location is controlled by the $EJUDGE_BUILD_ROOT environment variable.
+    If it is not set, it uses /dev/shm when available (a RAM-backed file
+    system in most Linux distributions) and falls back to the system's
+    temporary directory.
+    """
+
+    root = os.environ.get('EJUDGE_BUILD_ROOT')
+    if root:
+        return root
+
+    shm = '/dev/shm'
+    if os.path.isdir(shm) and os.access(shm, os.W_OK | os.X_OK):
+        base = shm
+    else:
+        base = tempfile.gettempdir()
+    return os.path.join(base, 'ejudge-build')
+
+
+def get_build_pool():
+    """
+    Return the default BuildDirPool instance.
+    """
+
+    global _default_pool
+
+    if _default_pool is None:
+        _default_pool = BuildDirPool()
+        atexit.register(_default_pool.close)
+    return _default_pool
+
+
+class BuildDirPool:
+    """
+    A pool of recyclable build directories.
+
+    Args:
+        root (str):
+            Directory in which all build directories are created. Defaults to
+            :func:`default_build_root`.
+        size (int):
+            Number of idle directories kept for each permission mode (regular
+            and sandboxed).
+        gc_interval (float):
+            Interval (in seconds) between two garbage collection runs of the
+            background thread. Set to None to disable the background thread.
+    """
+
+    def __init__(self, root=None, size=4, gc_interval=60):
+        self.root = root or default_build_root()
+        self.size = size
+        self.gc_interval = gc_interval
+        self._reset()
+
+    def __repr__(self):
+        return '<BuildDirPool %r (%s idle, %s in use)>' % (
+            self.root, sum(map(len, self._idle.values())), len(self._in_use)
+        )
+
+    def _reset(self):
+        # Idle directories and the threading state cannot be shared with forked
+        # processes. Children simply start a new pool at the same root.
+        self._pid = os.getpid()
+        self._lock = threading.Lock()
+        self._idle = {False: [], True: []}
+        self._in_use = {}
+        self._gc_thread = None
+        self._gc_stop = threading.Event()
+
+    def _check_pid(self):
+        if self._pid != os.getpid():
+            self._reset()
+
+    def _make_root(self):
+        if not os.path.isdir(self.root):
+            os.makedirs(self.root, exist_ok=True)
+
+            # Sandboxed processes running as other users must be able to
+            # create their own directories. We use the same permissions of
+            # /tmp.
+            try:
+                os.chmod(self.root, 0o1777)
+            except PermissionError:
+                pass
+
+    def _make_dir(self, sandboxed):
+        self._make_root()
+        path = tempfile.mkdtemp(prefix='%s-' % os.getpid(), dir=self.root)
+        if sandboxed:
+            os.chmod(path, SANDBOX_DIR_MODE)
+        return path
+
+    def acquire(self, sandboxed=False):
+        """
+        Return the path to an empty build directory.
+
+        If sandboxed is True, the directory is readable and writable by
+        everyone.
+        """
+
+        self._check_pid()
+        with self._lock:
+            idle = self._idle[bool(sandboxed)]
+            path = idle.pop() if idle else None
+
+        # Idle directories may have been removed by someone else (e.g., by
+        # an aggressive tmpfs cleaner) while they were in the pool.
+        if path is not None:
+            try:
+                os.utime(path)
+            except FileNotFoundError:
+                logger.debug('build path %r disappeared from pool' % path)
+                path = None
+        if path is None:
+            path = self._make_dir(sandboxed)
+        with self._lock:
+            self._in_use[path] = bool(sandboxed)
+
+        if self._gc_thread is None and self.gc_interval:
+            self.start()
+        return path
+
+    def release(self, path):
+        """
+        Give back a directory obtained with :meth:`acquire` to the pool.
+
+        The directory is emptied and either kept for later reuse or removed if
+        the pool is already full.
+        """
+
+        self._check_pid()
+        with self._lock:
+            sandboxed = self._in_use.pop(path, None)
+        if sandboxed is None:
+            raise ValueError('%r does not belong to the pool' % path)
+
+        try:
+            clear_dir(path)
+        except OSError as ex:
+            logger.warning('could not clean build path %r: %s' % (path, ex))
+            shutil.rmtree(path, ignore_errors=True)
+            return
+
+        with self._lock:
+            idle = self._idle[sandboxed]
+            if len(idle) < self.size:
+                idle.append(path)
+                path = None
+        if path is not None:
+            shutil.rmtree(path, ignore_errors=True)
+
+    def prefill(self):
+        """
+        Create idle directories until the pool is full.
+        """
+
+        self._check_pid()
+        for sandboxed, idle in self._idle.items():
+            while len(idle) < self.size:
+                path = self._make_dir(sandboxed)
+                with self._lock:
+                    idle.append(path)
+
+    def collect_garbage(self):
+        """
+        Remove orphaned build directories.
+
+        A directory is an orphan if the process that created it no longer
+        exists. Directories of running processes are never removed, even if
+        they are idle for a long time. Return the number of removed
+        directories.
+        """
+
+        self._check_pid()
+        try:
+            entries = list(os.scandir(self.root))
+        except FileNotFoundError:
+            return 0
+
+        with self._lock:
+            owned = set(self._in_use)
+            for idle in self._idle.values():
+                owned.update(idle)
+
+        removed = 0
+        for entry in entries:
+            if entry.path in owned or not entry.is_dir(follow_symlinks=False):
+                continue
+            pid, _, _ = entry.name.partition('-')
+            if not pid_exists(pid):
+                shutil.rmtree(entry.path, ignore_errors=True)
+                removed += 1
+
+        if removed:
+            logger.debug('removed %s orphaned build directories' % removed)
+        return removed
+
+    def start(self):
+        """
+        Start the background thread that pre-creates idle directories and
+        collects orphaned ones.
+        """
+
+        self._check_pid()
+        if self._gc_thread is not None:
+            return
+
+        def worker():
+            while not self._gc_stop.wait(self.gc_interval):
+                try:
+                    self.collect_garbage()
+                    self.prefill()
+                except Exception as ex:
+                    logger.warning('build pool maintenance failed: %s' % ex)
+
+        self._gc_thread = threading.Thread(target=worker, daemon=True,
+                                           name='ejudge-build-pool')
+        self._gc_thread.start()
+
+    def close(self):
+        """
+        Stop the background thread and remove all directories held by the pool.
+        """
+
+        if self._pid != os.getpid():
+            return
+
+        self._gc_stop.set()
+        with self._lock:
+            paths = list(self._in_use)
+            for idle in self._idle.values():
+                paths.extend(idle)
+                idle.clear()
+            self._in_use.clear()
+        for path in paths:
+            shutil.rmtree(path, ignore_errors=True)
+
+
+def clear_dir(path):
+    """
+    Remove all contents of the given directory, but keeps the directory itself.
+    """
+
+    for entry in os.scandir(path):
+        if entry.is_dir(follow_symlinks=False):
+            shutil.rmtree(entry.path)
+        else:
+            os.unlink(entry.path)
+
+
+def pid_exists(pid):
+    """
+    Return True if a process with the given pid (an int or a numeric string)
+    exists.
+    """
+
+    try:
+        pid = int(pid)
+    except ValueError:
+        return False
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
@@ -11,6 +11,9 @@ __original__ = vars(builtins)
 _print = print
 _input = input
 
+# A pristine copy of all builtins used to build namespaces for executed code
+_namespace = dict(__original__)
+
 
 def update(dic=None, **kwargs):
     """
@@ -50,3 +53,19 @@ def patched_builtins(dic=None, **kwargs):
         yield
     finally:
         restore()
+
+
+def namespace(dic=None, **kwargs):
+    """
+    Return a new dictionary with all builtins overridden by the given values.
+
+    The result can be used as the ``__builtins__`` entry in the globals of
+    executed code. Unlike update(), this does not touch the builtins module
+    and thus does not affect any other code running in the interpreter.
+    """
+
+    ns = _namespace.copy()
+    if dic:
+        ns.update(dic)
+    ns.update(kwargs)
+    return ns
@@ -18,3 +18,28 @@ class EarlyTerminationError(RuntimeError):
     """
     Error raised when program finishes without consuming all inputs.
     """
+
+
+class OutputMismatchError(BaseException):
+    """
+    Raised inside integrated programs when the output definitely does not match
+    the answer key in early-abort grading.
+
+    It is not a subclass of Exception, hence it is not silenced by generic
+    "except Exception" clauses in the program.
+    """
+
+
+class OutputLimitError(BaseException):
+    """
+    Raised inside integrated programs when they exceed the output limit.
+
+    Just like OutputMismatchError, it is not silenced by generic
+    "except Exception" clauses in the program.
+    """
+
+
+class ServerError(RuntimeError):
+    """
+    Error returned by an ejudge server (see :mod:`ejudge.server`) for a job.
+    """
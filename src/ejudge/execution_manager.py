@@ -1,19 +1,32 @@
+import asyncio
 import functools
-import io
 import logging
 import multiprocessing
 import os
+import pickle
+import resource
+import signal
 import subprocess
 import sys
 import time
 
 from lazyutils import delegate_to
 
-from boxed.pinteract import Pinteract
 from ejudge import builtins_ctrl
-from ejudge.exceptions import MissingInputError
+from ejudge.async_pinteract import AsyncPinteract, AsyncProcess
+from ejudge.pinteract import Pinteract, Process
+from ejudge.exceptions import MissingInputError, OutputMismatchError, \
+    OutputLimitError
+from ejudge.inputs import InputFile
+from ejudge.matching import OutputMatcher, StreamComparison, \
+    expected_stream_output
+from ejudge.recorder import InteractionRecorder, format_print
 from ejudge.util import remove_trailing_newline_from_testcase, \
-    timeout as run_with_timeout, format_traceback
+    timeout as run_with_timeout, format_traceback, cpu_timeout, \
+    set_resource_limits, address_space_limit, rusage_to_dict, \
+    is_cpu_limit_status, is_out_of_memory_output, \
+    do_nothing_context_manager, truncate_output
+from ejudge.zygote import get_zygote
 from iospec import Out, In, datatypes, StandardTestCase, ErrorTestCase
 
 logger = logging.getLogger('ejudge')
@@ -28,12 +41,38 @@ class ExecutionManager:
             The BuildManager instance associated with this program.
         inputs:
             A list of lists of input strings.
+        answer_key:
+            An optional TestCase with the expected interaction. In
+            compare_streams mode, the output of external programs is compared
+            with it by hash while it is read (see :meth:`run_popen`).
+        early_abort:
+            If True and an answer key is given, the program is killed as soon
+            as its output definitely does not match the answer key and the
+            truncated interaction is returned.
+        cpu_limit:
+            An optional limit for the CPU time (in seconds) used by the
+            program. Programs that exceed it are reported as timeouts.
+        memory_limit:
+            An optional limit for the memory (in bytes) allocated by the
+            program. Programs that exceed it are reported as runtime errors
+            with a 'memory-limit' error_kind meta attribute.
+        output_limit:
+            An optional limit for the size of the output of the program.
+            Programs are killed as soon as they exceed it and are reported as
+            runtime errors with an 'output-limit' error_kind meta attribute.
     """
 
     source = delegate_to('build_manager')
     is_sandboxed = delegate_to('build_manager')
     default_compare_streams = False
     env = None
+    pid = None
+    is_thread_safe = True
+    resource_usage = None
+
+    #: Number of characters kept from the beginning and from the end of the
+    #: output of programs that exceed the output limit.
+    output_limit_keep = 4096
 
     @property
     def compare_streams(self):
@@ -42,14 +81,27 @@ class ExecutionManager:
         else:
             return self.build_manager.compare_streams
 
-    def __init__(self, build_manager, inputs=()):
+    def __init__(self, build_manager, inputs=(), answer_key=None,
+                 cpu_limit=None, memory_limit=None, output_limit=None,
+                 early_abort=True):
         self.build_manager = build_manager
-        if inputs is None:
-            self.inputs = None
+        if inputs is None or isinstance(inputs, InputFile):
+            self.inputs = inputs
+        else:
+            self.inputs = list(inputs)
+        self.answer_key = answer_key
+        self.early_abort = early_abort
+        if answer_key is None or not early_abort:
+            self.matcher = None
         else:
-            self.inputs = tuple(inputs)
+            self.matcher = OutputMatcher(answer_key,
+                                         stream=self.compare_streams)
+        self.cpu_limit = cpu_limit
+        self.memory_limit = memory_limit
+        self.output_limit = output_limit
         self.is_started = False
         self.is_closed = False
+        self.is_cancelled = False
         self.duration = 0
         self.interaction = []
 
@@ -68,20 +120,57 @@ class ExecutionManager:
         Add an input string to the end of registered inputs.
         """
 
-        self.inputs += (input_str,)
+        self.add_inputs([input_str])
 
     def add_inputs(self, seq):
         """
         Add a sequence of input strings to the end of registered inputs.
         """
 
-        self.inputs += tuple(seq)
+        if not isinstance(self.inputs, list):
+            self.inputs = list(self.inputs)
+        self.inputs.extend(seq)
+
+    def input_count(self):
+        """
+        Return the number of inputs without loading input files.
+        """
+
+        if isinstance(self.inputs, InputFile):
+            return self.inputs.count_lines()
+        return len(self.inputs)
 
     def run(self, timeout=None):
         """
         Run program and return a list of In/Out elements interactions.
         """
 
+        t0 = self._start_run()
+        try:
+            result = self.interact(timeout)
+        except TimeoutError:
+            result = ErrorTestCase.timeout()
+        return self._end_run(result, t0)
+
+    async def run_async(self, timeout=None):
+        """
+        Coroutine version of .run().
+
+        The program must be already built.
+        """
+
+        t0 = self._start_run()
+        try:
+            result = await self.interact_async(timeout)
+        except TimeoutError:
+            result = ErrorTestCase.timeout()
+        except asyncio.CancelledError:
+            # The program may still be running in a worker thread
+            self.cancel()
+            raise
+        return self._end_run(result, t0)
+
+    def _start_run(self):
         if self.is_closed or self.build_manager.is_closed:
             raise RuntimeError(
                 'Program already executed. Cannot run it again.'
@@ -91,19 +180,34 @@ class ExecutionManager:
                 'Program already started execution. Please create another '
                 'ExecutionManager instance.'
             )
-        t0 = self.start()
-        try:
-            result = self.interact(timeout)
-        except TimeoutError:
-            result = ErrorTestCase.timeout()
+        return self.start()
 
+    def _end_run(self, result, t0):
         t1 = self.end()
         self.duration = t1 - t0
         self.build_manager.execution_duration += self.duration
         if self.compare_streams:
             result.normalize(stream=True)
+        self.record_usage(result)
         return remove_trailing_newline_from_testcase(result)
 
+    def record_usage(self, testcase):
+        """
+        Store the resources used by the program in the meta attributes of the
+        given test case (see :data:`ejudge.util.USAGE_META`).
+        """
+
+        usage = {'wall_time': self.duration}
+        if self.resource_usage is not None:
+            usage.update(self.resource_usage)
+        inputs = [str(x) for x in testcase if isinstance(x, In)]
+        outputs = [str(x) for x in testcase if isinstance(x, Out)]
+        usage['bytes_in'] = sum(len(x.encode('utf8')) + 1 for x in inputs)
+        usage['bytes_out'] = sum(len(x.encode('utf8')) for x in outputs)
+        usage['prompts'] = len(inputs)
+        for key, value in usage.items():
+            testcase.set_meta(key, value)
+
     def run_interactive(self):
         """
         Run program asking user for input.
@@ -122,6 +226,123 @@ class ExecutionManager:
         self.interact_with_user()
         self.end()
 
+    def cancel(self):
+        """
+        Abort execution, killing the running program.
+
+        This can be called from a different thread than the one that called
+        .run().
+        """
+
+        self.is_cancelled = True
+        self.set_pid(self.pid)
+
+    def set_pid(self, pid):
+        """
+        Register the pid of the process running the program.
+
+        The process is killed immediately if execution was already cancelled.
+        """
+
+        self.pid = pid
+        if self.is_cancelled:
+            self.kill()
+
+    def options(self):
+        """
+        Return a dictionary with the keyword arguments used to create a copy
+        of this execution manager.
+        """
+
+        return {
+            'answer_key': self.answer_key,
+            'early_abort': self.early_abort,
+            'cpu_limit': self.cpu_limit,
+            'memory_limit': self.memory_limit,
+            'output_limit': self.output_limit,
+        }
+
+    def resource_limiter(self):
+        """
+        Return a function that applies the CPU and memory limits to the
+        current process, or None if there are no limits.
+
+        It is the preexec_fn of child processes, hence limits are set in the
+        child before it executes the program.
+        """
+
+        if self.cpu_limit is None and self.memory_limit is None:
+            return None
+        return functools.partial(set_resource_limits, self.cpu_limit,
+                                 self.memory_limit)
+
+    def memory_limit_error(self, interaction):
+        """
+        Return an ErrorTestCase for a program that exceeded the memory limit.
+        """
+
+        error = ErrorTestCase.runtime(
+            list(interaction),
+            error_message='MemoryError: program exceeded the memory limit of '
+                          '%s bytes.' % self.memory_limit
+        )
+        error.set_meta('error_kind', 'memory-limit')
+        return error
+
+    def output_limit_error(self, interaction, omitted=0):
+        """
+        Return an ErrorTestCase for a program that exceeded the output limit.
+
+        Only the beginning and the end of the output are kept (see the
+        output_limit_keep attribute). If the output was already shortened
+        while it was read, omitted is the number of dropped characters (see
+        :func:`ejudge.util.truncate_output`).
+        """
+
+        error = ErrorTestCase.runtime(
+            truncate_output(interaction, self.output_limit_keep, omitted),
+            error_message='OutputLimitError: program exceeded the output '
+                          'limit of %s bytes.' % self.output_limit
+        )
+        error.set_meta('error_kind', 'output-limit')
+        return error
+
+    def kill(self):
+        """
+        Kill the running program, if any.
+        """
+
+        if self.pid is not None:
+            try:
+                os.kill(self.pid, signal.SIGKILL)
+            except ProcessLookupError:
+                pass
+
+    def check_output(self, data):
+        """
+        Check output string against the answer key.
+
+        Return False if the program should be aborted.
+        """
+
+        if self.matcher is None or self.matcher.feed_output(data):
+            return True
+        self.log('debug', 'output does not match answer key: aborting')
+        return False
+
+    def check_input(self):
+        """
+        Check the output produced before consuming the next input against the
+        answer key.
+
+        Return False if the program should be aborted.
+        """
+
+        if self.matcher is None or self.matcher.feed_input():
+            return True
+        self.log('debug', 'output does not match answer key: aborting')
+        return False
+
     def interact(self, timeout=None):
         """
         Interact with the program by using all input strings.
@@ -131,6 +352,17 @@ class ExecutionManager:
 
         raise NotImplementedError
 
+    async def interact_async(self, timeout=None):
+        """
+        Coroutine version of .interact().
+
+        The default implementation simply executes .interact() in the default
+        executor of the event loop.
+        """
+
+        loop = asyncio.get_event_loop()
+        return await loop.run_in_executor(None, self.interact, timeout)
+
     def interact_with_user(self):
         """
         Starts and executes program without storing any inputs.
@@ -146,11 +378,14 @@ class ExecutionManager:
         if not self.build_manager.is_built:
             self.build_manager.build()
         if not self.build_manager.has_successful_execution:
-            self.log('info', 'executing program with %s inputs '
-                             '(compare_streams=%s)' %
-                     (len(self.inputs), self.compare_streams))
+            if isinstance(self.inputs, InputFile):
+                inputs = 'inputs from %s' % self.inputs.path
+            else:
+                inputs = '%s inputs' % len(self.inputs)
+            self.log('info', 'executing program with %s (compare_streams=%s)'
+                     % (inputs, self.compare_streams))
         self.is_started = True
-        return time.time()
+        return time.monotonic()
 
     def end(self):
         """
@@ -161,7 +396,7 @@ class ExecutionManager:
         if not self.build_manager.has_successful_execution:
             self.log('debug', 'first run successful!')
         self.build_manager.has_successful_execution = True
-        return time.time()
+        return time.monotonic()
 
 
 class IntegratedExecutionManager(ExecutionManager):
@@ -171,6 +406,26 @@ class IntegratedExecutionManager(ExecutionManager):
     """
     __print = staticmethod(print)
     __input = staticmethod(input)
+    use_zygote = hasattr(os, 'fork')
+    recorder = None
+    output_exceeded = False
+
+    #: Optional function called when the program exceeds the output limit for
+    #: the first time. Programs may catch the OutputLimitError, hence execution
+    #: contexts that can simply terminate the program (e.g., zygote children)
+    #: use it to stop execution right away.
+    output_limit_hook = None
+
+    #: Executed code sees the replacements returned by .builtins() through a
+    #: private __builtins__ namespace. Languages whose runtime libraries look
+    #: up print() and input() in the builtins module must patch it globally.
+    patch_global_builtins = False
+
+    @property
+    def is_thread_safe(self):
+        # Sandboxed execution runs in the current process and is controlled by
+        # signals, which only work in the main thread.
+        return not self.is_sandboxed
 
     def _globals_and_locals(self):
         # Set locals and globals
@@ -182,10 +437,44 @@ class IntegratedExecutionManager(ExecutionManager):
         return globals_dic, locals_dic
 
     def wrapped_exec(self):
+        result = self._wrapped_exec()
+        if self.output_exceeded:
+            # The program may have caught the OutputLimitError
+            return self.output_limit_error(self.interaction)
+        return result
+
+    def _wrapped_exec(self):
         globals_dic, locals_dic = self._globals_and_locals()
+        if self.patch_global_builtins:
+            patched = builtins_ctrl.patched_builtins(self.builtins())
+        else:
+            namespace = builtins_ctrl.namespace(self.builtins())
+            globals_dic['__builtins__'] = namespace
+            patched = do_nothing_context_manager()
         try:
-            with builtins_ctrl.patched_builtins(self.builtins()):
-                self.exec(globals_dic, locals_dic)
+            try:
+                with patched:
+                    self.exec(globals_dic, locals_dic)
+            finally:
+                if self.recorder is not None:
+                    self.recorder.flush()
+        except OutputMismatchError:
+            return StandardTestCase(self.interaction)
+        except OutputLimitError:
+            return self.output_limit_error(self.interaction)
+        except TimeoutError:
+            raise
+        except SystemExit as ex:
+            # sys.exit() and sys.exit(0) are normal terminations
+            if ex.code not in (None, 0):
+                raise
+            return StandardTestCase(self.interaction)
+        except MemoryError as ex:
+            if self.memory_limit is None:
+                error = format_traceback(ex, self.source)
+                return ErrorTestCase.runtime(self.interaction,
+                                             error_message=error)
+            return self.memory_limit_error(self.interaction)
         except Exception as ex:
             error = format_traceback(ex, self.source)
             return ErrorTestCase.runtime(self.interaction, error_message=error)
@@ -201,54 +490,101 @@ class IntegratedExecutionManager(ExecutionManager):
         self.exec(globals_dic, locals_dic)
 
     def interact_with_timeout(self, timeout=None, storage=None):
-        t0 = time.time()
+        t0 = time.monotonic()
 
         try:
-            result = run_with_timeout(self.wrapped_exec, timeout=timeout)
+            with address_space_limit(self.memory_limit):
+                result = run_with_timeout(
+                    cpu_timeout, (self.wrapped_exec,),
+                    {'cpu_limit': self.cpu_limit}, timeout=timeout
+                )
         except TimeoutError:
-            result = ErrorTestCase.timeout(self.interaction)
+            if self.output_exceeded:
+                result = self.output_limit_error(self.interaction)
+            else:
+                result = ErrorTestCase.timeout(self.interaction)
 
         if storage is not None:
-            storage.put((result, time.time() - t0))
-        return result, time.time() - t0
+            storage.put((result, time.monotonic() - t0))
+        return result, time.monotonic() - t0
 
     def interact(self, timeout=None):
+        # Sandboxed test cases run in the sandbox process itself. Its peak_rss
+        # is the peak of all test cases executed so far, not of this one.
         if self.is_sandboxed:
+            start = resource.getrusage(resource.RUSAGE_SELF)
             result, dt = self.interact_with_timeout(timeout)
+            self.resource_usage = rusage_to_dict(
+                resource.getrusage(resource.RUSAGE_SELF), start)
             return result
+
+        # We execute the integrated manager in a separate process in order
+        # to isolate it from the main environment. This isolation is important
+        # in execution environments that introduce global state to the
+        # interpreter.
+        #
+        # Since python do not really prevent scripts from introducing global
+        # state, we always isolate execution to prevent any potentially
+        # dangerous global state to leak into the main interpreter process.
+        if self.use_zygote:
+            try:
+                return self.interact_in_zygote(timeout)
+            except (pickle.PicklingError, TypeError, AttributeError) as ex:
+                self.log('debug', 'cannot send manager to zygote: %s' % ex)
+        return self.interact_in_subprocess(timeout)
+
+    def interact_in_zygote(self, timeout=None):
+        """
+        Execute test case in a process forked from a zygote process with
+        all necessary modules pre-loaded.
+        """
+
+        zygote = get_zygote(self.build_manager.get_modules())
+        status, *args = zygote.run(self, timeout)
+        if status == 'result':
+            return args[0]
+        elif status == 'timeout':
+            return ErrorTestCase.timeout(self.interaction)
+        elif status == 'error':
+            interaction, message = args
+            return ErrorTestCase.runtime(interaction, error_message=message)
         else:
-            # We spawn and immediately join the child process in order to
-            # execute the integrated manager in a separate environment. This
-            # isolation is important in execution environments that introduce
-            # global state to the interpreter.
-            #
-            # Since python do not really prevent scripts from introducing global
-            # state, we always isolate execution to prevent any potentially
-            # dangerous global state to leak into the main interpreter process.
-            queue = multiprocessing.Queue()
-            process = multiprocessing.Process(
-                target=integrated_manager_interact,
-                args=(self, queue, None),
-            )
-            process.start()
-            process.join(timeout)
+            raise RuntimeError('invalid zygote response: %r' % status)
 
-            if process.is_alive():
-                process.terminate()
-                return ErrorTestCase.timeout(self.interaction)
+    def interact_in_subprocess(self, timeout=None):
+        """
+        Execute test case in a new subprocess.
 
-            if queue:
-                result, time = queue.get()
-                return result
-            else:
-                raise RuntimeError('unexpected error')
+        This is slower than interact_in_zygote(), but does not require the
+        manager to be pickable or the platform to support os.fork().
+        """
+
+        queue = multiprocessing.Queue()
+        process = multiprocessing.Process(
+            target=integrated_manager_interact,
+            args=(self, queue, None),
+        )
+        process.start()
+        process.join(timeout)
+
+        if process.is_alive():
+            process.terminate()
+            return ErrorTestCase.timeout(self.interaction)
+
+        if queue:
+            result, time = queue.get()
+            return result
+        else:
+            raise RuntimeError('unexpected error')
 
     def exec(self, globals, locals):
         """
         Execute code with the given locals and globals.
         """
 
-        code = compile(self.source, 'main.py', 'exec')
+        code = self.build_manager.code
+        if code is None:
+            code = compile(self.source, 'main.py', 'exec')
         if locals is None:
             exec(code, globals)
         else:
@@ -262,28 +598,55 @@ class IntegratedExecutionManager(ExecutionManager):
         functions.
         """
         consumed_inputs = list(reversed(self.inputs))
+        recorder = self.recorder = InteractionRecorder(self.interaction)
+        write = recorder.write
+        check_output = None if self.matcher is None else self.check_output
+        output_limit = self.output_limit
+        output_size = 0
+
+        def exceed_output_limit():
+            # The limit is sticky: nothing else is recorded and every
+            # subsequent call to print() or input() fails.
+            self.output_exceeded = True
+            if self.output_limit_hook is not None:
+                recorder.flush()
+                self.output_limit_hook()
+            raise OutputLimitError
 
         @functools.wraps(self.__print)
         def print(*args, sep=' ', end='\n', file=None, flush=False):
+            nonlocal output_size
             if not (file is None or file is sys.stdout):
                 self.__print(*args, sep=sep, end=end, file=file, flush=flush)
-            else:
-                file = io.StringIO()
-                self.__print(*args, sep=sep, end=end, file=file, flush=flush)
-                data = file.getvalue()
+                return
+            if self.output_exceeded:
+                raise OutputLimitError
 
-                if self.interaction and isinstance(self.interaction[-1], Out):
-                    self.interaction[-1] += Out(data)
-                else:
-                    self.interaction.append(Out(data))
+            # Fast path for the common print(str) call
+            if len(args) == 1 and type(args[0]) is str and end == '\n':
+                data = args[0] + end
+            else:
+                data = format_print(args, sep, end)
+            if output_limit is not None:
+                output_size += len(data)
+                if output_size > output_limit:
+                    write(data[:len(data) - output_size + output_limit])
+                    exceed_output_limit()
+            write(data)
+            if check_output is not None and not check_output(data):
+                raise OutputMismatchError
 
         @functools.wraps(self.__input)
         def input(prompt=None):
+            if self.output_exceeded:
+                raise OutputLimitError
             if prompt is not None:
                 print(prompt, end='')
+            if not self.check_input():
+                raise OutputMismatchError
             if consumed_inputs:
                 result = consumed_inputs.pop()
-                self.interaction.append(In(result))
+                recorder.add_input(result)
                 return result
             else:
                 raise MissingInputError('not enough inputs')
@@ -300,12 +663,23 @@ class PInteractExecutionManager(ExecutionManager):
     shell_args = None
     default_compare_streams = True
 
+    #: Outputs compared by hash are kept in memory up to this size (in bytes)
+    #: and spooled to a temporary file after that.
+    spool_size = 2 ** 20
+
     def interact(self, timeout=None):
         if self.compare_streams:
             return self.run_popen(self.get_shell_args(), timeout)
         else:
             return self.run_pinteract(self.get_shell_args(), timeout)
 
+    async def interact_async(self, timeout=None):
+        if self.compare_streams:
+            return await self.run_popen_async(self.get_shell_args(), timeout)
+        else:
+            return await self.run_pinteract_async(self.get_shell_args(),
+                                                  timeout)
+
     def interact_with_user(self):
         os.chdir(self.build_manager.build_path)
         try:
@@ -320,33 +694,38 @@ class PInteractExecutionManager(ExecutionManager):
 
         This is a generic implementation. Specific languages or runtimes are
         supported by fixing the shellargs argument of this function.
-        This function uses the PInteract() object for communication with
+        This function uses the Pinteract() object for communication with
         scripts.
-
-        This function may change the current working path.
         """
 
         if not self.build_manager.has_successful_execution:
             self.log('debug', 'executing with pinteract runner')
 
+        result = self.interaction
+        process = Pinteract(shell_args, **self._pinteract_options(timeout))
+        self.set_pid(process.pid)
+        try:
+            testcase = self._run_pinteract(process, result)
+        finally:
+            self.set_pid(None)
+            process.close()
+        return self._pinteract_result(testcase, process)
+
+    def _run_pinteract(self, process, result):
         def append_non_empty_output():
             data = process.receive()
             if data:
                 result.append(datatypes.Out(data))
-
-        # Execute script in the tempdir and than go back once execution has
-        # finished
-        result = self.interaction
-
-        # os.chdir(self.build_manager.build_path)
-        process = Pinteract(shell_args,
-                            cwd=self.build_manager.build_path,
-                            timeout=timeout,
-                            env=self.env)
+            if process.output_exceeded:
+                return False
+            return self.matcher is None or self.matcher.is_valid
 
         # Fetch all In/Out strings
-        append_non_empty_output()
+        if not append_non_empty_output():
+            return StandardTestCase(result)
         for idx, inpt in enumerate(self.inputs):
+            if not self.check_input():
+                return StandardTestCase(result)
             try:
                 process.send(inpt)
                 result.append(datatypes.In(inpt))
@@ -356,66 +735,284 @@ class PInteractExecutionManager(ExecutionManager):
                 #
                 # The default behavior is just to send a truncated
                 # IoTestCase
-                if process.is_dead():
-                    missing = self.inputs[idx:]
-                    missing_str = '\n'.join('    ' + x for x in missing)
-                    msg = (
-                              'Error: Process closed without consuming all inputs.\n'
-                              'Unused inputs:\n  '
-                          ) + missing_str
-
-                    return ErrorTestCase.runtime(
-                        result,
-                        error_message=msg
-                    )
-
-                # This clause is just a safeguard. We don't expect to ever
-                # get here
-                return ErrorTestCase.runtime(
-                    result,
-                    error_message='An internal error occurred while trying '
-                                  'to interact with the script: %s.' % ex
-                )
+                return self._early_termination_error(
+                    result, idx, ex, process.is_dead())
 
             try:
-                append_non_empty_output()
+                if not append_non_empty_output():
+                    return StandardTestCase(result)
             except TimeoutError:
                 return ErrorTestCase.timeout(result)
 
         # Finish process
         error_ = process.finish()
+        if process.output_exceeded:
+            return StandardTestCase(result)
+        assert not any(error_), error_
+        return StandardTestCase(result)
+
+    def _early_termination_error(self, result, idx, ex, is_dead):
+        if is_dead:
+            missing = self.inputs[idx:]
+            missing_str = '\n'.join('    ' + x for x in missing)
+            msg = (
+                      'Error: Process closed without consuming all inputs.\n'
+                      'Unused inputs:\n  '
+                  ) + missing_str
+
+            return ErrorTestCase.runtime(
+                result,
+                error_message=msg
+            )
+
+        # This clause is just a safeguard. We don't expect to ever
+        # get here
+        return ErrorTestCase.runtime(
+            result,
+            error_message='An internal error occurred while trying '
+                          'to interact with the script: %s.' % ex
+        )
+
+    def _pinteract_options(self, timeout):
+        def check_output(data):
+            if not self.check_output(data):
+                self.kill()
+
+        return dict(
+            cwd=self.build_manager.build_path,
+            timeout=timeout,
+            env=self.env,
+            on_output=None if self.matcher is None else check_output,
+            wait_running=self.cpu_limit is not None,
+            output_limit=self.output_limit,
+            output_keep=self.output_limit_keep,
+            preexec_fn=self.resource_limiter(),
+        )
+
+    def _pinteract_result(self, testcase, process):
+        if process.output_exceeded:
+            return self.output_limit_error(testcase, process.output_omitted)
+        return self._process_result(testcase, process.process)
+
+    async def run_pinteract_async(self, shell_args, timeout=None):
+        """
+        Coroutine version of .run_pinteract().
+
+        Communication with the child process uses non-blocking file descriptors
+        driven by the event loop instead of blocking the current thread.
+        """
+
+        if not self.build_manager.has_successful_execution:
+            self.log('debug', 'executing with async pinteract runner')
+
+        result = self.interaction
+        process = await AsyncPinteract.spawn(
+            shell_args, **self._pinteract_options(timeout)
+        )
+        self.set_pid(process.pid)
+        try:
+            testcase = await self._run_pinteract_async(process, result)
+        finally:
+            self.set_pid(None)
+            await process.close()
+        return self._pinteract_result(testcase, process)
+
+    async def _run_pinteract_async(self, process, result):
+        async def append_non_empty_output():
+            data = await process.receive()
+            if data:
+                result.append(datatypes.Out(data))
+            if process.output_exceeded:
+                return False
+            return self.matcher is None or self.matcher.is_valid
+
+        # Fetch all In/Out strings
+        if not await append_non_empty_output():
+            return StandardTestCase(result)
+        for idx, inpt in enumerate(self.inputs):
+            if not self.check_input():
+                return StandardTestCase(result)
+            try:
+                await process.send(inpt)
+                result.append(datatypes.In(inpt))
+            except RuntimeError as ex:
+                return self._early_termination_error(
+                    result, idx, ex, process.is_dead())
+
+            try:
+                if not await append_non_empty_output():
+                    return StandardTestCase(result)
+            except TimeoutError:
+                return ErrorTestCase.timeout(result)
+
+        # Finish process
+        error_ = await process.finish()
+        if process.output_exceeded:
+            return StandardTestCase(result)
         assert not any(error_), error_
         return StandardTestCase(result)
 
-    # TODO: still buggy!
     def run_popen(self, shell_args, timeout=None):
         """
         Run script as a subprocess and gather results of execution.
 
         Collect only the raw stdin and stdout streams.
+
+        If there is an answer key, the normalized output is hashed while it is
+        read and the raw output is spooled to a temporary file. It is only read
+        back if the digest differs from the digest of the expected output.
+        Otherwise, the expected output string is used as the output of the
+        resulting test case, which is marked with the "digest_match" meta
+        attribute.
         """
 
         if not self.build_manager.has_successful_execution:
             self.log('debug', 'executing with popen runner')
 
-        inputs = '\n'.join(self.inputs)
-        process = subprocess.Popen(shell_args,
-                                   cwd=self.build_manager.build_path,
-                                   universal_newlines=True,
-                                   stderr=subprocess.STDOUT,
-                                   stdin=subprocess.PIPE,
-                                   stdout=subprocess.PIPE,
-                                   env=self.env)
-        result, err = process.communicate(inputs, timeout)
+        process, inputs = self._start_popen(Process, shell_args)
+        comparison = self._stream_comparison()
+        try:
+            data = process.communicate(inputs, self.output_limit,
+                                       comparison.sink,
+                                       self.output_limit_keep, timeout)
+            return self._popen_result(data, process, comparison)
+        finally:
+            self.set_pid(None)
+            process.kill()
+            process.wait()
+            comparison.close()
+
+    async def run_popen_async(self, shell_args, timeout=None):
+        """
+        Coroutine version of .run_popen().
+        """
+
+        if not self.build_manager.has_successful_execution:
+            self.log('debug', 'executing with async popen runner')
+
+        process, inputs = self._start_popen(AsyncProcess, shell_args)
+        comparison = self._stream_comparison()
+        try:
+            data = await asyncio.wait_for(
+                process.communicate(inputs, self.output_limit,
+                                    comparison.sink, self.output_limit_keep),
+                timeout
+            )
+            return self._popen_result(data, process, comparison)
+        except asyncio.TimeoutError:
+            raise TimeoutError
+        finally:
+            self.set_pid(None)
+            process.kill()
+            await process.wait()
+            comparison.close()
+
+    def _start_popen(self, process_class, shell_args):
+        # Input files are handed directly to the child's stdin. Otherwise we
+        # send all inputs through a pipe.
+        if isinstance(self.inputs, InputFile):
+            stdin = self.inputs.open()
+            inputs = b''
+        else:
+            stdin = subprocess.PIPE
+            inputs = '\n'.join(self.inputs).encode('utf8')
+        try:
+            process = process_class(
+                shell_args,
+                cwd=self.build_manager.build_path,
+                stderr=subprocess.STDOUT,
+                stdin=stdin,
+                stdout=subprocess.PIPE,
+                env=self.env,
+                preexec_fn=self.resource_limiter(),
+            )
+        finally:
+            if stdin is not subprocess.PIPE:
+                stdin.close()
+        self.set_pid(process.pid)
+        return process, inputs
+
+    def _stream_comparison(self):
+        expected = None
+        if self.answer_key is not None:
+            expected = expected_stream_output(self.answer_key)
+        # IoSpec keeps the leading newlines of the output of test cases with
+        # exactly one input and strips them otherwise.
+        strip_leading = expected is not None and self.input_count() != 1
+        return StreamComparison(expected, strip_leading, self.spool_size)
+
+    def _popen_result(self, data, process, comparison):
+        omitted = process.output_omitted
+        if comparison.digest is not None:
+            if (process.returncode == 0 and not process.output_exceeded
+                    and comparison.is_match()):
+                atoms = self._input_atoms(matched=True)
+                atoms.append(Out(comparison.expected))
+                testcase = StandardTestCase(atoms)
+                testcase.set_meta('digest_match', True)
+                return self._process_result(testcase, process)
+            data, omitted = comparison.read(
+                self.output_limit_keep if process.output_exceeded else None
+            )
 
+        result = data.decode('utf8', 'replace')
+        if '\r' in result:
+            result = result.replace('\r\n', '\n')
         if result.endswith('\n'):
             result = result[:-1]
-        atoms = [In(x) for x in self.inputs]
+        atoms = self._input_atoms()
         atoms.append(Out(result))
-        if process.poll() == 0:
-            return StandardTestCase(atoms)
+        if process.output_exceeded:
+            return self.output_limit_error(atoms, omitted)
+        if process.returncode == 0:
+            testcase = StandardTestCase(atoms)
         else:
-            return ErrorTestCase.runtime(atoms)
+            testcase = ErrorTestCase.runtime(atoms)
+        return self._process_result(testcase, process)
+
+    def _input_atoms(self, matched=False):
+        # The inputs of an output that matched the answer key are already
+        # stored in it. We avoid reading and decoding input files again.
+        if matched and isinstance(self.inputs, InputFile):
+            return [x for x in self.answer_key if isinstance(x, In)]
+        return [In(x) for x in self.inputs]
+
+    def _process_result(self, result, process):
+        if process.returncode is None:
+            return ErrorTestCase.runtime(
+                list(result),
+                error_message='Error: the exit status of the program is '
+                              'unknown.'
+            )
+
+        # Record resource usage and check if the process was killed for
+        # exceeding its CPU or memory limits
+        if process.rusage is not None:
+            self.resource_usage = rusage_to_dict(process.rusage)
+        if is_cpu_limit_status(process.returncode):
+            return ErrorTestCase.timeout(list(result))
+        elif self.is_memory_limit_failure(result, process.returncode):
+            return self.memory_limit_error(result)
+        return result
+
+    def is_memory_limit_failure(self, result, returncode):
+        """
+        Return True if a process that terminated with the given returncode
+        has probably failed because of the memory limit.
+
+        External programs usually crash or abort when an allocation fails. We
+        assume that happened if the program printed an out of memory message
+        or if its peak resident memory is close to the limit.
+        """
+
+        if (self.memory_limit is None or returncode in (0, -signal.SIGKILL)
+                or getattr(result, 'error_type', None) == 'timeout'):
+            return False
+        output = ''.join(str(x) for x in result if isinstance(x, Out))
+        if is_out_of_memory_output(output):
+            return True
+        usage = self.resource_usage or {}
+        return usage.get('peak_rss', 0) >= 0.9 * self.memory_limit
 
     def get_shell_args(self):
         """
@@ -484,4 +1081,14 @@ def integrated_manager_interact(exc_manager, storage, timeout):
     Interact with execution manager.
     """
 
+    t0 = time.monotonic()
+
+    def output_limit_hook():
+        result = exc_manager.output_limit_error(exc_manager.interaction)
+        storage.put((result, time.monotonic() - t0))
+        storage.close()
+        storage.join_thread()
+        os._exit(0)
+
+    exc_manager.output_limit_hook = output_limit_hook
     exc_manager.interact_with_timeout(timeout, storage)
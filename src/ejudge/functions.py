@@ -1,22 +1,41 @@
+import collections
+import functools
 import io
+import itertools
+import json
 import logging
+import os
+import time
 import traceback
+import warnings
+from concurrent.futures import ThreadPoolExecutor, as_completed, wait, \
+    FIRST_COMPLETED
 
 import sys
 
-from boxed.core import capture_print
-from boxed.jsonbox import run as run_sandbox
+from boxed.core import capture_print, real_print
 from ejudge import registry
 from ejudge.exceptions import BuildError
+from ejudge.inputs import InputFile
+from ejudge.matching import get_feedback
+from ejudge.sandbox_pool import consume, run as run_sandbox, \
+    stream as stream_sandbox
+from ejudge.util import iospec_from_json, testcase_from_json, \
+    aggregate_usage_meta
 from iospec import parse as ioparse, TestCase, ErrorTestCase, IoSpec
-from iospec.feedback import get_feedback
 
 logger = logging.getLogger('ejudge')
+inf = float('inf')
+
+#: Prefix of the comment lines used to send test cases from the sandbox.
+STREAM_PREFIX = '#ejudge-testcase: '
 
 
 def run(source, inputs, lang=None, *,
         fast=False, timeout=None, raises=False, path=None, sandbox=True,
-        compare_streams=False, fake_sandbox=False, debug=False):
+        compare_streams=False, fake_sandbox=False, debug=False, workers=1,
+        case_timeout=None, cpu_limit=None, memory_limit=None,
+        output_limit=None, cache=None, problem=None):
     """
     Run program with the given list of inputs and returns the corresponding
     :class:`iospec.IoSpec` instance with the results.
@@ -28,7 +47,10 @@ def run(source, inputs, lang=None, *,
             A sequence of input strings. If input is a sequence of sequences,
             this function will perform multiple test cases. It can also be a
             IoSpec or a TestCase instance which are used to extract the
-            necessary input strings.
+            necessary input strings. Other iterables and the sources in
+            :mod:`ejudge.inputs` are read on demand, but only if
+            sandbox=False and no cache is given. Otherwise, all inputs are
+            loaded into memory first and a warning is issued.
         lang (str)
             The name for the source code language. See
             :func:`ejudge.graders.io.grade` for more details.
@@ -36,6 +58,25 @@ def run(source, inputs, lang=None, *,
             A time limit for the entire run (in seconds). If this attribute is
             not given, the program will run without any timeout. This can be
             potentially dangerous if the input program has an infinite loop.
+            Test cases that do not finish before the limit (or that did not
+            start) are marked as timeouts.
+        case_timeout (float)
+            A wall time limit (in seconds) for each test case.
+        cpu_limit (float)
+            A CPU time limit (in seconds) for each test case. It is not
+            affected by the load of the host machine. Test cases that exceed
+            it are marked as timeouts.
+        memory_limit (int)
+            A limit (in bytes) for the memory allocated by each test case.
+            Test cases that exceed it are marked as runtime errors with
+            ``testcase.meta['error_kind'] == 'memory-limit'``.
+        output_limit (int)
+            A limit for the size of the output of each test case (in bytes
+            for external programs and in characters for integrated
+            languages). Programs are killed as soon as they exceed it and
+            marked as runtime errors with
+            ``testcase.meta['error_kind'] == 'output-limit'``. Only the
+            beginning and the end of their output are kept.
         sandbox (bool)
             Controls if code is run in sandboxed mode or not. Sandbox protection
             is the default behavior on supported platforms.
@@ -50,9 +91,29 @@ def run(source, inputs, lang=None, *,
         compare_streams:
             If True, collect only the raw stdin and stdout streams. The default
             behavior is trying to collect fine-grained interactions.
+        workers (int):
+            Maximum number of test cases executed concurrently. Results are
+            always returned in the same order as the inputs. If fast=True,
+            test cases still running after the first error are killed.
+        cache (ResultCache):
+            A :class:`ejudge.result_cache.ResultCache` instance. Results for
+            the same source, inputs, language and options are fetched from
+            the cache instead of executing the program again. Cached results
+            have ``result.meta['cached'] == True``.
+        problem (str):
+            Name of the problem used to group results in the cache, so they
+            can be invalidated with ``cache.invalidate(problem)``.
     Returns:
         A :class:`iospec.IoSpec` structure. If ``inputs`` is a sequence of
         strings, the resulting tree will have a single test case.
+
+        The meta attributes of each test case record the resources it used:
+        wall_time, user_time and system_time (in seconds), peak_rss (in
+        bytes), bytes_in, bytes_out and the number of input prompts. The same
+        attributes in the IoSpec meta are totals over all test cases (or the
+        maximum, for peak_rss). Sandboxed integrated languages (e.g., Python)
+        run all test cases in the same process, hence their peak_rss is the
+        peak of all test cases executed so far.
     """
 
     return run_worker(**locals())[0]
@@ -61,21 +122,25 @@ def run(source, inputs, lang=None, *,
 def run_worker(source, inputs, lang=None, *,
                fast=False, timeout=None, raises=False, path=None, sandbox=True,
                compare_streams=False, is_sandboxed=False, fake_sandbox=False,
-               debug=False):
-    # Normalize inputs
-    if isinstance(inputs, (IoSpec, TestCase)):
-        inputs = inputs.inputs()
-    else:
-        if inputs and isinstance(inputs[0], str):
-            inputs = [list(inputs)]
-        else:
-            inputs = [list(map(str, x)) for x in inputs]
+               debug=False, workers=1, case_timeout=None, cpu_limit=None,
+               memory_limit=None, output_limit=None, answer_key=None,
+               early_abort=True, cache=None, problem=None):
+    if cache is not None:
+        kwargs = dict(locals())
+        del kwargs['cache'], kwargs['problem']
+        return run_cached(cache, problem, **kwargs)
+
+    inputs = normalize_inputs(inputs)
+    if isinstance(answer_key, (list, dict)):
+        answer_key = iospec_from_json(answer_key)
 
     # Validate params
-    if timeout is not None and timeout <= 0:
-        raise ValueError('timeout must be positive, got: %s' % timeout)
+    validate_limits(timeout, case_timeout, cpu_limit, memory_limit,
+                    output_limit)
     if sandbox and is_sandboxed:
         raise ValueError('cannot set sandbox = is_sandboxed = True')
+    if workers < 1:
+        raise ValueError('workers must be positive, got: %s' % workers)
 
     # Create build manager
     build_manager = registry.build_manager_from_path(
@@ -88,7 +153,7 @@ def run_worker(source, inputs, lang=None, *,
     if sandbox:
         logger.debug('executing %s program inside sandbox' % lang)
         imports = build_manager.get_modules()
-        args = (source, inputs, lang)
+        args = (source, materialize_inputs(inputs, 'sandbox=True'), lang)
         kwargs = {
             'raises': raises,
             'timeout': timeout,
@@ -97,6 +162,13 @@ def run_worker(source, inputs, lang=None, *,
             'sandbox': False,
             'compare_streams': compare_streams,
             'is_sandboxed': True,
+            'workers': workers,
+            'case_timeout': case_timeout,
+            'cpu_limit': cpu_limit,
+            'memory_limit': memory_limit,
+            'output_limit': output_limit,
+            'answer_key': None if answer_key is None else answer_key.to_json(),
+            'early_abort': early_abort,
         }
 
         if fake_sandbox:
@@ -118,47 +190,467 @@ def run_worker(source, inputs, lang=None, *,
         for (level, message) in messages:
             getattr(logger, level)(message)
 
-        return IoSpec.from_json(result), []
+        return aggregate_usage_meta(iospec_from_json(result)), []
 
     # Prepare build manager
-    try:
-        build_manager.build()
-    except BuildError as ex:
-        if raises:
-            raise
-        result = IoSpec([ErrorTestCase.build(error_message=str(ex))])
-        if is_sandboxed:
-            return result.to_json(), []
-        else:
-            return result, []
-
-    # Run all examples with the execution manager
-    data = []
-    language = build_manager.language
-    for input_strings in inputs:
-        ctrl = registry.execution_manager(language, build_manager,
-                                          input_strings)
-        result = ctrl.run(timeout)
-        assert isinstance(result, TestCase)
-        data.append(result)
-        if fast and result.is_error_test_case:
-            break
+    with build_manager:
+        try:
+            build_manager.build()
+        except BuildError as ex:
+            if raises:
+                raise
+            result = IoSpec([ErrorTestCase.build(error_message=str(ex))])
+            if is_sandboxed:
+                return result.to_json(), []
+            else:
+                return result, []
+
+        # Run all examples with the execution manager
+        data = run_test_cases(build_manager, inputs, timeout=timeout,
+                              fast=fast, workers=workers,
+                              answer_key=answer_key,
+                              early_abort=early_abort,
+                              case_timeout=case_timeout,
+                              cpu_limit=cpu_limit,
+                              memory_limit=memory_limit,
+                              output_limit=output_limit)
 
     build_manager.log('info', 'executed all %s testcases in %s sec' %
-                      (len(inputs), build_manager.execution_duration))
+                      (len(data), build_manager.execution_duration))
 
     # Prepare resulting iospec object
     result = IoSpec(data)
     result.set_meta('lang', build_manager.language)
+    aggregate_usage_meta(result)
     if is_sandboxed:
         return result.to_json(), build_manager.messages
     else:
         return result, []
 
 
+def run_cached(cache, problem, source, inputs, lang=None, **kwargs):
+    """
+    Like :func:`run_worker`, but fetch results from the given ResultCache
+    whenever possible and store the results of new executions.
+    """
+
+    key, source, inputs, lang, result = cache_lookup(
+        cache, problem, source, inputs, lang, kwargs
+    )
+    if result is not None:
+        return result, []
+
+    result, messages = run_worker(source, inputs, lang, **kwargs)
+    cache.put(key, result, problem)
+    return result, messages
+
+
+def cache_lookup(cache, problem, source, inputs, lang, kwargs):
+    """
+    Fetch the results of running source from the given ResultCache.
+
+    Return a tuple (key, source, inputs, lang, result) with the cache key, the
+    normalized source string, inputs and language, and the cached result or
+    None if it is not in the cache. Results of new executions must be stored
+    under the returned key. Implements the cache lookup of :func:`run_cached`
+    and of its :mod:`ejudge.aio` counterpart.
+    """
+
+    inputs = materialize_inputs(inputs, 'the result cache')
+    if lang is None:
+        lang = registry.language_from_source(source, kwargs.get('path'))
+    if not isinstance(source, str):
+        source = source.read()
+
+    key = cache.key(source, inputs, lang, kwargs)
+    result = cache.get(key, problem)
+    if result is not None:
+        logger.debug('using cached results (%s)' % key)
+        if kwargs.get('raises') and is_build_error(result):
+            raise BuildError(result[0].error_message)
+    return key, source, inputs, lang, result
+
+
+def is_build_error(result):
+    """
+    Return True if the IoSpec returned by :func:`run` signals a build error.
+    """
+
+    return (len(result) == 1 and
+            getattr(result[0], 'error_type', None) == 'build')
+
+
+def iter_run(source, inputs, lang=None, *,
+             fast=False, timeout=None, raises=False, path=None, sandbox=True,
+             compare_streams=False, fake_sandbox=False, debug=False,
+             workers=1, case_timeout=None, cpu_limit=None, memory_limit=None,
+             output_limit=None):
+    """
+    Like :func:`run`, but return an iterator that yields each TestCase as soon
+    as it finishes.
+
+    The program is built only once and test cases are yielded in the same
+    order as the inputs. If the build fails, yields a single build error
+    test case. Closing the iterator kills all test cases that are still
+    running.
+
+    Accepts the same arguments as :func:`run`.
+    """
+
+    return iter_run_worker(**locals())
+
+
+def iter_run_worker(source, inputs, lang=None, *,
+                    fast=False, timeout=None, raises=False, path=None,
+                    sandbox=True, compare_streams=False, is_sandboxed=False,
+                    fake_sandbox=False, debug=False, workers=1,
+                    case_timeout=None, cpu_limit=None, memory_limit=None,
+                    output_limit=None, answer_key=None, early_abort=True):
+    # Generator version of run_worker(). It yields test cases and returns the
+    # list of log messages.
+    inputs = normalize_inputs(inputs)
+    if isinstance(answer_key, (list, dict)):
+        answer_key = iospec_from_json(answer_key)
+
+    # Validate params
+    validate_limits(timeout, case_timeout, cpu_limit, memory_limit,
+                    output_limit)
+    if sandbox and is_sandboxed:
+        raise ValueError('cannot set sandbox = is_sandboxed = True')
+    if workers < 1:
+        raise ValueError('workers must be positive, got: %s' % workers)
+
+    # Create build manager
+    build_manager = registry.build_manager_from_path(
+        lang, source, path,
+        is_sandboxed=is_sandboxed,
+        compare_streams=compare_streams,
+    )
+
+    # Run in sandboxed mode. Test cases are sent back as comments while the
+    # job runs.
+    if sandbox:
+        logger.debug('streaming %s program inside sandbox' % lang)
+        args = (build_manager.source,
+                materialize_inputs(inputs, 'sandbox=True'),
+                build_manager.language)
+        kwargs = {
+            'raises': raises,
+            'timeout': timeout,
+            'fast': fast,
+            'compare_streams': compare_streams,
+            'workers': workers,
+            'case_timeout': case_timeout,
+            'cpu_limit': cpu_limit,
+            'memory_limit': memory_limit,
+            'output_limit': output_limit,
+            'answer_key': None if answer_key is None else answer_key.to_json(),
+            'early_abort': early_abort,
+        }
+
+        if fake_sandbox:
+            messages = yield from iter_run_worker(
+                *args, sandbox=False, is_sandboxed=True, **kwargs
+            )
+        else:
+            stream = stream_sandbox(
+                stream_worker,
+                args=args,
+                kwargs=kwargs,
+                imports=build_manager.get_modules(),
+            )
+            messages = yield from iter_streamed_test_cases(stream)
+
+        for (level, message) in messages:
+            getattr(logger, level)(message)
+        return []
+
+    # Prepare build manager
+    with build_manager:
+        try:
+            build_manager.build()
+        except BuildError as ex:
+            if raises:
+                raise
+            yield ErrorTestCase.build(error_message=str(ex))
+        else:
+            yield from iter_test_cases(build_manager, inputs, timeout=timeout,
+                                       fast=fast, workers=workers,
+                                       answer_key=answer_key,
+                                       early_abort=early_abort,
+                                       case_timeout=case_timeout,
+                                       cpu_limit=cpu_limit,
+                                       memory_limit=memory_limit,
+                                       output_limit=output_limit)
+
+    return build_manager.messages if is_sandboxed else []
+
+
+def stream_worker(source, inputs, lang, **kwargs):
+    """
+    Executed inside the sandbox by :func:`iter_run`.
+
+    Print each test case as a comment line prefixed by STREAM_PREFIX and return
+    the list of log messages.
+    """
+
+    def send(testcase):
+        real_print(STREAM_PREFIX + json.dumps(testcase.to_json()), flush=True)
+
+    stream = iter_run_worker(source, inputs, lang, sandbox=False,
+                             is_sandboxed=True, **kwargs)
+    return consume(stream, send)
+
+
+def iter_streamed_test_cases(stream):
+    """
+    Yield the test cases sent by :func:`stream_worker` in the given stream of
+    comment lines and return the result of the job.
+    """
+
+    while True:
+        try:
+            line = next(stream)
+        except StopIteration as ex:
+            return ex.value
+        if line.startswith(STREAM_PREFIX):
+            data = json.loads(line[len(STREAM_PREFIX):])
+            yield testcase_from_json(data)
+
+
+def normalize_inputs(inputs):
+    """
+    Return a list of lists of input strings from any of the input formats
+    accepted by :func:`run`.
+
+    Iterables that are not lists or tuples (e.g., generators or the sources
+    in :mod:`ejudge.inputs`) are consumed lazily: the result is an iterator
+    that only reads the inputs of each test case when it is requested.
+    :class:`ejudge.inputs.InputFile` test cases are kept as they are.
+    """
+
+    if isinstance(inputs, (IoSpec, TestCase)):
+        return inputs.inputs()
+    elif not isinstance(inputs, (list, tuple)):
+        return map(normalize_case_inputs, inputs)
+    elif inputs and isinstance(inputs[0], str):
+        return [list(inputs)]
+    else:
+        return [normalize_case_inputs(x) for x in inputs]
+
+
+def normalize_case_inputs(inputs):
+    """
+    Return the list of input strings of a single test case.
+    """
+
+    if isinstance(inputs, InputFile):
+        return inputs
+    return list(map(str, inputs))
+
+
+def materialize_inputs(inputs, reason=None):
+    """
+    Like :func:`normalize_inputs`, but always return a list of lists of
+    strings that can be serialized.
+
+    If reason is given, warn when lazy inputs (iterators or input files) are
+    loaded into memory for that reason.
+    """
+
+    inputs = normalize_inputs(inputs)
+    if reason is not None and is_lazy_inputs(inputs):
+        warnings.warn('%s loads all inputs into memory. Use sandbox=False '
+                      'without a cache to read lazy inputs on demand.'
+                      % reason)
+    return [list(x) for x in inputs]
+
+
+def is_lazy_inputs(inputs):
+    """
+    Return True if normalized inputs are read on demand.
+    """
+
+    return (not isinstance(inputs, list) or
+            any(isinstance(x, InputFile) for x in inputs))
+
+
+def validate_limits(timeout=None, case_timeout=None, cpu_limit=None,
+                    memory_limit=None, output_limit=None):
+    """
+    Raise a ValueError if any of the given time or memory limits is invalid.
+    """
+
+    for name, value in [('timeout', timeout), ('case_timeout', case_timeout),
+                        ('cpu_limit', cpu_limit),
+                        ('memory_limit', memory_limit),
+                        ('output_limit', output_limit)]:
+        if value is not None and value <= 0:
+            raise ValueError('%s must be positive, got: %s' % (name, value))
+
+
+def run_test_cases(build_manager, inputs, timeout=None, fast=False,
+                   workers=1, answer_key=None, case_timeout=None,
+                   cpu_limit=None, memory_limit=None, output_limit=None,
+                   early_abort=True):
+    """
+    Run all test cases for the given inputs using a built build manager.
+
+    Return a list of TestCase instances in the same order as inputs. If
+    workers > 1, test cases are executed concurrently by up to the given number
+    of threads, each one driving a separate child process.
+
+    The timeout is a budget for running all test cases, while case_timeout,
+    cpu_limit, memory_limit and output_limit are applied to each test case.
+
+    If answer_key is given and early_abort is True, each test case is aborted
+    as soon as its output definitely does not match the corresponding test
+    case in answer key. In compare_streams mode, outputs are also compared
+    with the answer key by hash.
+    """
+
+    return list(iter_test_cases(build_manager, inputs, timeout=timeout,
+                                fast=fast, workers=workers,
+                                answer_key=answer_key,
+                                early_abort=early_abort,
+                                case_timeout=case_timeout,
+                                cpu_limit=cpu_limit,
+                                memory_limit=memory_limit,
+                                output_limit=output_limit))
+
+
+def iter_test_cases(build_manager, inputs, timeout=None, fast=False,
+                    workers=1, answer_key=None, case_timeout=None,
+                    cpu_limit=None, memory_limit=None, output_limit=None,
+                    early_abort=True):
+    """
+    Like :func:`run_test_cases`, but return an iterator that yields each
+    TestCase as soon as it finishes.
+
+    Test cases are always yielded in the same order as inputs. Closing the
+    iterator kills all test cases that are still running.
+    """
+
+    managers = iter_execution_managers(build_manager, inputs, answer_key,
+                                       cpu_limit=cpu_limit,
+                                       memory_limit=memory_limit,
+                                       output_limit=output_limit,
+                                       early_abort=early_abort)
+    deadline = None if timeout is None else time.monotonic() + timeout
+    run_case = functools.partial(run_with_deadline,
+                                 timeout=case_timeout, deadline=deadline)
+
+    # Execution managers (and their inputs) are created only when the test
+    # case is about to run, so inputs can be a lazy iterable
+    first = next(managers, None)
+    if first is None:
+        return
+    managers = itertools.chain([first], managers)
+
+    if workers == 1 or not first.is_thread_safe:
+        for ctrl in managers:
+            result = run_case(ctrl)
+            assert isinstance(result, TestCase)
+            yield result
+            if fast and result.is_error_test_case:
+                break
+        return
+
+    # Results must be in the same order of inputs. In fast mode, we cancel all
+    # test cases that come after the first error, but still wait for the ones
+    # that come before it. At most window test cases are scheduled or waiting
+    # to be yielded at any time.
+    window = 2 * workers
+    running = {}
+    results = {}
+    stop = inf
+    next_idx = submitted = 0
+    executor = ThreadPoolExecutor(max_workers=workers)
+    try:
+        while True:
+            while submitted - next_idx < window and submitted <= stop:
+                ctrl = next(managers, None)
+                if ctrl is None:
+                    break
+                running[executor.submit(run_case, ctrl)] = (submitted, ctrl)
+                submitted += 1
+            if not running:
+                break
+
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                idx, _ = running.pop(future)
+                if future.cancelled():
+                    continue
+                result = results[idx] = future.result()
+                assert isinstance(result, TestCase)
+                if fast and result.is_error_test_case and idx < stop:
+                    stop = idx
+                    for other, (other_idx, ctrl) in running.items():
+                        if other_idx > idx and not other.cancel():
+                            ctrl.cancel()
+            while next_idx in results and next_idx <= stop:
+                yield results.pop(next_idx)
+                next_idx += 1
+            if next_idx > stop:
+                break
+    finally:
+        for future, (_, ctrl) in running.items():
+            if not future.cancel() and not future.done():
+                ctrl.cancel()
+        executor.shutdown(wait=True)
+
+
+def run_with_deadline(ctrl, timeout=None, deadline=None):
+    """
+    Run execution manager with the given per-case timeout, but never past the
+    deadline (a time.monotonic() value).
+
+    Test cases are not even started if the deadline has already passed.
+    """
+
+    if deadline is not None:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            return ErrorTestCase.timeout()
+        timeout = remaining if timeout is None else min(timeout, remaining)
+    return ctrl.run(timeout)
+
+
+def execution_managers(build_manager, inputs, answer_key=None, **kwargs):
+    """
+    Return a list of execution managers for the given list of inputs and an
+    optional IoSpec answer key.
+
+    Additional keyword arguments are passed to all execution managers.
+    """
+
+    return list(iter_execution_managers(build_manager, inputs, answer_key,
+                                        **kwargs))
+
+
+def iter_execution_managers(build_manager, inputs, answer_key=None, **kwargs):
+    """
+    Like :func:`execution_managers`, but return an iterator that creates each
+    execution manager only when it is requested.
+    """
+
+    language = build_manager.language
+    if answer_key is None:
+        for x in inputs:
+            yield registry.execution_manager(language, build_manager, x,
+                                             **kwargs)
+    else:
+        for x, case in zip(inputs, answer_key):
+            yield registry.execution_manager(language, build_manager, x,
+                                             answer_key=case, **kwargs)
+
+
 def grade(source, iospec, lang=None, *,
           fast=True, path=None, raises=False, sandbox=False, timeout=None,
-          compare_streams=False):
+          compare_streams=False, workers=1, early_abort=False,
+          case_timeout=None, cpu_limit=None, memory_limit=None,
+          output_limit=None, cache=None, problem=None):
     """
     Grade the string of source code by comparing the results of all inputs and
     outputs in the given template structure.
@@ -194,17 +686,166 @@ def grade(source, iospec, lang=None, *,
             order to do this.
         timeout (float)
             Maximum time (in seconds) for the complete test to run.
+        case_timeout, cpu_limit (float)
+            Wall and CPU time limits (in seconds) for each test case. See
+            :func:`run`.
+        memory_limit, output_limit (int)
+            Memory and output limits for each test case. See :func:`run`.
+        workers (int)
+            Maximum number of test cases executed concurrently.
+        compare_streams (bool)
+            If True, compare the concatenated outputs of each test case. The
+            outputs of external programs are hashed while they are read and
+            only kept in memory if they differ from the expected outputs.
+        early_abort (bool)
+            If True, compare outputs with the expected ones while the program
+            runs and kill it at the first definitive mismatch. The grade is the
+            same, but programs that would eventually fail with a runtime error
+            or timeout are reported as wrong answers.
+        cache, problem
+            Result cache and problem name. See :func:`run`.
 
     Returns:
         A :class:`ejudge.Feedback` instance.
     """
 
+    return _grade(**locals())[0]
+
+
+def _grade(source, iospec, lang=None, normalized=False, **kwargs):
+    # Implements grade() and returns a tuple of (feedback, result). If
+    # normalized is True, the iospec was already normalized by the caller.
+    if isinstance(iospec, str):
+        iospec = ioparse(iospec)
+    if kwargs['early_abort'] or kwargs['compare_streams']:
+        kwargs['answer_key'] = iospec
+    result = run_worker(source, iospec, lang, **kwargs)[0]
+    feedback = get_feedback(result, iospec, stream=kwargs['compare_streams'],
+                            normalized=normalized)
+    return feedback, result
+
+
+def iter_grade(source, iospec, lang=None, *,
+               fast=True, path=None, raises=False, sandbox=False,
+               timeout=None, compare_streams=False, workers=1,
+               early_abort=False, case_timeout=None, cpu_limit=None,
+               memory_limit=None, output_limit=None):
+    """
+    Like :func:`grade`, but return an iterator that yields the feedback for
+    each test case as soon as it finishes.
+
+    Feedback is yielded in the same order as the test cases of the iospec and
+    ``feedback.testcase`` holds the corresponding response. The final grade
+    is the minimum of all partial grades. If the build fails, yields a single
+    build error feedback.
+
+    Accepts the same arguments as :func:`grade`.
+    """
+
     if isinstance(iospec, str):
         iospec = ioparse(iospec)
-    kwargs = locals()
-    kwargs['inputs'] = kwargs.pop('iospec')
-    result = run(**kwargs)
-    return get_feedback(result, iospec, stream=compare_streams)
+    stream = iter_run_worker(
+        source, iospec, lang,
+        fast=fast, path=path, raises=raises, sandbox=sandbox,
+        timeout=timeout, compare_streams=compare_streams, workers=workers,
+        case_timeout=case_timeout, cpu_limit=cpu_limit,
+        memory_limit=memory_limit, output_limit=output_limit,
+        answer_key=iospec if early_abort or compare_streams else None,
+        early_abort=early_abort,
+    )
+    try:
+        for testcase, answer_key in zip(stream, iospec):
+            yield get_feedback(testcase, answer_key, stream=compare_streams)
+    finally:
+        stream.close()
+
+
+def grade_many(submissions, iospec, lang=None, *, workers=None,
+               fast=True, sandbox=False, timeout=None, compare_streams=False,
+               early_abort=False, case_timeout=None, cpu_limit=None,
+               memory_limit=None, output_limit=None, cache=None, problem=None,
+               results=False):
+    """
+    Grade many submissions against the same iospec.
+
+    The iospec is parsed and normalized only once and identical sources are
+    graded a single time. Submissions are built and executed concurrently by
+    a pool of threads, each driving its own build and child processes.
+
+    Args:
+        submissions (mapping or sequence)
+            A mapping from submission ids to source strings (or file objects)
+            or a sequence of (submission_id, source) pairs. Items may also be
+            (submission_id, source, lang) triples in order to override the
+            language of individual submissions.
+        iospec (IOSpec parse tree)
+            The expected template for correct answers.
+        lang (str)
+            Programming language for all submissions.
+        workers (int)
+            Maximum number of submissions graded concurrently. Defaults to the
+            number of CPUs. Test cases of each submission always run
+            sequentially.
+        results (bool)
+            If True, yield the IoSpec returned by :func:`run` for each
+            submission together with its feedback.
+
+    All other arguments have the same meaning as in :func:`grade`.
+
+    Yields:
+        (submission_id, feedback) pairs, or (submission_id, feedback, result)
+        triples if results=True, in the order submissions finish. Submissions
+        with identical sources share the same objects.
+    """
+
+    if isinstance(iospec, str):
+        iospec = ioparse(iospec)
+    iospec = iospec.copy()
+    iospec.normalize(stream=compare_streams)
+    if workers is None:
+        workers = os.cpu_count() or 1
+    elif workers < 1:
+        raise ValueError('workers must be positive, got: %s' % workers)
+    if hasattr(submissions, 'items'):
+        submissions = submissions.items()
+    kwargs = dict(
+        fast=fast, path=None, raises=False, sandbox=sandbox, timeout=timeout,
+        compare_streams=compare_streams, workers=1, early_abort=early_abort,
+        case_timeout=case_timeout, cpu_limit=cpu_limit,
+        memory_limit=memory_limit, output_limit=output_limit, cache=cache,
+        problem=problem,
+    )
+
+    # Group submissions with the same source and language
+    sources = collections.OrderedDict()
+    for submission_id, source, *args in submissions:
+        lang_ = args[0] if args else lang
+        if not isinstance(source, str):
+            if lang_ is None:
+                lang_ = registry.language_from_source(source)
+            source = source.read()
+        sources.setdefault((source, lang_), []).append(submission_id)
+    logger.info('grading %s unique sources' % len(sources))
+
+    executor = ThreadPoolExecutor(max_workers=workers)
+    futures = {}
+    try:
+        for (source, lang_), ids in sources.items():
+            future = executor.submit(_grade, source, iospec, lang_,
+                                     normalized=True, **kwargs)
+            futures[future] = ids
+        for future in as_completed(futures):
+            feedback, result = future.result()
+            for submission_id in futures[future]:
+                if results:
+                    yield submission_id, feedback, result
+                else:
+                    yield submission_id, feedback
+    finally:
+        # Do not start pending submissions if the caller stops iterating
+        for future in futures:
+            future.cancel()
+        executor.shutdown(wait=True)
 
 
 def exec(source, lang=None, path=None):
@@ -219,9 +860,10 @@ def exec(source, lang=None, path=None):
         lang, source, path,
         is_sandboxed=False,
     )
-    build_manager.build()
-    ctrl = registry.execution_manager(lang, build_manager)
-    ctrl.run_interactive()
+    with build_manager:
+        build_manager.build()
+        ctrl = registry.execution_manager(lang, build_manager)
+        ctrl.run_interactive()
 
 
 def _error_test_case(exc, tb, limit=None):
@@ -0,0 +1,180 @@
+"""
+Lazy sources of test case inputs.
+
+:func:`ejudge.run` and friends accept any iterable of test cases as inputs.
+Lists are used as they are, while other iterables are consumed lazily: the
+inputs of each test case are only read when it is about to run. The sources in
+this module read test cases from files, so grading against tens of thousands
+of generated cases does not require loading all of them into memory.
+"""
+
+import collections.abc
+import fnmatch
+import mmap
+import os
+import re
+
+DIGITS = re.compile(r'(\d+)')
+
+
+class InputFile(collections.abc.Sequence):
+    """
+    The inputs of a single test case stored in a file, one input per line.
+
+    The file is only read when its lines are needed. Programs executed in
+    compare_streams mode read the file directly from their standard input,
+    hence large inputs are never copied or decoded by ejudge before the
+    program runs.
+
+    Args:
+        path (str):
+            Path to the input file.
+        encoding (str):
+            Encoding of the input file.
+    """
+
+    def __init__(self, path, encoding='utf8'):
+        self.path = path
+        self.encoding = encoding
+        self._lines = None
+
+    def __repr__(self):
+        return '<InputFile %r>' % self.path
+
+    def __len__(self):
+        return len(self.lines)
+
+    def __getitem__(self, idx):
+        return self.lines[idx]
+
+    def __iter__(self):
+        return iter(self.lines)
+
+    @property
+    def lines(self):
+        """
+        List of input strings.
+        """
+
+        if self._lines is None:
+            with open(self.path, encoding=self.encoding) as file:
+                self._lines = file.read().splitlines()
+        return self._lines
+
+    def open(self):
+        """
+        Return the input file opened in binary mode.
+        """
+
+        return open(self.path, 'rb')
+
+    def count_lines(self):
+        """
+        Return the number of input lines without decoding the file.
+
+        Only newline characters are line breaks, hence the result may differ
+        from len() for files with other line break characters.
+        """
+
+        if self._lines is not None:
+            return len(self._lines)
+        count = 0
+        last = b''
+        with self.open() as file:
+            for chunk in iter(lambda: file.read(2 ** 16), b''):
+                count += chunk.count(b'\n')
+                last = chunk[-1:]
+        if last not in (b'', b'\n'):
+            count += 1
+        return count
+
+
+class InputDirectory:
+    """
+    A directory with one file per test case.
+
+    Yields an :class:`InputFile` for each file. Files are sorted by name, with
+    numbers compared by value (so "2.in" comes before "10.in").
+
+    Args:
+        path (str):
+            Path to the directory.
+        pattern (str):
+            Glob pattern for the input files.
+        encoding (str):
+            Encoding of the input files.
+    """
+
+    def __init__(self, path, pattern='*.in', encoding='utf8'):
+        self.path = path
+        self.pattern = pattern
+        self.encoding = encoding
+        names = fnmatch.filter(os.listdir(path), pattern)
+        self.files = [os.path.join(path, name)
+                      for name in sorted(names, key=natural_sort_key)]
+
+    def __repr__(self):
+        return '<InputDirectory %r (%s files)>' % (self.path, len(self.files))
+
+    def __len__(self):
+        return len(self.files)
+
+    def __iter__(self):
+        for path in self.files:
+            yield InputFile(path, self.encoding)
+
+
+class DelimitedInputFile:
+    """
+    A single file with the inputs of all test cases.
+
+    Each line is an input string and test cases are separated by lines equal
+    to the separator. Empty test cases are ignored. The file is memory mapped,
+    hence only the pages of the test cases being executed are kept in memory.
+
+    Args:
+        path (str):
+            Path to the file.
+        separator (str):
+            The separator line. The default is an empty line, just like
+            test cases in iospec files.
+        encoding (str):
+            Encoding of the input file.
+    """
+
+    def __init__(self, path, separator='', encoding='utf8'):
+        self.path = path
+        self.separator = separator
+        self.encoding = encoding
+
+    def __repr__(self):
+        return '<DelimitedInputFile %r>' % self.path
+
+    def __iter__(self):
+        with open(self.path, 'rb') as file:
+            if os.fstat(file.fileno()).st_size == 0:
+                return
+            with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                yield from self._iter_cases(data)
+
+    def _iter_cases(self, data):
+        separator = self.separator.encode(self.encoding)
+        case = []
+        for line in iter(data.readline, b''):
+            line = line.rstrip(b'\r\n')
+            if line == separator:
+                if case:
+                    yield case
+                case = []
+            else:
+                case.append(line.decode(self.encoding))
+        if case:
+            yield case
+
+
+def natural_sort_key(name):
+    """
+    Key function that sorts strings with numbers by their numeric values.
+    """
+
+    return [int(x) if x.isdigit() else x for x in DIGITS.split(name)]
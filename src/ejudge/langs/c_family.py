@@ -1,9 +1,15 @@
+import hashlib
+import os
+import re
 import subprocess
 import tempfile
+import time
 
 import shutil
 
+from ejudge.build_cache import compiler_identity, default_cache_path
 from ejudge.build_manager import CompiledLanguageBuildManager
+from ejudge.exceptions import BuildError
 from ejudge.execution_manager import CompiledLanguageExecutionManager
 
 
@@ -23,10 +29,14 @@ class CLanguageBuildManager(CompiledLanguageBuildManager):
     source_extension = '.c'
     language = 'c'
     shell_checker_args = ['gcc', '-fsyntax-only']
+    single_pass_build = True
 
     def syntax_check(self):
         c_syntax_check(self.source, compiler='gcc')
 
+    def classify_build_error(self, output):
+        return c_classify_build_error(output, self.get_source_filename())
+
 
 class CLanguageExecutionManager(CompiledLanguageExecutionManager):
     """
@@ -73,10 +83,69 @@ class ClangBuildManager(CLanguageBuildManager):
 class CppBuildManager(CompiledLanguageBuildManager):
     """
     Base class for C++ builders.
+
+    Sources that include one of the headers listed in precompiled_headers
+    are compiled against a precompiled version of that header. Precompiled
+    headers are created on demand and shared between builds in the
+    precompiled_header_path directory (which defaults to the "pch" folder in
+    ejudge's cache dir). Set precompiled_headers to an empty sequence to
+    disable this feature.
     """
 
     source_extension = '.cpp'
     language = 'c++'
+    single_pass_build = True
+    precompiled_headers = ('bits/stdc++.h', 'iostream')
+    precompiled_header_extension = '.gch'
+    precompiled_header_path = None
+
+    def classify_build_error(self, output):
+        return c_classify_build_error(output, self.get_source_filename())
+
+    def get_build_args(self):
+        args = super().get_build_args()
+        header = self.get_precompiled_header(args)
+        if header is not None:
+            args[1:1] = ['-include', header]
+        return args
+
+    def get_cache_args(self):
+        # Precompiled headers do not change the resulting executable and
+        # should not be created just to look up the executable cache.
+        return CompiledLanguageBuildManager.get_build_args(self)
+
+    def get_precompiled_header(self, build_args):
+        """
+        Return the path of the precompiled header wrapper that should be
+        included when compiling the source, or None if no precompiled header
+        can be used.
+        """
+
+        included = c_included_headers(self.source)
+        for header in self.precompiled_headers:
+            if header in included:
+                break
+        else:
+            return None
+
+        t0 = time.time()
+        path = self.precompiled_header_path or default_cache_path('pch')
+        try:
+            wrapper, created = c_precompiled_header(
+                header, build_args,
+                path=path,
+                source_name=self.get_source_filename(),
+                extension=self.precompiled_header_extension,
+            )
+        except (BuildError, OSError) as ex:
+            self.log('warning', 'could not precompile <%s>: %s' % (header, ex))
+            return None
+
+        if created:
+            self.log('info', 'precompiled <%s> in %s sec' %
+                     (header, time.time() - t0))
+        self.log('info', 'using precompiled header <%s>' % header)
+        return wrapper
 
 
 class GccCppBuildManager(CppBuildManager):
@@ -85,7 +154,7 @@ class GccCppBuildManager(CppBuildManager):
     """
 
     language = 'g++'
-    build_args = ['g++', '-lm', '-o', 'main.cpp', '-o', 'main.exe']
+    build_args = ['g++', '-lm', 'main.cpp', '-o', 'main.exe']
 
     def syntax_check(self):
         c_syntax_check(self.source, compiler='g++', cpp=True)
@@ -97,12 +166,113 @@ class ClangCppBuildManager(CppBuildManager):
     """
 
     language = 'clang++'
-    build_args = ['clang++', '-lm', '-o', 'main.cpp', '-o', 'main.exe']
+    precompiled_header_extension = '.pch'
+    build_args = ['clang++', '-lm', 'main.cpp', '-o', 'main.exe']
 
     def syntax_check(self):
         c_syntax_check(self.source, compiler='clang++', cpp=True)
 
 
+def c_classify_build_error(output, source_name):
+    """
+    Classify the output of a failed C/C++ compilation.
+
+    Return a SyntaxError if the compiler emitted any diagnostic error for the
+    given source file and a BuildError otherwise. Errors in the later stages
+    of the build (e.g., undefined references reported by the linker) are not
+    detected by ``CC -fsyntax-only`` and thus are not considered syntax errors.
+    """
+
+    regex = re.compile(
+        r'^%s(:\d+)+: (fatal )?error' % re.escape(source_name),
+        re.MULTILINE,
+    )
+    if regex.search(output):
+        return SyntaxError(output)
+    return BuildError(output)
+
+
+def c_included_headers(source):
+    """
+    Return a set with all system headers (i.e., #include <header>) included by
+    the given C/C++ source.
+    """
+
+    return set(re.findall(r'^\s*#\s*include\s*<([^>]+)>', source,
+                          re.MULTILINE))
+
+
+def c_precompiled_header(header, build_args, path, source_name='main.cpp',
+                         extension='.gch', timeout=60):
+    """
+    Create a precompiled version of the given system header, if it does not
+    exist yet.
+
+    Return a tuple (wrapper, created) with the path of a header file that
+    includes the requested header and should be passed to the compiler with the
+    ``-include`` flag, and a boolean telling if the precompiled header was
+    created in this call. Raises a BuildError if compilation fails.
+
+    Args:
+        header (str):
+            Name of the header (e.g., 'iostream' or 'bits/stdc++.h').
+        build_args (list):
+            Arguments used to build the program. Precompiled headers are only
+            valid for the same compiler and compilation flags, hence each
+            combination is stored in a different location.
+        path (str):
+            Root directory in which precompiled headers are stored.
+        source_name (str):
+            Name of the source file in build_args.
+        extension (str):
+            Extension of the precompiled header file: '.gch' for gcc and '.pch'
+            for clang.
+        timeout (float):
+            Maximum time allowed for compilation.
+    """
+
+    # Strip the source file, the output and linker flags since they do not
+    # affect the generated precompiled header.
+    compiler, *args = build_args
+    flags = []
+    args = iter(args)
+    for arg in args:
+        if arg == '-o':
+            next(args, None)
+        elif arg != source_name and not arg.startswith(('-l', '-L')):
+            flags.append(arg)
+
+    data = '\0'.join([compiler_identity(compiler), header] + flags)
+    key = hashlib.sha256(data.encode('utf8')).hexdigest()[:32]
+    base = os.path.join(path, key)
+    wrapper = os.path.join(base, 'pch.h')
+    if os.path.exists(wrapper + extension):
+        return wrapper, False
+
+    os.makedirs(base, exist_ok=True)
+    with open(wrapper, 'w') as F:
+        F.write('#include <%s>\n' % header)
+
+    # Compile to a temporary location and move it so concurrent builds never
+    # see a partially written file.
+    fd, tmp_path = tempfile.mkstemp(dir=base, suffix=extension)
+    os.close(fd)
+    cmd = [compiler] + flags + ['-x', 'c++-header', wrapper, '-o', tmp_path]
+    try:
+        subprocess.check_output(cmd, stderr=subprocess.STDOUT,
+                                timeout=timeout)
+        os.chmod(tmp_path, 0o644)
+        os.replace(tmp_path, wrapper + extension)
+    except subprocess.CalledProcessError as ex:
+        raise BuildError(ex.output.decode('utf8'))
+    except (OSError, subprocess.TimeoutExpired) as ex:
+        raise BuildError(str(ex))
+    finally:
+        if os.path.exists(tmp_path):
+            os.unlink(tmp_path)
+    return wrapper, True
+
+
 def c_syntax_check(source, compiler=None, cpp=False, encoding='utf8'):
     """
     Check syntax of C code.
@@ -17,7 +17,7 @@ class PythonBuildManager(IntegratedBuildManager):
     language = 'python'
 
     def syntax_check(self):
-        python3_syntax_check(self.source)
+        self.code = python3_syntax_check(self.source)
 
 
 class PythonExecutionManager(IntegratedExecutionManager):
@@ -91,10 +91,12 @@ class Python2ExecutionManager(InterpretedLanguageExecutionManager):
 def python3_syntax_check(source):
     """
     Checks if string of source code is valid Python 3 syntax.
+
+    Return the compiled code object.
     """
 
     try:
-        compile(source, 'main.py', 'exec')
+        return compile(source, 'main.py', 'exec')
     except SyntaxError as ex:
         msg = format_traceback(ex, source)
         raise SyntaxError(msg)
@@ -19,6 +19,7 @@ class PytugaBuildManager(IntegratedBuildManager):
         super().build()
         self.is_built = False
         self.transpiled = pytuga.transpile(self.source)
+        self.code = compile(self.transpiled, '<string>', 'exec')
         self.is_built = True
 
     def get_modules(self):
@@ -32,6 +33,9 @@ class PytugaExecutionManager(IntegratedExecutionManager):
 
     language = 'pytuga'
 
+    # Functions in the tugalib call print() and input() from builtins
+    patch_global_builtins = True
+
     @property
     def transpiled(self):
         return self.build_manager.transpiled
@@ -40,4 +44,5 @@ class PytugaExecutionManager(IntegratedExecutionManager):
         if globals is None:
             globals = {}
         globals.update(pytuga.tugalib_namespace(forbidden=True))
-        builtins.exec(self.transpiled, globals, locals)
\ No newline at end of file
+        builtins.exec(self.build_manager.code or self.transpiled, globals,
+                      locals)
\ No newline at end of file
@@ -0,0 +1,352 @@
+"""
+Incremental comparison of program outputs with an expected test case.
+
+Used by the early-abort grading mode: execution managers feed each output
+chunk and each consumed input to an :class:`OutputMatcher` while the program
+runs, and kill the program as soon as the response can no longer be accepted.
+
+Programs graded with compare_streams=True are also compared by hash: the
+:class:`OutputDigest` of the output is computed while it is read and the full
+output is only kept if it differs from the digest of the expected output.
+"""
+
+import codecs
+import decimal
+import hashlib
+import re
+import tempfile
+
+from iospec import In, Out, IoSpec, ErrorTestCase, StandardTestCase
+from iospec.feedback import Feedback, get_feedback as iospec_get_feedback, \
+    presentation_equal
+
+from ejudge.util import read_truncated
+
+SPACES = re.compile(r'(\s+)')
+LINE_BREAKS = re.compile('[\r\x0b\x0c\x1c-\x1e\x85\u2028\u2029]')
+
+
+class OutputMatcher:
+    """
+    Compare outputs of a running program with the outputs of an answer key.
+
+    A mismatch is only reported when it is definitive, i.e., no continuation of
+    the current output could be accepted even as a presentation error. Strings
+    are compared after case-folding and collapsing all whitespace, just like
+    :func:`iospec.feedback.presentation_equal`. Since all definitive mismatches
+    are wrong answers, aborting the program does not change its grade.
+
+    Args:
+        answer_key (TestCase):
+            The expected test case.
+        stream (bool):
+            If True, compare the concatenated outputs of the program like
+            a ``compare_streams=True`` run.
+    """
+
+    def __init__(self, answer_key, stream=False):
+        answer_key = answer_key.copy()
+        answer_key.normalize(stream=stream)
+        self.stream = stream
+        self.expected = [presentation_normalize(x)
+                         for x in answer_key if type(x) is Out]
+        self.is_valid = True
+        self._segment = 0
+        self._text = ''
+        self._space = False
+
+        # We do not try to match ellipsis, regex or other special atoms
+        self.is_enabled = all(type(x) in (In, Out) for x in answer_key)
+
+    def feed_output(self, data):
+        """
+        Register output string.
+
+        Return False if the output definitely does not match the answer key.
+        """
+
+        if not (self.is_enabled and self.is_valid):
+            return self.is_valid
+        if self._segment >= len(self.expected):
+            self.is_valid = not data.strip()
+            return self.is_valid
+
+        start = len(self._text)
+        parts = []
+        for token in SPACES.split(data.casefold()):
+            if not token:
+                continue
+            elif token.isspace():
+                self._space = bool(self._text or parts)
+            else:
+                if self._space:
+                    parts.append(' ')
+                    self._space = False
+                parts.append(token)
+
+        if parts:
+            self._text += ''.join(parts)
+            expected = self.expected[self._segment]
+            end = len(self._text)
+            self.is_valid = expected[start:end] == self._text[start:]
+        return self.is_valid
+
+    def feed_input(self):
+        """
+        Register that the program has consumed an input string. Any further
+        output belongs to the next output segment.
+
+        Return False if the output definitely does not match the answer key.
+        """
+
+        if self.stream or not (self.is_enabled and self.is_valid):
+            return self.is_valid
+        if self._segment < len(self.expected):
+            self.is_valid = self._text == self.expected[self._segment]
+        self._segment += 1
+        self._text = ''
+        self._space = False
+        return self.is_valid
+
+
+def presentation_normalize(data):
+    """
+    Normalize string as in :func:`iospec.feedback.presentation_equal`.
+    """
+
+    return ' '.join(str(data).casefold().split())
+
+
+class OutputDigest:
+    """
+    Incremental hash of a normalized output stream.
+
+    Output is normalized just like the result of a ``compare_streams=True``
+    run: Windows line endings are converted and trailing whitespace of each
+    line and of the whole output is ignored. Outputs with the same digest are
+    considered equal by :func:`iospec.feedback.get_feedback`.
+
+    Only the whitespace that might still be discarded is kept in memory.
+
+    Args:
+        strip_leading (bool):
+            If True, leading newlines are ignored when the output ends with
+            an empty line. IoSpec strips them when normalizing the results of
+            programs with more than one input or with no inputs.
+        encoding (str):
+            Encoding used to decode the bytes passed to .feed_bytes().
+    """
+
+    def __init__(self, strip_leading=False, encoding='utf8'):
+        self.strip_leading = strip_leading
+
+        #: False if the output has line breaks other than "\n" and "\r\n",
+        #: which IoSpec normalizes differently. Those outputs have no digest.
+        self.is_exact = True
+        self._hash = hashlib.sha256()
+        self._decoder = codecs.getincrementaldecoder(encoding)('replace')
+        self._is_started = False
+        self._leading = 0
+        self._newlines = 0
+        self._spaces = ''
+        self._tail = ''
+        self._cr = ''
+
+    def feed_bytes(self, data):
+        """
+        Register a chunk of raw output bytes.
+        """
+
+        self.feed(self._decoder.decode(data))
+
+    def feed(self, data):
+        """
+        Register output string.
+        """
+
+        # A "\r" at the end of the chunk may be part of a "\r\n"
+        data = self._cr + data
+        self._cr = ''
+        if data.endswith('\r'):
+            data, self._cr = data[:-1], '\r'
+        if '\r' in data:
+            data = data.replace('\r\n', '\n')
+        if not data:
+            return
+        if LINE_BREAKS.search(data):
+            self.is_exact = False
+        self._tail = (self._tail + data[-2:])[-2:]
+
+        for idx, line in enumerate(data.split('\n')):
+            if idx and self._is_started:
+                self._newlines += 1
+                self._spaces = ''
+            elif idx:
+                self._leading += 1
+            if not line:
+                continue
+            self._is_started = True
+            text = line.rstrip()
+            if text:
+                self._hash.update(
+                    ('\n' * self._newlines + self._spaces + text)
+                    .encode('utf8', 'surrogatepass')
+                )
+                self._newlines = 0
+                self._spaces = line[len(text):]
+            else:
+                self._spaces += line
+
+    def hexdigest(self):
+        """
+        Return the digest of the output registered so far or None if the
+        output cannot be compared by hash.
+        """
+
+        self.feed(self._decoder.decode(b'', final=True))
+        if self._cr:
+            self.is_exact = False
+        if not self.is_exact:
+            return None
+        leading = self._leading if self._is_started else 0
+        if self.strip_leading and self._tail == '\n\n':
+            leading = 0
+        data = '%s:%s' % (leading, self._hash.hexdigest())
+        return hashlib.sha256(data.encode('ascii')).hexdigest()
+
+
+def output_digest(data):
+    """
+    Return the :class:`OutputDigest` hex digest of a string.
+    """
+
+    digest = OutputDigest()
+    digest.feed(data)
+    return digest.hexdigest()
+
+
+def expected_stream_output(answer_key):
+    """
+    Return the expected output string of a test case compared with
+    compare_streams=True or None if it cannot be compared by hash.
+    """
+
+    if not (isinstance(answer_key, StandardTestCase)
+            and all(type(x) in (In, Out) for x in answer_key)):
+        return None
+    answer_key = answer_key.copy()
+    answer_key.normalize(stream=True)
+    return str(answer_key[-1]) if answer_key else ''
+
+
+class StreamComparison:
+    """
+    Compare the raw output of a program with an expected output string by
+    hash while the output is read.
+
+    The output is also spooled to a temporary file so it can be read back if
+    the digests differ. If expected is None or cannot be compared by hash,
+    the digest and sink attributes are None and the output must be kept by
+    the caller.
+
+    Args:
+        expected (str):
+            The expected output (see :func:`expected_stream_output`).
+        strip_leading (bool):
+            Passed to :class:`OutputDigest`.
+        spool_size (int):
+            Outputs are kept in memory up to this size (in bytes) and spooled
+            to a temporary file after that.
+    """
+
+    def __init__(self, expected, strip_leading=False, spool_size=2 ** 20):
+        self.expected = expected
+        self.expected_digest = None
+        self.digest = self.spool = self.sink = None
+        if expected is not None:
+            self.expected_digest = output_digest(expected)
+        if self.expected_digest is not None:
+            self.digest = OutputDigest(strip_leading=strip_leading)
+            self.spool = tempfile.SpooledTemporaryFile(spool_size)
+            self.sink = self._write
+
+    def _write(self, chunk):
+        self.digest.feed_bytes(chunk)
+        self.spool.write(chunk)
+
+    def is_match(self):
+        """
+        Return True if the output read so far matches the expected output.
+        """
+
+        return self.digest.hexdigest() == self.expected_digest
+
+    def read(self, keep=None):
+        """
+        Read back the spooled output.
+
+        Return a tuple with the data and the number of dropped bytes. If keep
+        is given, only the first and last keep bytes are returned.
+        """
+
+        self.spool.seek(0)
+        if keep is None:
+            return self.spool.read(), 0
+        return read_truncated(self.spool, keep)
+
+    def close(self):
+        """
+        Remove the spooled output.
+        """
+
+        if self.spool is not None:
+            self.spool.close()
+
+
+def get_feedback(response, answer_key, stream=False, normalized=False):
+    """
+    Like :func:`iospec.feedback.get_feedback`, but accepts test cases whose
+    output was already matched by hash without comparing their outputs again.
+
+    Those test cases have a "digest_match" meta attribute set to True.
+
+    If normalized is True, the answer key must have been normalized with
+    ``answer_key.normalize(stream=stream)`` and it is used as is instead of
+    being copied and normalized again.
+    """
+
+    if isinstance(response, IoSpec):
+        feedback = None
+        for case, key in zip(response, answer_key):
+            case_feedback = get_feedback(case, key, stream=stream,
+                                         normalized=normalized)
+            if feedback is None or case_feedback.grade < feedback.grade:
+                feedback = case_feedback
+                if feedback.grade == 0:
+                    break
+        return feedback
+
+    if (stream and response.meta.get('digest_match')
+            and not isinstance(response, ErrorTestCase)):
+        return Feedback(response, answer_key, grade=decimal.Decimal(1),
+                        status='ok')
+    if not normalized:
+        return iospec_get_feedback(response, answer_key, stream=stream)
+
+    # Same as iospec_get_feedback(), but only the response is normalized
+    response = response.copy()
+    response.normalize(stream=stream)
+    grade = decimal.Decimal(0)
+    if isinstance(response, ErrorTestCase):
+        status = response.error_type + '-error'
+    elif answer_key.is_equal(response):
+        status = 'ok'
+        grade = decimal.Decimal(1)
+    elif presentation_equal(response, answer_key):
+        status = 'presentation-error'
+        grade = decimal.Decimal('0.5')
+    elif isinstance(response, StandardTestCase):
+        status = 'wrong-answer'
+    else:
+        raise ValueError('invalid testcase: \n%s' % response.format())
+    return Feedback(response, answer_key, grade=grade, status=status)
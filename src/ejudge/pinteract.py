@@ -0,0 +1,487 @@
+"""
+Blocking interaction with child processes.
+
+:class:`Pinteract` has the same interface as :class:`boxed.pinteract.Pinteract`
+and attaches the child process to a pseudo-terminal in the same way, so
+programs keep their interactive (line buffered) behavior. Unlike boxed, which
+lets pexpect reap its children, processes are reaped with os.wait4() so their
+resource usage is available after they finish. Resource limits can be set in
+the child before the program starts and its output can be limited.
+
+:class:`Process` is the equivalent helper for programs that talk through
+pipes. The asyncio counterparts of both classes live in
+:mod:`ejudge.async_pinteract`.
+"""
+
+import codecs
+import os
+import pty
+import select
+import selectors
+import signal
+import subprocess
+import termios
+import time
+
+import psutil
+
+from ejudge.util import OutputBuffer
+
+inf = float('inf')
+
+
+def open_pty():
+    """
+    Return the (master, slave) file descriptors of a new pseudo-terminal with
+    echo disabled.
+    """
+
+    master, slave = pty.openpty()
+    attrs = termios.tcgetattr(slave)
+    attrs[3] &= ~termios.ECHO
+    termios.tcsetattr(slave, termios.TCSANOW, attrs)
+    return master, slave
+
+
+class BaseProcess:
+    """
+    Common implementation of :class:`Process` and
+    :class:`ejudge.async_pinteract.AsyncProcess`.
+
+    The constructor accepts the same arguments as :class:`subprocess.Popen`.
+    After the process finishes, the exit status is stored in the
+    ``returncode`` attribute and its resource usage (as returned by
+    :func:`os.wait4`) in the ``rusage`` attribute. The returncode remains None
+    if the exit status of the process is unknown.
+    """
+
+    #: Polling interval used while waiting for the process to finish.
+    poll_interval = 0.005
+
+    #: Set by communicate() if the process was killed for exceeding the
+    #: output limit.
+    output_exceeded = False
+
+    #: Number of output bytes dropped by communicate() after the output limit
+    #: was exceeded.
+    output_omitted = 0
+
+    def __init__(self, args, **kwargs):
+        self.popen = subprocess.Popen(args, **kwargs)
+        self.pid = self.popen.pid
+        self.returncode = None
+        self.rusage = None
+        self.is_reaped = False
+        self._output_size = 0
+
+    def _reap(self, flags=0):
+        if self.is_reaped:
+            return True
+        try:
+            pid, status, rusage = os.wait4(self.pid, flags)
+        except ChildProcessError:
+            # Someone else reaped the child and its exit status is lost. We
+            # must not report it as a successful execution.
+            pid, status, rusage = self.pid, None, None
+        if pid == 0:
+            return False
+
+        if status is None:
+            self.returncode = None
+        elif os.WIFSIGNALED(status):
+            self.returncode = -os.WTERMSIG(status)
+        else:
+            self.returncode = os.WEXITSTATUS(status)
+        self.popen.returncode = self.returncode
+        self.rusage = rusage
+        self.is_reaped = True
+        return True
+
+    def kill(self):
+        """
+        Send SIGKILL to the process if it is still running.
+        """
+
+        if not self.is_reaped:
+            try:
+                os.kill(self.pid, signal.SIGKILL)
+            except ProcessLookupError:
+                pass
+
+    def _read_output(self, fd, buffer, limit=None, sink=None):
+        # Read a chunk of output from fd and return False at the end of file
+        # or after the output limit is exceeded.
+        read_size = 65536
+        if limit is not None:
+            read_size = min(read_size, limit - self._output_size + 1)
+        try:
+            chunk = os.read(fd, read_size)
+        except BlockingIOError:
+            return True
+        except OSError:
+            chunk = b''
+        if chunk:
+            if sink is None:
+                buffer.write(chunk)
+            else:
+                sink(chunk)
+            self._output_size += len(chunk)
+            if limit is not None and self._output_size > limit:
+                self.output_exceeded = True
+                self.kill()
+                buffer.truncate()
+                return False
+        return bool(chunk)
+
+
+class Process(BaseProcess):
+    """
+    A child process that is reaped with os.wait4().
+
+    See :class:`BaseProcess` for the attributes set after the process
+    finishes.
+    """
+
+    def wait(self, timeout=None):
+        """
+        Wait for the process to finish and return its exit status.
+
+        Raises a TimeoutError if it is still running after timeout seconds.
+        """
+
+        if timeout is None:
+            self._reap()
+            return self.returncode
+
+        deadline = time.monotonic() + timeout
+        while not self._reap(os.WNOHANG):
+            if time.monotonic() > deadline:
+                raise TimeoutError
+            time.sleep(self.poll_interval)
+        return self.returncode
+
+    def communicate(self, data=b'', limit=None, sink=None, keep=4096,
+                    timeout=None):
+        """
+        Send data to stdin, close it and read stdout until the end of file.
+
+        Stdout must have been created with subprocess.PIPE. Data is ignored if
+        stdin is not a pipe. Return the output bytes after the process
+        finishes or raise a TimeoutError if it takes more than timeout
+        seconds.
+
+        If limit is given, the process is killed as soon as it writes more
+        than limit bytes and the output_exceeded attribute is set to True.
+        Reading stops at this point and only the first and last keep bytes of
+        the output are returned. The number of dropped bytes is stored in the
+        output_omitted attribute.
+
+        If sink is given, it is called with each chunk of output as soon as it
+        is read instead of keeping it in memory, and an empty bytes string is
+        returned.
+        """
+
+        deadline = None if timeout is None else time.monotonic() + timeout
+        buffer = OutputBuffer(keep, b'')
+        out_fd = self.popen.stdout.fileno()
+        stdin = self.popen.stdin
+        view = memoryview(data)
+        selector = selectors.DefaultSelector()
+        selector.register(out_fd, selectors.EVENT_READ)
+        if stdin is not None and view:
+            os.set_blocking(stdin.fileno(), False)
+            selector.register(stdin.fileno(), selectors.EVENT_WRITE)
+        elif stdin is not None:
+            stdin.close()
+
+        try:
+            eof = False
+            while not eof:
+                wait = None
+                if deadline is not None:
+                    wait = deadline - time.monotonic()
+                    if wait <= 0:
+                        raise TimeoutError
+                for key, _ in selector.select(wait):
+                    if key.fd == out_fd:
+                        eof = not self._read_output(out_fd, buffer, limit,
+                                                    sink)
+                        continue
+                    try:
+                        view = view[os.write(key.fd, view):]
+                    except BlockingIOError:
+                        continue
+                    except OSError:
+                        view = view[:0]  # the program stopped reading
+                    if not view:
+                        selector.unregister(key.fd)
+                        stdin.close()
+        finally:
+            selector.close()
+            self.popen.stdout.close()
+            if stdin is not None and not stdin.closed:
+                stdin.close()
+
+        if deadline is None:
+            self.wait()
+        else:
+            self.wait(max(deadline - time.monotonic(), 0))
+        self.output_omitted = buffer.omitted
+        return buffer.take()
+
+
+class BasePinteract:
+    """
+    Common implementation of :class:`Pinteract` and
+    :class:`ejudge.async_pinteract.AsyncPinteract`.
+
+    Args:
+        command (list):
+            Command line arguments used to start the child process.
+        timeout (float):
+            Total time budget for the interaction. A TimeoutError is raised
+            when the time is exhausted.
+        encoding (str):
+            Encoding used to decode/encode data sent to the child process.
+        cwd (str):
+            Working directory for the child process.
+        env (dict):
+            Environment variables for the child process.
+        on_output (callable):
+            Optional function called with each decoded output chunk as soon as
+            it arrives.
+        wait_running (bool):
+            If True, receive() keeps waiting while the process is running
+            instead of returning after a short period without output. This is
+            only safe if the process is limited by a timeout or an external
+            CPU limit.
+        output_limit (int):
+            Optional limit for the number of bytes written by the child
+            process. It is killed as soon as it exceeds the limit and the
+            output_exceeded attribute is set to True.
+        output_keep (int):
+            Number of characters kept from the beginning and from the end of
+            the unread output when the output limit is exceeded. The number of
+            dropped characters is stored in the output_omitted attribute.
+        preexec_fn (callable):
+            Optional function called in the child process before the command
+            is executed (e.g., to set resource limits).
+    """
+
+    #: Interval without any output after which we check if the process is
+    #: blocked waiting for input.
+    poll_interval = 0.05
+
+    def __init__(self, command, timeout=None, encoding='utf8', cwd=None,
+                 env=None, on_output=None, wait_running=False,
+                 output_limit=None, output_keep=4096, preexec_fn=None):
+        if timeout == inf:
+            timeout = None
+        self.command = list(command)
+        self.timeout = timeout
+        self.encoding = encoding
+        self.cwd = cwd
+        self.env = env
+        self.on_output = on_output
+        self.wait_running = wait_running
+        self.output_limit = output_limit
+        self.preexec_fn = preexec_fn
+        self.output_size = 0
+        self.output_exceeded = False
+        self.pid = None
+        self.process = None
+        self._deadline = None
+        self._is_burnt = False
+        self._master = None
+        self._buffer = OutputBuffer(output_keep)
+        self._eof = False
+        self._decoder = codecs.getincrementaldecoder(encoding)('replace')
+        self._psdata = None
+
+    @property
+    def output_omitted(self):
+        return self._buffer.omitted
+
+    def _spawn(self, process_class):
+        master, slave = open_pty()
+        try:
+            self.process = process_class(
+                self.command,
+                stdin=slave, stdout=slave, stderr=slave,
+                cwd=self.cwd, env=self.env,
+                start_new_session=True,
+                preexec_fn=self.preexec_fn,
+            )
+        except BaseException:
+            os.close(master)
+            raise
+        finally:
+            os.close(slave)
+
+        self.pid = self.process.pid
+        self._psdata = psutil.Process(self.pid)
+        if self.timeout is not None:
+            self._deadline = time.monotonic() + self.timeout
+        self._master = master
+        os.set_blocking(master, False)
+
+    def _read_output(self):
+        # Read a chunk of output from the terminal. Return False if there was
+        # nothing to read.
+        size = 65536
+        if self.output_limit is not None:
+            size = min(size, self.output_limit - self.output_size + 1)
+        try:
+            data = os.read(self._master, size)
+        except BlockingIOError:
+            return False
+        except OSError:
+            # Linux raises EIO when all slave descriptors are closed
+            data = b''
+        if self.output_limit is not None:
+            self.output_size += len(data)
+            if self.output_size > self.output_limit:
+                # Stop reading as if the process had closed its output
+                self.output_exceeded = True
+                self.process.kill()
+        if not data or self.output_exceeded:
+            self._eof = True
+        text = self._decoder.decode(data, final=self._eof)
+        if text:
+            self._buffer.write(text)
+            if self.on_output is not None:
+                self.on_output(text)
+        if self.output_exceeded:
+            self._buffer.truncate()
+        return True
+
+    def _take_output(self):
+        data = self._buffer.take()
+        return data.replace('\r\n', '\n')
+
+    def remaining_time(self):
+        """
+        Return the remaining time before a timeout.
+        """
+
+        if self._deadline is None:
+            return inf
+        return self._deadline - time.monotonic()
+
+    def status(self):
+        """
+        Return a string with the status code for the process.
+        """
+
+        try:
+            return self._psdata.status()
+        except psutil.NoSuchProcess:
+            return 'dead'
+
+    def is_dead(self):
+        """
+        Return True if child process is dead.
+        """
+
+        return self._eof or self.status() in ['zombie', 'dead']
+
+
+class Pinteract(BasePinteract):
+    """
+    Interact with a child process, blocking the current thread.
+
+    The child process is started by the constructor. See
+    :class:`BasePinteract` for the accepted arguments.
+    """
+
+    def __init__(self, command, **kwargs):
+        super().__init__(command, **kwargs)
+        self._spawn(Process)
+
+    def burn(self, duration):
+        """
+        Wait at most the given time (in seconds) for the process to leave the
+        "running" status.
+
+        Output is read while waiting, so the on_output callback may abort the
+        process early.
+        """
+
+        end = time.monotonic() + max(min(duration, self.remaining_time()), 0)
+        while time.monotonic() < end and not self._eof:
+            status = self.status()
+            if status in ['running', 'disk-sleep']:
+                ready, _, _ = select.select([self._master], [], [], 0.005)
+                if ready:
+                    self._read_output()
+            elif status in ['sleeping', 'zombie', 'dead']:
+                break
+            else:
+                raise RuntimeError('status: %s' % status)
+
+    def receive(self):
+        """
+        Read the output of the child process.
+        """
+
+        if not self._is_burnt:
+            self._is_burnt = True
+            self.burn(1 if self.timeout is None else self.timeout)
+
+        while not self._eof:
+            if self.remaining_time() < 0:
+                raise TimeoutError
+            ready, _, _ = select.select([self._master], [], [],
+                                        self.poll_interval)
+            if ready:
+                self._read_output()
+                continue
+            status = self.status()
+            if status == 'running' and self.remaining_time() <= 0:
+                raise TimeoutError
+            elif status == 'running' and self.wait_running:
+                continue
+            break
+
+        return self._take_output()
+
+    def send(self, data, end='\n'):
+        """
+        Write some input string of data to the child process.
+        """
+
+        if self.is_dead():
+            raise RuntimeError('trying to send message to a closed process')
+
+        view = memoryview((data + end).encode(self.encoding))
+        try:
+            while view:
+                try:
+                    view = view[os.write(self._master, view):]
+                except BlockingIOError:
+                    select.select([], [self._master], [], self.poll_interval)
+        except OSError:
+            raise RuntimeError('trying to send message to a closed process')
+
+    def finish(self):
+        """
+        Finish process execution and return any unread output.
+        """
+
+        try:
+            return self.receive()
+        finally:
+            self.close()
+
+    def close(self):
+        """
+        Kill child process and release the terminal.
+        """
+
+        if self.process is None:
+            return
+        self.process.kill()
+        self.process.wait()
+        if self._master is not None:
+            os.close(self._master)
+            self._master = None
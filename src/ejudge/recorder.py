@@ -0,0 +1,71 @@
+"""
+Recording of interactions of integrated programs.
+
+Programs that print thousands of lines spend most of their time in the
+print() replacement. The :class:`InteractionRecorder` keeps the printed
+strings as a list of fragments and only joins them into an Out atom when the
+program asks for an input or when execution ends.
+"""
+
+from iospec import In, Out
+
+
+class InteractionRecorder:
+    """
+    Record the outputs and inputs of a program into a list of In/Out atoms.
+
+    Args:
+        interaction (list):
+            List that receives the In/Out atoms. Output fragments are only
+            appended to it by .flush() and .add_input().
+    """
+
+    def __init__(self, interaction):
+        self.interaction = interaction
+        self._fragments = []
+
+        #: Register an output string. This is just the append method of the
+        #: fragments list, hence it is very cheap to call.
+        self.write = self._fragments.append
+
+    def flush(self):
+        """
+        Join all pending output fragments into an Out atom at the end of the
+        interaction.
+        """
+
+        if not self._fragments:
+            return
+        data = ''.join(self._fragments)
+        self._fragments.clear()
+        interaction = self.interaction
+        if interaction and isinstance(interaction[-1], Out):
+            interaction[-1] = Out(str(interaction[-1]) + data)
+        else:
+            interaction.append(Out(data))
+
+    def add_input(self, data):
+        """
+        Register an input string consumed by the program.
+        """
+
+        self.flush()
+        self.interaction.append(In(data))
+
+
+def format_print(args, sep=' ', end='\n'):
+    """
+    Return the string printed by ``print(*args, sep=sep, end=end)``.
+    """
+
+    if sep is None:
+        sep = ' '
+    elif not isinstance(sep, str):
+        raise TypeError('sep must be None or a string, not %s' %
+                        type(sep).__name__)
+    if end is None:
+        end = '\n'
+    elif not isinstance(end, str):
+        raise TypeError('end must be None or a string, not %s' %
+                        type(end).__name__)
+    return sep.join(map(str, args)) + end
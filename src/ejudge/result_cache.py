@@ -0,0 +1,297 @@
+"""
+Memoization of run results.
+
+Running the same source with the same inputs and options produces the same
+results for most problems. The :class:`ResultCache` stores the serialized
+IoSpec returned by :func:`ejudge.run` so resubmissions, regrades and
+copy-pasted answers are not executed again. Entries live in an in-memory LRU
+layer backed by a persistent on-disk layer and are grouped by problem, so all
+results of a problem can be invalidated at once (e.g., after fixing its test
+inputs).
+
+Results with timeouts are never stored since they depend on the load of the
+machine.
+"""
+
+import collections
+import hashlib
+import json
+import logging
+import os
+import shutil
+import tempfile
+import threading
+import time
+from urllib.parse import quote
+
+from ejudge.build_cache import default_cache_path, TEMP_PREFIX
+from ejudge.util import iospec_from_json
+
+logger = logging.getLogger('ejudge')
+
+#: Default maximum number of results kept in memory.
+DEFAULT_MAX_ENTRIES = 1024
+
+#: Default maximum size (in bytes) of the on-disk layer.
+DEFAULT_MAX_SIZE = 256 * 1024 * 1024
+
+#: Options of run() that may change its results.
+KEY_OPTIONS = ('fast', 'timeout', 'compare_streams', 'case_timeout',
+               'cpu_limit', 'memory_limit', 'output_limit', 'answer_key',
+               'early_abort')
+
+
+class ResultCache:
+    """
+    A two-level (memory and disk) cache of run results.
+
+    Args:
+        path (str):
+            Directory in which results are stored. Defaults to the "results"
+            folder inside :func:`ejudge.build_cache.default_cache_path`.
+        max_entries (int):
+            Maximum number of results kept in the in-memory layer.
+        max_size (int):
+            Maximum size of the on-disk layer, in bytes.
+        ttl (float):
+            Results older than ttl seconds are discarded. By default, results
+            never expire.
+        persistent (bool):
+            If False, results are only kept in memory.
+    """
+
+    def __init__(self, path=None, max_entries=DEFAULT_MAX_ENTRIES,
+                 max_size=DEFAULT_MAX_SIZE, ttl=None, persistent=True):
+        if ttl is not None and ttl <= 0:
+            raise ValueError('ttl must be positive, got: %s' % ttl)
+        self.path = path or default_cache_path('results')
+        self.max_entries = max_entries
+        self.max_size = max_size
+        self.ttl = ttl
+        self.persistent = persistent
+        self.hits = 0
+        self.misses = 0
+        self._memory = collections.OrderedDict()
+        self._disk_size = None
+        self._lock = threading.Lock()
+
+    def __repr__(self):
+        return '<ResultCache %r (hits=%s, misses=%s)>' % (
+            self.path, self.hits, self.misses
+        )
+
+    def key(self, source, inputs, lang, options=None):
+        """
+        Return the cache key for running source with the given list of inputs
+        and options.
+
+        Only the options listed in KEY_OPTIONS are considered, since other
+        options do not change the results.
+        """
+
+        options = options or {}
+        options = {k: options.get(k) for k in KEY_OPTIONS}
+        if hasattr(options['answer_key'], 'to_json'):
+            options['answer_key'] = options['answer_key'].to_json()
+        data = json.dumps([source, inputs, lang, options], sort_keys=True,
+                          default=str)
+        return hashlib.sha256(data.encode('utf8')).hexdigest()
+
+    def entry_path(self, key, problem=None):
+        """
+        Return the path to the on-disk entry for the given key.
+        """
+
+        return os.path.join(self._problem_path(problem), key[:2],
+                            key + '.json')
+
+    def _problem_path(self, problem):
+        if problem is None:
+            return os.path.join(self.path, 'default')
+        return os.path.join(self.path, 'problem-' + quote(str(problem), ''))
+
+    def _is_expired(self, entry):
+        if self.ttl is None:
+            return False
+        return time.time() - entry['created'] > self.ttl
+
+    def get(self, key, problem=None):
+        """
+        Return the IoSpec stored under the given key or None if the key is not
+        in the cache.
+
+        Each call returns a new IoSpec instance with the "cached" meta
+        attribute set to True.
+        """
+
+        entry = self._get_entry(key, problem)
+        with self._lock:
+            if entry is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+
+        result = iospec_from_json(entry['testcases'])
+        for name, value in entry['meta'].items():
+            result.set_meta(name, value)
+        result.set_meta('cached', True)
+        return result
+
+    def _get_entry(self, key, problem):
+        with self._lock:
+            entry = self._memory.get((problem, key))
+            if entry is not None:
+                if not self._is_expired(entry):
+                    self._memory.move_to_end((problem, key))
+                    return entry
+                del self._memory[problem, key]
+
+        if not self.persistent:
+            return None
+        path = self.entry_path(key, problem)
+        try:
+            with open(path, encoding='utf8') as fd:
+                entry = json.load(fd)
+            if self._is_expired(entry):
+                os.unlink(path)
+                return None
+            os.utime(path)
+        except (OSError, ValueError):
+            return None
+        self._remember(key, problem, entry)
+        return entry
+
+    def _remember(self, key, problem, entry):
+        with self._lock:
+            self._memory[problem, key] = entry
+            self._memory.move_to_end((problem, key))
+            while len(self._memory) > self.max_entries:
+                self._memory.popitem(last=False)
+
+    def put(self, key, result, problem=None):
+        """
+        Store IoSpec result under the given key.
+
+        Return False if the result cannot be cached because it has timeouts.
+        Errors writing the on-disk layer are only logged, since the cache must
+        never break the run that produced the result.
+        """
+
+        if any(getattr(case, 'error_type', None) == 'timeout'
+               for case in result):
+            return False
+
+        meta = {k: v for k, v in result.meta.items() if k != 'cached'}
+        entry = {
+            'created': time.time(),
+            'testcases': result.to_json(),
+            'meta': meta,
+        }
+        self._remember(key, problem, entry)
+        if self.persistent:
+            try:
+                self._write_entry(self.entry_path(key, problem), entry)
+            except OSError as ex:
+                logger.warning('could not write cached result: %s' % ex)
+        return True
+
+    def _write_entry(self, path, entry):
+        data = json.dumps(entry).encode('utf8')
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        # Write to a temporary file first and move it to its final location so
+        # concurrent readers never see a partially written entry.
+        fd, tmp_path = tempfile.mkstemp(prefix=TEMP_PREFIX,
+                                        dir=os.path.dirname(path))
+        try:
+            with os.fdopen(fd, 'wb') as file:
+                file.write(data)
+            os.replace(tmp_path, path)
+        except OSError:
+            if os.path.exists(tmp_path):
+                os.unlink(tmp_path)
+            raise
+
+        with self._lock:
+            if self._disk_size is not None:
+                self._disk_size += len(data)
+            must_evict = (self._disk_size is None or
+                          self._disk_size > self.max_size)
+        if must_evict:
+            self.evict()
+
+    def evict(self):
+        """
+        Remove expired and least recently used on-disk entries until the cache
+        fits in max_size.
+        """
+
+        entries = []
+        total = 0
+        now = time.time()
+        for dirpath, _, filenames in os.walk(self.path):
+            for name in filenames:
+                # Temporary files belong to concurrent writers
+                if name.startswith(TEMP_PREFIX):
+                    continue
+                path = os.path.join(dirpath, name)
+                try:
+                    st = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                entries.append((st.st_mtime, st.st_size, path))
+                total += st.st_size
+
+        entries.sort()
+        for mtime, size, path in entries:
+            # Hits touch the file, so an entry whose mtime is older than the
+            # ttl was also created before it.
+            expired = self.ttl is not None and now - mtime > self.ttl
+            if total <= self.max_size and not expired:
+                continue
+            try:
+                os.unlink(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+
+        with self._lock:
+            self._disk_size = total
+
+    def invalidate(self, problem=None):
+        """
+        Remove all results of the given problem.
+        """
+
+        with self._lock:
+            for key in [k for k in self._memory if k[0] == problem]:
+                del self._memory[key]
+            self._disk_size = None
+        shutil.rmtree(self._problem_path(problem), ignore_errors=True)
+        logger.info('invalidated cached results of problem %r' % problem)
+
+    def clear(self):
+        """
+        Remove all entries from the cache and reset statistics.
+        """
+
+        with self._lock:
+            self._memory.clear()
+            self._disk_size = None
+            self.hits = self.misses = 0
+        shutil.rmtree(self.path, ignore_errors=True)
+
+    def stats(self):
+        """
+        Return a dictionary with the number of cache hits and misses, the hit
+        ratio and the number of results kept in memory.
+        """
+
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_ratio': self.hits / total if total else 0.0,
+                'entries': len(self._memory),
+            }
@@ -0,0 +1,354 @@
+"""
+A pool of pre-started sandbox workers.
+
+Each call to :func:`boxed.jsonbox.run` starts a new sandboxed interpreter and
+imports all modules required by the target function before doing any actual
+work. The :class:`SandboxPool` keeps a few sandbox workers alive (see
+:mod:`ejudge.sandbox_worker`) with all modules already imported. Jobs are
+dispatched to an idle worker, which forks a fresh child to execute each one.
+Workers are recycled after a bounded number of jobs.
+"""
+
+import atexit
+import json
+import logging
+import os
+import select
+import subprocess
+import threading
+import time
+
+from boxed.core import pythonpath, return_from_status_data
+from boxed.errors import SerializationError
+
+logger = logging.getLogger('ejudge')
+
+HANDSHAKE = 'ejudge-sandbox-worker::0.1'
+JOB_HANDSHAKE = 'jsonbox::0.1'
+
+#: Command used to start new sandbox workers.
+WORKER_COMMAND = ['python_boxed', '-S', '-s', '-m', 'ejudge.sandbox_worker']
+
+_default_pool = None
+
+
+def get_sandbox_pool():
+    """
+    Return the default SandboxPool instance.
+    """
+
+    global _default_pool
+
+    if _default_pool is None or _default_pool.pid != os.getpid():
+        _default_pool = SandboxPool()
+        atexit.register(_default_pool.close)
+    return _default_pool
+
+
+def run(target, args=(), kwargs=None, *, timeout=None, user='nobody',
+        imports=(), print_messages=False):
+    """
+    Run target function in a pre-warmed sandbox worker.
+
+    It has the same interface as :func:`boxed.jsonbox.run`.
+    """
+
+    return get_sandbox_pool().run(
+        target, args, kwargs,
+        timeout=timeout,
+        user=user,
+        imports=imports,
+        print_messages=print_messages,
+    )
+
+
+def stream(target, args=(), kwargs=None, *, timeout=None, user='nobody',
+           imports=(), print_messages=False):
+    """
+    Run target function in a pre-warmed sandbox worker and yield its comment
+    lines as soon as they are printed.
+
+    See :meth:`SandboxPool.stream`.
+    """
+
+    return get_sandbox_pool().stream(
+        target, args, kwargs,
+        timeout=timeout,
+        user=user,
+        imports=imports,
+        print_messages=print_messages,
+    )
+
+
+class SandboxWorker:
+    """
+    A long running sandboxed interpreter that executes jobs sent by the
+    SandboxPool.
+
+    Args:
+        imports (list):
+            List of modules imported before lowering privileges.
+        user (str):
+            Name of the low privilege user that executes all jobs.
+        command (list):
+            Command that starts the worker process.
+    """
+
+    def __init__(self, imports=(), user='nobody', command=None):
+        self.imports = tuple(imports)
+        self.user = user
+        self.jobs = 0
+        self.process = subprocess.Popen(
+            command or WORKER_COMMAND,
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            env={'PYTHONPATH': pythonpath()},
+        )
+        self._buffer = b''
+        self._send({
+            'header': HANDSHAKE,
+            'imports': list(self.imports),
+            'user': user,
+        })
+
+    def __repr__(self):
+        return '<SandboxWorker pid=%s jobs=%s>' % (self.process.pid, self.jobs)
+
+    def is_alive(self):
+        """
+        Return True if worker process is still running.
+        """
+
+        return self.process.poll() is None
+
+    def close(self):
+        """
+        Terminate worker process.
+        """
+
+        if self.is_alive():
+            try:
+                self.process.stdin.close()
+            except OSError:
+                pass
+            self.process.kill()
+        self.process.wait()
+        self.process.stdout.close()
+
+    def run(self, target, args=(), kwargs=None, timeout=None):
+        """
+        Execute target function with the given args and kwargs.
+
+        Return a tuple of (data, comments) strings similar to
+        :func:`boxed.core.execute_subprocess`.
+        """
+
+        comments = []
+        job = self.iter_run(target, args, kwargs, timeout)
+        data = consume(job, comments.append)
+        return data, '\n'.join(comments).strip()
+
+    def iter_run(self, target, args=(), kwargs=None, timeout=None):
+        """
+        Like :meth:`run`, but yield comment lines as soon as they are received.
+
+        The data string is the return value of the generator.
+        """
+
+        self.jobs += 1
+        self._send({
+            'header': JOB_HANDSHAKE,
+            'target': '%s.%s' % (target.__module__, target.__qualname__),
+            'args': args,
+            'kwargs': kwargs or {},
+        })
+
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            line = self._readline(deadline)
+            if line.startswith('#'):
+                yield line
+            else:
+                return line.strip()
+
+    def _send(self, data):
+        try:
+            serialized = json.dumps(data)
+        except Exception as ex:
+            raise SerializationError(ex)
+        self.process.stdin.write(serialized.encode('utf8') + b'\n')
+        self.process.stdin.flush()
+
+    def _readline(self, deadline):
+        fd = self.process.stdout.fileno()
+        while b'\n' not in self._buffer:
+            wait = None
+            if deadline is not None:
+                wait = deadline - time.monotonic()
+                if wait <= 0:
+                    self.close()
+                    raise TimeoutError('sandbox worker timed out')
+            ready, _, _ = select.select([fd], [], [], wait)
+            if ready:
+                chunk = os.read(fd, 65536)
+                if not chunk:
+                    raise RuntimeError('sandbox worker died unexpectedly')
+                self._buffer += chunk
+
+        line, _, self._buffer = self._buffer.partition(b'\n')
+        return line.decode('utf8', 'replace')
+
+
+class SandboxPool:
+    """
+    A pool of pre-started sandbox workers grouped by the list of imported
+    modules and user.
+
+    Args:
+        max_jobs (int):
+            Number of jobs executed by a worker before it is recycled.
+        max_idle (int):
+            Maximum number of idle workers kept for each (imports, user) pair.
+        command (list):
+            Command that starts new workers.
+    """
+
+    def __init__(self, max_jobs=100, max_idle=4, command=None):
+        self.max_jobs = max_jobs
+        self.max_idle = max_idle
+        self.command = command
+        self.pid = os.getpid()
+        self._idle = {}
+        self._lock = threading.Lock()
+
+    def __repr__(self):
+        n_idle = sum(len(x) for x in self._idle.values())
+        return '<SandboxPool (%s idle workers)>' % n_idle
+
+    def prewarm(self, imports=(), n=1, user='nobody'):
+        """
+        Start workers for the given imports until there are at least n idle
+        workers available.
+        """
+
+        key = (tuple(imports), user)
+        with self._lock:
+            idle = self._idle.setdefault(key, [])
+            missing = n - len(idle)
+        new = [self._new_worker(imports, user) for _ in range(missing)]
+        with self._lock:
+            idle.extend(new)
+
+    def acquire(self, imports=(), user='nobody'):
+        """
+        Return an idle worker for the given imports, or start a new one.
+        """
+
+        key = (tuple(imports), user)
+        with self._lock:
+            idle = self._idle.get(key, [])
+            while idle:
+                worker = idle.pop()
+                if worker.is_alive():
+                    return worker
+                worker.close()
+        return self._new_worker(imports, user)
+
+    def release(self, worker):
+        """
+        Give worker back to the pool after a job.
+        """
+
+        key = (worker.imports, worker.user)
+        if worker.is_alive() and worker.jobs < self.max_jobs:
+            with self._lock:
+                idle = self._idle.setdefault(key, [])
+                if len(idle) < self.max_idle:
+                    idle.append(worker)
+                    return
+        worker.close()
+
+    def run(self, target, args=(), kwargs=None, *, timeout=None,
+            user='nobody', imports=(), print_messages=False):
+        """
+        Run target function in a sandbox worker.
+
+        It has the same interface as :func:`boxed.jsonbox.run`.
+        """
+
+        stream = self.stream(target, args, kwargs, timeout=timeout, user=user,
+                             imports=imports, print_messages=print_messages)
+        return consume(stream)
+
+    def stream(self, target, args=(), kwargs=None, *, timeout=None,
+               user='nobody', imports=(), print_messages=False):
+        """
+        Like :meth:`run`, but yield the comment lines printed by the target
+        function as soon as they are received.
+
+        The result of the target function is the return value of the
+        generator. Closing the generator before the job finishes kills the
+        worker.
+        """
+
+        # The target module is also imported ahead of time, so forked children
+        # can start executing immediately
+        imports = tuple(imports)
+        if target.__module__ not in imports:
+            imports += (target.__module__,)
+
+        worker = self.acquire(imports, user)
+        logger.info('called %s() on sandbox worker %s' %
+                    (target.__qualname__, worker.process.pid))
+        comments = []
+        try:
+            job = worker.iter_run(target, args, kwargs, timeout=timeout)
+            while True:
+                try:
+                    line = next(job)
+                except StopIteration as ex:
+                    data = ex.value
+                    break
+                comments.append(line)
+                yield line
+        except BaseException:
+            worker.close()
+            raise
+        self.release(worker)
+
+        comments = '\n'.join(comments).strip()
+        if print_messages:
+            print(comments)
+        return return_from_status_data(data, comments, json.loads)
+
+    def close(self):
+        """
+        Terminate all idle workers.
+        """
+
+        if self.pid != os.getpid():
+            return
+        with self._lock:
+            workers = [w for idle in self._idle.values() for w in idle]
+            self._idle.clear()
+        for worker in workers:
+            worker.close()
+
+    def _new_worker(self, imports, user):
+        logger.debug('starting sandbox worker for %r' % (imports,))
+        return SandboxWorker(imports, user=user, command=self.command)
+
+
+def consume(generator, callback=None):
+    """
+    Exhaust generator, passing all yielded values to the optional callback,
+    and return the generator's return value.
+    """
+
+    while True:
+        try:
+            value = next(generator)
+        except StopIteration as ex:
+            return ex.value
+        if callback is not None:
+            callback(value)
@@ -0,0 +1,167 @@
+#
+# Pre-warmed sandbox worker.
+#
+# This script is executed by the python_boxed interpreter and is controlled by
+# ejudge.sandbox_pool. It reads a handshake with a list of modules to import
+# and the user that should run the jobs, imports all modules, lowers its
+# privileges and then waits for jobs in the same JSON format used by
+# boxed.jsonbox. Each job is executed in a forked child so the worker itself
+# never runs untrusted code and can be safely reused by several jobs.
+#
+# Each job produces any number of comment lines (starting with "#") followed by
+# exactly one data line. Comments are forwarded as soon as the job prints them.
+#
+import json
+import os
+import select
+import signal
+import sys
+import time
+
+from boxed.core import set_protocol, load_data, lower_privileges, \
+    validate_target, execute_target, END_POINT, comment, real_print
+from ejudge.sandbox_pool import HANDSHAKE, JOB_HANDSHAKE
+
+#: Interval (in seconds) between checks for the termination of a job.
+WAIT_INTERVAL = 0.05
+
+
+def main():
+    set_protocol('json')
+    data = load_data()
+    if data.get('header') != HANDSHAKE:
+        END_POINT({'status': 'invalid-handshake', 'handshake': HANDSHAKE})
+
+    # Import modules and switch to a low privilege user. Modules must be
+    # imported first since the low privilege user may not be able to read them
+    validate_target({
+        'header': JOB_HANDSHAKE,
+        'imports': data.get('imports', ()),
+        'target': main,
+    }, handshake=JOB_HANDSHAKE)
+    lower_privileges(data.get('user', 'nobody'))
+    comment('worker ready')
+    sys.stdout.flush()
+
+    while True:
+        try:
+            line = sys.stdin.readline()
+        except KeyboardInterrupt:
+            break
+        if not line:
+            break
+        run_job(line)
+
+
+def run_job(line):
+    """
+    Execute job described in the given JSON line in a forked child process and
+    forward its output to stdout.
+    """
+
+    sys.stdout.flush()
+    read_fd, write_fd = os.pipe()
+    pid = os.fork()
+    if pid == 0:
+        # The child gets its own session so the worker can kill any process
+        # it leaves behind. Its stdin is the job pipe of the worker and must
+        # not be visible to untrusted code.
+        os.setsid()
+        devnull = os.open(os.devnull, os.O_RDONLY)
+        os.dup2(devnull, 0)
+        os.close(devnull)
+        os.close(read_fd)
+        os.dup2(write_fd, 1)
+        os.close(write_fd)
+        try:
+            job = json.loads(line)
+            target = validate_target(job, handshake=JOB_HANDSHAKE)
+            END_POINT(execute_target(target, job['args'], job['kwargs']))
+        except SystemExit:
+            pass
+        finally:
+            sys.stdout.flush()
+            os._exit(0)
+
+    # Forward comments as soon as they arrive, so the parent can follow the
+    # progress of the job. The first data line is only forwarded at the end
+    # since it marks the end of the job for the parent.
+    os.close(write_fd)
+    partial = []
+    data = None
+    status = deadline = None
+    while True:
+        ready, _, _ = select.select([read_fd], [], [], WAIT_INTERVAL)
+        if deadline is not None and (not ready or time.monotonic() > deadline):
+            break
+        elif not ready:
+            # A leftover process may hold the pipe open after the child exits.
+            # We kill its process group and stop reading shortly after, in
+            # case something escaped from the group.
+            wait_pid, wait_status = os.waitpid(pid, os.WNOHANG)
+            if wait_pid:
+                status = wait_status
+                deadline = time.monotonic() + WAIT_INTERVAL * 20
+                kill_group(pid)
+            continue
+        chunk = os.read(read_fd, 65536)
+        if not chunk:
+            break
+        elif b'\n' not in chunk:
+            partial.append(chunk)
+            continue
+        *lines, tail = chunk.split(b'\n')
+        lines[0] = b''.join(partial) + lines[0]
+        partial = [tail]
+        data = forward_lines(lines, data)
+    os.close(read_fd)
+    data = forward_lines([b''.join(partial)], data)
+    if status is None:
+        _, status = os.waitpid(pid, 0)
+        kill_group(pid)
+
+    if data is not None:
+        real_print(data)
+    else:
+        real_print(json.dumps({
+            'status': 'exception',
+            'type': 'RuntimeError',
+            'args': ['sandboxed process terminated unexpectedly (status %s)'
+                     % status],
+            'traceback': '',
+            'target': '<unknown>',
+        }))
+    sys.stdout.flush()
+
+
+def kill_group(pid):
+    """
+    Kill all processes left behind in the process group of the given job.
+    """
+
+    try:
+        os.killpg(pid, signal.SIGKILL)
+    except (ProcessLookupError, PermissionError):
+        pass
+
+
+def forward_lines(lines, data):
+    """
+    Print comment lines and return the first data line (or the given data, if
+    it was already found). Additional data lines are sent as comments.
+    """
+
+    for line in lines:
+        line = line.decode('utf8', 'replace').rstrip('\r')
+        if line.startswith('#'):
+            real_print(line)
+        elif line and data is None:
+            data = line
+        elif line:
+            comment(line)
+    sys.stdout.flush()
+    return data
+
+
+if __name__ == '__main__':
+    main()
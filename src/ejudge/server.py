@@ -0,0 +1,406 @@
+"""
+Persistent grading server.
+
+``ejudge serve`` starts a long-lived process that accepts jobs on a Unix
+domain socket. The server keeps zygotes, sandbox workers and build directories
+of the configured languages warm, so each job costs a dispatch instead of
+starting a new interpreter and importing all modules.
+
+The protocol is based on JSON lines. Each request is a JSON object with an
+"id" (any JSON value chosen by the client), a "command" and its arguments:
+
+    {"id": 1, "command": "run", "source": "...", "lang": "python",
+     "inputs": [["foo"], ["bar"]], "options": {"timeout": 1}}
+    {"id": 2, "command": "grade", "source": "...", "lang": "python",
+     "iospec": "<iospec source>", "options": {"early_abort": true}}
+    {"id": 3, "command": "ping"}
+
+Options are keyword arguments of :func:`ejudge.aio.run` or
+:func:`ejudge.aio.grade`. Jobs of a connection run concurrently and each one
+is answered with a single line as soon as it finishes, hence responses may
+arrive in a different order than requests:
+
+    {"id": 1, "result": ...}
+    {"id": 2, "error": "error message"}
+
+The result of a "run" job is an object with the JSON representation of the
+IoSpec test cases ("testcases") and its meta attributes ("meta"). The result
+of a "grade" job is the JSON representation of the feedback.
+"""
+
+import asyncio
+import json
+import logging
+import os
+import socket
+import tempfile
+
+from ejudge import aio, registry
+from ejudge.build_pool import get_build_pool
+from ejudge.exceptions import ServerError
+from ejudge.functions import materialize_inputs
+from ejudge.sandbox_pool import get_sandbox_pool
+from ejudge.util import iospec_from_json, testcase_from_json
+from ejudge.zygote import prewarm_zygotes
+from iospec import parse as ioparse
+from iospec.feedback import Feedback
+
+logger = logging.getLogger('ejudge')
+
+#: Default number of jobs accepted by the server but not finished yet.
+DEFAULT_QUEUE_DEPTH = 256
+
+
+def default_socket_path():
+    """
+    Return the default path for the server socket.
+
+    The location is controlled by the $EJUDGE_SOCKET environment variable and
+    defaults to a file in the user's runtime directory.
+    """
+
+    path = os.environ.get('EJUDGE_SOCKET')
+    if path:
+        return path
+    base = os.environ.get('XDG_RUNTIME_DIR') or tempfile.gettempdir()
+    return os.path.join(base, 'ejudge-%s.sock' % os.getuid())
+
+
+class Server:
+    """
+    A server that executes run and grade jobs received on a Unix socket.
+
+    Args:
+        path (str):
+            Path of the Unix socket. Defaults to :func:`default_socket_path`.
+        queue_depth (int):
+            Maximum number of jobs accepted and not finished yet. Jobs received
+            when the queue is full are rejected immediately.
+        workers (int):
+            Maximum number of jobs executed concurrently (see
+            :func:`ejudge.aio.set_concurrency_limit`).
+        langs (list):
+            Languages whose worker pools are started ahead of time.
+        sandbox (bool):
+            Default value for the sandbox option of jobs.
+    """
+
+    def __init__(self, path=None, queue_depth=DEFAULT_QUEUE_DEPTH,
+                 workers=None, langs=(), sandbox=False):
+        if queue_depth < 1:
+            raise ValueError('queue_depth must be positive, got: %s'
+                             % queue_depth)
+        self.path = path or default_socket_path()
+        self.queue_depth = queue_depth
+        self.workers = workers
+        self.langs = list(langs)
+        self.sandbox = sandbox
+        self.pending = 0
+        self.processed = 0
+        self._server = None
+
+    def __repr__(self):
+        return '<Server %r (%s pending jobs)>' % (self.path, self.pending)
+
+    def prewarm(self):
+        """
+        Start worker pools for all configured languages.
+
+        This forks worker processes, hence it is better to call it before
+        starting any event loop or thread.
+        """
+
+        get_build_pool().prefill()
+        for lang in self.langs:
+            modules = registry.build_manager(lang, '').get_modules()
+            if self.sandbox:
+                imports = tuple(modules) + ('ejudge.functions',)
+                get_sandbox_pool().prewarm(imports)
+            else:
+                prewarm_zygotes(modules)
+            logger.info('started worker pools for %s' % lang)
+
+    async def start(self):
+        """
+        Start listening on the server socket.
+        """
+
+        if os.path.exists(self.path):
+            if is_listening(self.path):
+                raise RuntimeError('a server is already listening on %s'
+                                   % self.path)
+            os.unlink(self.path)
+
+        if self.workers is not None:
+            aio.set_concurrency_limit(self.workers)
+        self._server = await asyncio.start_unix_server(
+            self.handle_connection, path=self.path, limit=2 ** 26,
+        )
+
+        # Only the owner of the server may submit jobs
+        os.chmod(self.path, 0o600)
+        logger.info('ejudge server listening on %s' % self.path)
+
+    async def serve_forever(self):
+        """
+        Start the server and process jobs until cancelled.
+        """
+
+        if self._server is None:
+            await self.start()
+        try:
+            await self._server.serve_forever()
+        finally:
+            self.close()
+
+    def close(self):
+        """
+        Stop listening and remove the socket file.
+        """
+
+        if self._server is not None:
+            self._server.close()
+            self._server = None
+            try:
+                os.unlink(self.path)
+            except FileNotFoundError:
+                pass
+
+    async def handle_connection(self, reader, writer):
+        """
+        Read requests from a client connection and answer each one when its
+        job finishes.
+        """
+
+        tasks = set()
+        lock = asyncio.Lock()
+
+        async def respond(request):
+            response = await self.process(request)
+            async with lock:
+                writer.write(json.dumps(response).encode('utf8') + b'\n')
+                await writer.drain()
+
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                try:
+                    request = json.loads(line.decode('utf8'))
+                    if not isinstance(request, dict):
+                        raise ValueError('request must be a JSON object')
+                except ValueError as ex:
+                    request = {'command': 'invalid', 'error': str(ex)}
+                task = asyncio.ensure_future(respond(request))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+            if tasks:
+                await asyncio.wait(tasks)
+        except (ConnectionError, asyncio.IncompleteReadError):
+            for task in tasks:
+                task.cancel()
+        finally:
+            writer.close()
+
+    async def process(self, request):
+        """
+        Execute the job described by the request and return the response
+        dictionary.
+        """
+
+        response = {'id': request.get('id')}
+        if request.get('command') == 'ping':
+            response['result'] = {'pending': self.pending,
+                                  'processed': self.processed}
+            return response
+        if self.pending >= self.queue_depth:
+            response['error'] = 'queue is full'
+            return response
+
+        self.pending += 1
+        try:
+            response['result'] = await self.execute(request)
+        except asyncio.CancelledError:
+            raise
+        except Exception as ex:
+            logger.debug('job %r failed: %s' % (response['id'], ex))
+            response['error'] = '%s: %s' % (type(ex).__name__, ex)
+        finally:
+            self.pending -= 1
+            self.processed += 1
+        return response
+
+    async def execute(self, request):
+        """
+        Execute job and return its JSON-like result.
+        """
+
+        command = request.get('command')
+        options = dict(request.get('options') or {})
+        options.setdefault('sandbox', self.sandbox)
+        if command == 'run':
+            result = await aio.run(request['source'], request['inputs'],
+                                   request.get('lang'), **options)
+            return {'testcases': result.to_json(), 'meta': dict(result.meta)}
+        elif command == 'grade':
+            iospec = ioparse(request['iospec'])
+            feedback = await aio.grade(request['source'], iospec,
+                                       request.get('lang'), **options)
+            return feedback_to_json(feedback)
+        elif command == 'invalid':
+            raise ValueError(request['error'])
+        else:
+            raise ValueError('invalid command: %r' % command)
+
+
+def serve(path=None, **kwargs):
+    """
+    Run an ejudge server until interrupted.
+
+    Accept the same arguments as :class:`Server`.
+    """
+
+    server = Server(path, **kwargs)
+    server.prewarm()
+    loop = asyncio.new_event_loop()
+    try:
+        loop.run_until_complete(server.serve_forever())
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.close()
+        loop.close()
+
+
+def is_listening(path):
+    """
+    Return True if some process accepts connections on the given Unix socket.
+    """
+
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(path)
+    except OSError:
+        return False
+    else:
+        return True
+    finally:
+        sock.close()
+
+
+def feedback_to_json(feedback):
+    """
+    Return a JSON-like representation of a Feedback instance.
+    """
+
+    return {
+        'testcase': feedback.testcase.to_json(),
+        'answer_key': feedback.answer_key.to_json(),
+        'grade': str(feedback.grade),
+        'status': feedback.status,
+        'message': feedback.message,
+        'hint': feedback.hint,
+    }
+
+
+def feedback_from_json(data):
+    """
+    Create Feedback instance from the result of feedback_to_json().
+    """
+
+    data = dict(data)
+    testcase = testcase_from_json(data.pop('testcase'))
+    answer_key = testcase_from_json(data.pop('answer_key'))
+    return Feedback(testcase, answer_key, **data)
+
+
+class Client:
+    """
+    A blocking client for the ejudge server.
+
+    Args:
+        path (str):
+            Path of the server socket. Defaults to
+            :func:`default_socket_path`.
+        timeout (float):
+            Optional timeout (in seconds) for each request.
+    """
+
+    def __init__(self, path=None, timeout=None):
+        self.path = path or default_socket_path()
+        self.socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.socket.settimeout(timeout)
+        self.socket.connect(self.path)
+        self._file = self.socket.makefile('rwb')
+        self._counter = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        """
+        Close connection to the server.
+        """
+
+        self._file.close()
+        self.socket.close()
+
+    def request(self, command, **kwargs):
+        """
+        Send request to the server and return the result of the job.
+
+        Raises a ServerError if the job failed.
+        """
+
+        self._counter += 1
+        request = dict(kwargs, id=self._counter, command=command)
+        self._file.write(json.dumps(request).encode('utf8') + b'\n')
+        self._file.flush()
+
+        while True:
+            line = self._file.readline()
+            if not line:
+                raise ConnectionError('connection closed by the server')
+            response = json.loads(line.decode('utf8'))
+            if response.get('id') == self._counter:
+                break
+        if 'error' in response:
+            raise ServerError(response['error'])
+        return response['result']
+
+    def ping(self):
+        """
+        Return a dictionary with the number of pending and processed jobs.
+        """
+
+        return self.request('ping')
+
+    def run(self, source, inputs, lang=None, **options):
+        """
+        Like :func:`ejudge.run`, but executes the job in the server.
+        """
+
+        inputs = materialize_inputs(inputs)
+        data = self.request('run', source=source, inputs=inputs, lang=lang,
+                            options=options)
+        result = iospec_from_json(data['testcases'])
+        for key, value in data['meta'].items():
+            result.set_meta(key, value)
+        return result
+
+    def grade(self, source, iospec, lang=None, **options):
+        """
+        Like :func:`ejudge.grade`, but executes the job in the server.
+
+        The iospec can be given either as a string or as an IoSpec instance.
+        """
+
+        if not isinstance(iospec, str):
+            iospec = iospec.source()
+        data = self.request('grade', source=source, iospec=iospec, lang=lang,
+                            options=options)
+        return feedback_from_json(data)
@@ -0,0 +1,137 @@
+import asyncio
+import os
+import time
+
+import pytest
+
+from ejudge import aio, functions
+from ejudge.async_pinteract import AsyncProcess
+from ejudge.result_cache import ResultCache
+from ejudge.util import strip_usage_meta
+
+source = 'name = input("name: ")\nprint("hello %s!" % name)'
+iospec_source = 'name: <john>\nhello john!'
+
+
+def run_async(coro):
+    return asyncio.run(coro)
+
+
+def test_aio_run_returns_the_same_as_run():
+    inputs = [['john'], ['mary']]
+    result = run_async(aio.run(source, inputs, lang='python', sandbox=False))
+    expected = functions.run(source, inputs, lang='python', sandbox=False)
+    strip_usage_meta(result)
+    strip_usage_meta(expected)
+    assert result.to_json() == expected.to_json()
+
+
+def test_aio_grade():
+    feedback = run_async(aio.grade(source, iospec_source, lang='python'))
+    assert feedback.grade == 1
+
+    feedback = run_async(aio.grade('print(42)', iospec_source, lang='python'))
+    assert feedback.grade == 0
+
+
+def test_aio_uses_result_cache(tmpdir):
+    cache = ResultCache(str(tmpdir.join('cache')))
+    for _ in range(2):
+        result = run_async(aio.run(source, [['john']], lang='python',
+                                   sandbox=False, cache=cache, problem='foo'))
+        assert result[0].inputs() == ['john']
+        feedback = run_async(aio.grade(source, iospec_source, lang='python',
+                                       cache=cache, problem='foo'))
+        assert feedback.grade == 1
+    assert result.meta['cached'] is True
+    assert cache.stats()['hits'] == 2
+
+
+def test_aio_build_error():
+    result = run_async(aio.run('a b', ['foo'], lang='python', sandbox=False))
+    assert result[0].error_type == 'build'
+
+
+def run_sleep_programs(n, duration):
+    sleep = 'import time\ntime.sleep(%s)' % duration
+
+    async def main():
+        return await asyncio.gather(*[
+            aio.run(sleep, [[]], lang='python', sandbox=False)
+            for _ in range(n)
+        ])
+
+    t0 = time.time()
+    results = run_async(main())
+    assert all(not r[0].is_error_test_case for r in results)
+    return time.time() - t0
+
+
+def test_aio_runs_programs_concurrently():
+    assert run_sleep_programs(4, 0.5) < 1.5
+
+
+def test_aio_concurrency_limit():
+    with pytest.raises(ValueError):
+        aio.set_concurrency_limit(0)
+
+    aio.set_concurrency_limit(1)
+    try:
+        assert run_sleep_programs(3, 0.2) >= 0.6
+    finally:
+        aio.set_concurrency_limit(aio.DEFAULT_CONCURRENCY_LIMIT)
+
+
+def test_aio_cancellation():
+    src = 'input()\nwhile True: pass'
+
+    async def main():
+        task = asyncio.ensure_future(
+            aio.run(src, ['foo'], lang='python', sandbox=False)
+        )
+        await asyncio.sleep(0.5)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+    t0 = time.time()
+    run_async(main())
+    assert time.time() - t0 < 2
+
+
+def test_aio_iter_run():
+    async def main():
+        return [case async for case in aio.iter_run(
+            source, [['john'], ['mary']], lang='python', sandbox=False,
+        )]
+
+    cases = run_async(main())
+    assert [case.inputs() for case in cases] == [['john'], ['mary']]
+
+
+def test_aio_iter_run_build_error():
+    async def main():
+        return [case async for case in aio.iter_run(
+            'a b', ['foo'], lang='python', sandbox=False,
+        )]
+
+    [case] = run_async(main())
+    assert case.error_type == 'build'
+
+
+def test_aio_iter_grade():
+    async def main():
+        iospec = iospec_source + '\n\nname: <mary>\nhello mary!'
+        return [fb async for fb in aio.iter_grade(source, iospec,
+                                                  lang='python')]
+
+    assert [fb.grade for fb in run_async(main())] == [1, 1]
+
+
+def test_process_reaped_elsewhere_is_not_successful():
+    async def main():
+        process = AsyncProcess(['true'])
+        os.waitpid(process.pid, 0)
+        return await process.wait()
+
+    assert run_async(main()) is None
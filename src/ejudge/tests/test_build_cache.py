@@ -0,0 +1,118 @@
+import os
+import stat
+
+import pytest
+
+from ejudge import registry
+from ejudge.build_cache import ExecutableCache, TEMP_PREFIX
+from ejudge.tests import test_language_gcc
+
+
+@pytest.fixture
+def cache(tmpdir):
+    return ExecutableCache(str(tmpdir.join('cache')), max_size=100)
+
+
+def test_cache_miss_and_hit(cache, tmpdir):
+    src = tmpdir.join('src.exe')
+    src.write('binary data')
+    dest = str(tmpdir.join('dest.exe'))
+    key = cache.key('source', ['cc', '-o', 'main.exe'], compiler='true')
+
+    assert not cache.get(key, dest)
+    cache.put(key, str(src))
+    assert cache.get(key, dest)
+    assert open(dest).read() == 'binary data'
+    assert cache.stats() == {'hits': 1, 'misses': 1, 'hit_ratio': 0.5}
+
+
+def test_cache_key_depends_on_source_and_args(cache):
+    key = cache.key('source', ['cc', '-O2'], compiler='true')
+    assert key == cache.key('source', ['cc', '-O2'], compiler='true')
+    assert key != cache.key('source2', ['cc', '-O2'], compiler='true')
+    assert key != cache.key('source', ['cc', '-O3'], compiler='true')
+
+
+def test_cache_evicts_least_recently_used_entries(cache, tmpdir):
+    src = tmpdir.join('src.exe')
+    src.write('x' * 60)
+    cache.put('a' * 64, str(src))
+    os.utime(cache.entry_path('a' * 64), (0, 0))
+    cache.put('b' * 64, str(src))
+
+    assert not os.path.exists(cache.entry_path('a' * 64))
+    assert os.path.exists(cache.entry_path('b' * 64))
+
+
+def test_cache_only_scans_the_disk_when_it_may_be_full(cache, tmpdir,
+                                                       monkeypatch):
+    src = tmpdir.join('src.exe')
+    src.write('x' * 10)
+    calls = []
+    evict = cache.evict
+    monkeypatch.setattr(cache, 'evict', lambda: calls.append(1) or evict())
+    for i in range(9):
+        cache.put(str(i) * 64, str(src))
+    assert len(calls) == 1
+    cache.put('9' * 64, str(src))
+    cache.put('a' * 64, str(src))
+    assert len(calls) == 2
+
+
+def test_cache_replacing_an_entry_does_not_grow_its_size(cache, tmpdir):
+    src = tmpdir.join('src.exe')
+    src.write('x' * 10)
+    cache.evict()
+    cache.put('a' * 64, str(src))
+    cache.put('a' * 64, str(src))
+    assert cache._disk_size == 10
+
+
+def test_cached_executables_are_executable_by_everyone(cache, tmpdir):
+    src = tmpdir.join('src.exe')
+    src.write('binary data')
+    src.chmod(0o600)
+    cache.put('a' * 64, str(src))
+    dest = str(tmpdir.join('dest.exe'))
+    assert cache.get('a' * 64, dest)
+    assert stat.S_IMODE(os.stat(dest).st_mode) == 0o555
+
+
+def test_cache_evict_ignores_temporary_files(cache, tmpdir):
+    tmp_path = os.path.join(cache.path, 'aa', TEMP_PREFIX + 'entry')
+    os.makedirs(os.path.dirname(tmp_path))
+    with open(tmp_path, 'w') as fd:
+        fd.write('x' * 200)
+    os.utime(tmp_path, (0, 0))
+    cache.evict()
+    assert os.path.exists(tmp_path)
+
+
+@pytest.mark.c
+@pytest.mark.gcc
+def test_build_manager_uses_executable_cache(tmpdir):
+    cache = ExecutableCache(str(tmpdir.join('cache')))
+    source = test_language_gcc.TestGCCSupport.get_source('ok')
+
+    for _ in range(2):
+        manager = registry.build_manager('c', source)
+        manager.executable_cache = cache
+        manager.build()
+        assert os.path.exists(os.path.join(manager.build_path, 'main.exe'))
+    assert cache.hits == 1
+    assert cache.misses == 1
+
+
+@pytest.mark.cpp
+def test_cache_hit_does_not_build_precompiled_headers(tmpdir):
+    cache = ExecutableCache(str(tmpdir.join('cache')))
+    source = '#include <iostream>\nint main() { std::cout << "hi"; }'
+
+    for i in range(2):
+        manager = registry.build_manager('c++', source)
+        manager.executable_cache = cache
+        manager.precompiled_header_path = str(tmpdir.join('pch%s' % i))
+        manager.build()
+    assert cache.hits == 1
+    assert tmpdir.join('pch0').exists()
+    assert not tmpdir.join('pch1').exists()
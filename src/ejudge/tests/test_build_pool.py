@@ -0,0 +1,86 @@
+import os
+
+import pytest
+
+from ejudge import registry
+from ejudge.build_pool import BuildDirPool
+
+
+@pytest.fixture
+def pool(tmpdir):
+    pool = BuildDirPool(str(tmpdir.join('builds')), size=1, gc_interval=None)
+    yield pool
+    pool.close()
+
+
+def test_pool_recycles_directories(pool):
+    path = pool.acquire()
+    assert os.path.isdir(path)
+    with open(os.path.join(path, 'main.c'), 'w') as F:
+        F.write('int main() {}')
+    os.mkdir(os.path.join(path, 'subdir'))
+
+    pool.release(path)
+    assert pool.acquire() == path
+    assert os.listdir(path) == []
+
+
+def test_pool_removes_extra_directories(pool):
+    path1, path2 = pool.acquire(), pool.acquire()
+    pool.release(path1)
+    pool.release(path2)
+    assert os.path.exists(path1)
+    assert not os.path.exists(path2)
+
+
+def test_pool_sandboxed_directories_are_world_writable(pool):
+    path = pool.acquire(sandboxed=True)
+    assert os.stat(path).st_mode & 0o777 == 0o777
+    assert pool.acquire(sandboxed=False) != path
+
+
+def test_pool_collects_orphaned_directories(pool):
+    path = pool.acquire()
+    os.makedirs(pool.root, exist_ok=True)
+    orphan = os.path.join(pool.root, '999999999-orphan')
+    os.mkdir(orphan)
+
+    assert pool.collect_garbage() == 1
+    assert not os.path.exists(orphan)
+    assert os.path.exists(path)
+
+
+def test_pool_keeps_directories_of_running_processes(pool):
+    os.makedirs(pool.root, exist_ok=True)
+    other = os.path.join(pool.root, '%s-idle' % os.getppid())
+    os.mkdir(other)
+    os.utime(other, (0, 0))
+
+    assert pool.collect_garbage() == 0
+    assert os.path.exists(other)
+
+
+def test_pool_recreates_missing_idle_directories(pool):
+    path = pool.acquire()
+    pool.release(path)
+    os.rmdir(path)
+
+    path = pool.acquire()
+    assert os.path.isdir(path)
+
+
+def test_pool_close_removes_all_directories(pool):
+    path = pool.acquire()
+    pool.close()
+    assert not os.path.exists(path)
+
+
+def test_build_manager_close_releases_build_path(pool):
+    manager = registry.build_manager('python-script', 'print(42)')
+    manager.build_pool = pool
+    with manager:
+        manager.build()
+        path = manager.build_path
+        assert os.listdir(path) == ['main.py']
+    assert manager.is_closed
+    assert os.listdir(path) == []
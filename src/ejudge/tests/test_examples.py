@@ -1,8 +1,11 @@
+import time
+
 import pytest
 
 import ejudge
 import iospec
 from ejudge import functions
+from ejudge.util import strip_usage_meta
 
 simple_inputs = """
 <foo>
@@ -46,6 +49,7 @@ def test_simple_inputs():
     ast = iospec.parse(simple_inputs)
     ast.normalize()
     result = functions.run(simple_source, ast, lang='python', sandbox=False)
+    result = strip_usage_meta(result)
     result.normalize()
     ast.pprint()
     result.pprint()
@@ -69,4 +73,37 @@ def test_grade_program_with_simple_inputs():
 print(sum([int(input()) for _ in range(3)]))
 """
     feedback = ejudge.grade(src, io, lang='python', sandbox=False)
-    assert feedback.grade == 1
\ No newline at end of file
+    assert feedback.grade == 1
+
+
+# Parallel execution of test cases
+def test_parallel_run_keeps_input_order():
+    src = (
+        'import time\n'
+        'x = int(input())\n'
+        'time.sleep(0.05 * (5 - x))\n'
+        'print(x)'
+    )
+    inputs = [[str(x)] for x in range(5)]
+    result = functions.run(src, inputs, lang='python', sandbox=False,
+                           workers=5)
+    assert [case[1] for case in result] == ['0', '1', '2', '3', '4']
+
+
+def test_parallel_run_cancels_cases_after_first_error():
+    src = (
+        'import time\n'
+        'x = int(input())\n'
+        'if x == 1:\n'
+        '    1 / 0\n'
+        'time.sleep(0.1 if x == 0 else 5)\n'
+        'print(x)'
+    )
+    inputs = [[str(x)] for x in range(4)]
+    t0 = time.time()
+    result = functions.run(src, inputs, lang='python', sandbox=False,
+                           workers=4, fast=True)
+    assert time.time() - t0 < 2
+    assert len(result) == 2
+    assert result[0].is_standard_test_case
+    assert result[1].error_type == 'runtime'
@@ -0,0 +1,89 @@
+import io
+
+import pytest
+
+from ejudge import functions, grade, grade_many, matching
+
+iospec_source = 'name: <john>\nhello john!\n\nname: <mary>\nhello mary!'
+ok = 'name = input("name: ")\nprint("hello %s!" % name)'
+wrong = 'print(42)'
+
+
+def test_grade_many():
+    submissions = {'a': ok, 'b': wrong, 'c': ok, 'd': io.StringIO(wrong)}
+    results = dict(grade_many(submissions, iospec_source, lang='python',
+                              workers=2))
+    assert sorted(results) == ['a', 'b', 'c', 'd']
+    assert results['a'].grade == results['c'].grade == 1
+    assert results['b'].grade == results['d'].grade == 0
+
+
+def test_grade_many_normalizes_iospec_once(monkeypatch):
+    # iospec's get_feedback() copies and normalizes the answer key each time
+    calls = []
+    iospec_get_feedback = matching.iospec_get_feedback
+
+    def counting_get_feedback(*args, **kwargs):
+        calls.append(args)
+        return iospec_get_feedback(*args, **kwargs)
+
+    monkeypatch.setattr(matching, 'iospec_get_feedback',
+                        counting_get_feedback)
+    sources = [ok, wrong, 'a b', ok.replace('hello', 'HELLO')]
+    submissions = list(enumerate(sources))
+    results = dict(grade_many(submissions, iospec_source, lang='python'))
+    assert calls == []
+
+    for i, source in submissions:
+        expected = grade(source, iospec_source, lang='python')
+        assert results[i].grade == expected.grade
+        assert results[i].status == expected.status
+    assert results[3].status == 'presentation-error'
+
+
+def test_grade_many_deduplicates_sources(monkeypatch):
+    calls = []
+    grade = functions._grade
+
+    def counting_grade(source, *args, **kwargs):
+        calls.append(source)
+        return grade(source, *args, **kwargs)
+
+    monkeypatch.setattr(functions, '_grade', counting_grade)
+    submissions = [(1, ok), (2, ok), (3, wrong)]
+    results = dict(grade_many(submissions, iospec_source, lang='python'))
+    assert sorted(calls) == sorted([ok, wrong])
+    assert results[1] is results[2]
+
+
+def test_grade_many_cancels_pending_submissions(monkeypatch):
+    calls = []
+    grade = functions._grade
+
+    def counting_grade(source, *args, **kwargs):
+        calls.append(source)
+        return grade(source, *args, **kwargs)
+
+    monkeypatch.setattr(functions, '_grade', counting_grade)
+    submissions = [(i, 'print(%s)' % i) for i in range(10)]
+    results = grade_many(submissions, iospec_source, lang='python',
+                         workers=1)
+    next(results)
+    results.close()
+    assert len(calls) < 10
+
+
+def test_grade_many_invalid_workers():
+    with pytest.raises(ValueError):
+        list(grade_many({}, iospec_source, lang='python', workers=0))
+
+
+def test_grade_many_with_languages_and_results():
+    c_source = '#include<stdio.h>\nint main() { printf("42"); return 0; }'
+    submissions = [('py', ok, 'python'), ('c', c_source, 'c')]
+    results = {id: (fb, result) for id, fb, result in
+               grade_many(submissions, iospec_source, results=True)}
+    assert results['py'][0].grade == 1
+    assert results['c'][0].grade == 0
+    assert results['py'][1].meta['lang'] == 'python'
+    assert results['c'][1].meta['lang'] == 'c'
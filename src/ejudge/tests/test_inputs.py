@@ -0,0 +1,133 @@
+import warnings
+
+import pytest
+
+from ejudge import iter_run, registry, run
+from ejudge.inputs import DelimitedInputFile, InputDirectory, InputFile
+from ejudge.result_cache import ResultCache
+from iospec import In, Out, StandardTestCase
+
+source = 'name = input("name: ")\nprint("hello %s!" % name)'
+sum_c = r'''
+#include <stdio.h>
+int main() {
+    long x, total = 0;
+    while (scanf("%ld", &x) == 1) total += x;
+    printf("%ld\n", total);
+    return 0;
+}
+'''
+
+
+def test_input_directory(tmpdir):
+    for name, data in [('10.in', 'c\n'), ('2.in', 'b'), ('1.in', 'a\nx'),
+                       ('notes.txt', 'ignored')]:
+        tmpdir.join(name).write(data)
+
+    inputs = InputDirectory(str(tmpdir))
+    assert len(inputs) == 3
+    assert [list(x) for x in inputs] == [['a', 'x'], ['b'], ['c']]
+
+
+def test_delimited_input_file(tmpdir):
+    path = tmpdir.join('inputs.txt')
+    path.write('a\nb\n\n\nc\n\nd\n')
+    assert list(DelimitedInputFile(str(path))) == [['a', 'b'], ['c'], ['d']]
+
+    path.write('a\n---\n\n---\n')
+    cases = DelimitedInputFile(str(path), separator='---')
+    assert list(cases) == [['a'], ['']]
+
+
+def test_delimited_empty_file(tmpdir):
+    path = tmpdir.join('inputs.txt')
+    path.write('')
+    assert list(DelimitedInputFile(str(path))) == []
+
+
+def test_run_with_input_directory(tmpdir):
+    tmpdir.join('1.in').write('john\n')
+    tmpdir.join('2.in').write('mary\n')
+    result = run(source, InputDirectory(str(tmpdir)), 'python',
+                 sandbox=False)
+    assert [case.inputs() for case in result] == [['john'], ['mary']]
+
+
+def test_lazy_inputs_are_consumed_on_demand():
+    consumed = []
+
+    def inputs():
+        for idx in range(10000):
+            consumed.append(idx)
+            yield [str(idx)]
+
+    for workers in [1, 4]:
+        del consumed[:]
+        stream = iter_run(source, inputs(), 'python', sandbox=False,
+                          workers=workers)
+        assert next(stream).inputs() == ['0']
+        stream.close()
+        assert len(consumed) <= 2 * workers + 1
+
+
+def test_lazy_inputs_are_loaded_in_sandbox_with_a_warning(tmpdir):
+    with pytest.warns(UserWarning, match='sandbox=True'):
+        result = run(source, iter([['john']]), 'python', fake_sandbox=True)
+    assert result[0].inputs() == ['john']
+
+    cache = ResultCache(str(tmpdir.join('cache')))
+    with pytest.warns(UserWarning, match='result cache'):
+        run(source, iter([['john']]), 'python', sandbox=False, cache=cache)
+
+    with warnings.catch_warnings():
+        warnings.simplefilter('error')
+        run(source, [['john']], 'python', fake_sandbox=True)
+
+
+def test_input_file_is_read_lazily(tmpdir):
+    path = tmpdir.join('1.in')
+    path.write('a\nb\n')
+    inputs = InputFile(str(path))
+    path.write('c\n')
+    assert list(inputs) == ['c']
+    assert len(inputs) == 1
+
+
+def test_input_file_is_streamed_to_external_programs(tmpdir):
+    path = tmpdir.join('1.in')
+    path.write('\n'.join(map(str, range(100000))) + '\n')
+    result = run(sum_c, [InputFile(str(path))], 'c', sandbox=False,
+                 compare_streams=True)
+    assert not result[0].is_error_test_case
+    assert str(result[0][-1]) == str(sum(range(100000)))
+    assert result[0].meta['prompts'] == 100000
+
+
+def test_input_file_in_interactive_mode(tmpdir):
+    tmpdir.join('1.in').write('john\n')
+    [case] = run(source, [InputFile(str(tmpdir.join('1.in')))], 'python',
+                 sandbox=False)
+    assert list(case) == ['name: ', 'john', 'hello john!']
+
+
+def test_input_file_counts_lines_without_loading_them(tmpdir):
+    path = tmpdir.join('1.in')
+    for data, count in [('', 0), ('a', 1), ('a\n', 1), ('a\n\nb', 3)]:
+        path.write(data)
+        inputs = InputFile(str(path))
+        assert inputs.count_lines() == count
+        assert inputs._lines is None
+
+
+def test_input_file_is_not_loaded_when_output_matches(tmpdir):
+    path = tmpdir.join('1.in')
+    path.write('1\n2\n3\n')
+    inputs = InputFile(str(path))
+    answer_key = StandardTestCase([In('1'), In('2'), In('3'), Out('6')])
+    with registry.build_manager('c', sum_c, compare_streams=True) as manager:
+        ctrl = registry.execution_manager('c', manager, inputs,
+                                          answer_key=answer_key)
+        case = ctrl.run()
+    assert case.meta['digest_match']
+    assert case.inputs() == ['1', '2', '3']
+    assert inputs._lines is None
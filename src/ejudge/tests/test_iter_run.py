@@ -0,0 +1,57 @@
+import time
+
+from ejudge import iter_grade, iter_run, run
+from ejudge.util import strip_usage_meta
+from iospec import IoSpec
+
+source = 'name = input("name: ")\nprint("hello %s!" % name)'
+iospec_source = 'name: <john>\nhello john!\n\nname: <mary>\nhello mary!'
+inputs = [['john'], ['mary']]
+
+
+def test_iter_run_yields_the_same_as_run():
+    cases = list(iter_run(source, inputs, lang='python', sandbox=False))
+    expected = run(source, inputs, lang='python', sandbox=False)
+    assert strip_usage_meta(IoSpec(cases)).to_json() == \
+        strip_usage_meta(expected).to_json()
+
+
+def test_iter_run_yields_before_finishing():
+    src = 'import time\nn = int(input())\ntime.sleep(n)\nprint(n)'
+    t0 = time.time()
+    stream = iter_run(src, [['0'], ['5']], lang='python', sandbox=False)
+    assert not next(stream).is_error_test_case
+    assert time.time() - t0 < 3
+    stream.close()
+
+
+def test_iter_run_workers_keep_order():
+    src = 'import time\nn = int(input())\ntime.sleep(n / 10)\nprint(n)'
+    stream = iter_run(src, [['3'], ['1'], ['2']], lang='python',
+                      sandbox=False, workers=3)
+    assert [case.inputs() for case in stream] == [['3'], ['1'], ['2']]
+
+
+def test_iter_run_fast_stops_at_first_error():
+    src = 'x = int(input())\nprint(1 / x)'
+    stream = iter_run(src, [['1'], ['0'], ['2']], lang='python',
+                      sandbox=False, fast=True)
+    assert [case.is_error_test_case for case in stream] == [False, True]
+
+
+def test_iter_run_build_error():
+    [case] = iter_run('a b', ['foo'], lang='python', sandbox=False)
+    assert case.error_type == 'build'
+
+
+def test_iter_run_fake_sandbox():
+    cases = list(iter_run(source, inputs, lang='python', fake_sandbox=True))
+    assert [case.inputs() for case in cases] == inputs
+
+
+def test_iter_grade():
+    feedback = list(iter_grade(source, iospec_source, lang='python'))
+    assert [fb.grade for fb in feedback] == [1, 1]
+
+    feedback = list(iter_grade('print(42)', iospec_source, lang='python'))
+    assert [fb.grade for fb in feedback] == [0, 0]
@@ -1,7 +1,11 @@
+import asyncio
+
 import pytest
 
 from ejudge import functions
-from ejudge.langs.c_family import c_syntax_check
+from ejudge import registry
+from ejudge.exceptions import BuildError
+from ejudge.langs.c_family import c_syntax_check, c_classify_build_error
 from ejudge.tests import abstract as base
 
 sources = r"""
@@ -121,6 +125,39 @@ class TestGCCSupport(base.TestLanguageSupport):
         assert len(case) == 2
         assert case.error_type == 'runtime'
 
+    def run_async(self, source, inputs, timeout=None, compare_streams=False):
+        manager = registry.build_manager('c', source,
+                                         compare_streams=compare_streams)
+        manager.build()
+
+        async def main():
+            managers = [registry.execution_manager('c', manager, inputs)
+                        for _ in range(10)]
+            return await asyncio.gather(
+                *[ex.run_async(timeout) for ex in managers]
+            )
+
+        try:
+            return asyncio.run(main())
+        finally:
+            manager.close()
+
+    def test_run_async_interaction(self, twoinputs):
+        for case in self.run_async(twoinputs, ['foo', 'bar']):
+            assert list(case) == ['name: ', 'foo', 'job: ', 'bar', 'foo, bar']
+
+    def test_run_async_with_compare_streams(self, src_ok, src_error):
+        case, *_ = self.run_async(src_ok, ['john'], compare_streams=True)
+        assert list(case) == ['john', 'name: hello john!']
+
+        case, *_ = self.run_async(src_error, ['john'], compare_streams=True)
+        assert case.error_type == 'runtime'
+
+    def test_run_async_timeout(self):
+        source = 'int main() { while (1); }'
+        for case in self.run_async(source, [], timeout=0.2):
+            assert case.error_type == 'timeout'
+
 
 @pytest.mark.c
 @pytest.mark.gcc
@@ -131,3 +168,44 @@ def test_c_syntax_check_detect_invalid_syntax(compiler):
     assert c_syntax_check(good_src, compiler=compiler) is None
     with pytest.raises(SyntaxError):
         c_syntax_check(bad_src, compiler=compiler)
+
+
+def test_c_classify_build_error_detects_syntax_errors():
+    output = "main.c:1:13: error: unknown type name 'a'"
+    assert isinstance(c_classify_build_error(output, 'main.c'), SyntaxError)
+
+    output = ("main.c:(.text+0xa): undefined reference to `f'\n"
+              "collect2: error: ld returned 1 exit status")
+    assert isinstance(c_classify_build_error(output, 'main.c'), BuildError)
+
+
+@pytest.mark.c
+@pytest.mark.gcc
+def test_single_pass_build_classifies_syntax_errors():
+    manager = registry.build_manager('c', 'a b')
+    assert manager.single_pass_build
+    with pytest.raises(BuildError) as exc_info:
+        manager.build()
+    assert isinstance(exc_info.value.__cause__, SyntaxError)
+
+    manager = registry.build_manager('c', 'int f(); int main() { f(); }')
+    with pytest.raises(BuildError) as exc_info:
+        manager.build()
+    assert exc_info.value.__cause__ is None
+
+
+@pytest.mark.cpp
+def test_cpp_build_uses_precompiled_header(tmpdir):
+    source = (
+        '#include <iostream>\n'
+        'int main() { std::cout << "hello" << std::endl; }'
+    )
+    manager = registry.build_manager('c++', source)
+    manager.precompiled_header_path = str(tmpdir)
+    manager.build()
+    assert tmpdir.listdir()
+    pch_dir = tmpdir.listdir()[0]
+    assert pch_dir.join('pch.h.gch').exists()
+
+    result = registry.execution_manager('c++', manager, []).run()
+    assert list(result) == ['hello']
@@ -1,7 +1,12 @@
+import builtins
+import pickle
+from concurrent.futures import ThreadPoolExecutor
+
 import pytest
 import time
 
-from ejudge import functions
+from ejudge import functions, registry
+from ejudge.execution_manager import IntegratedExecutionManager
 from ejudge.tests import abstract as base
 
 sources = r"""
@@ -67,3 +72,62 @@ class TestPythonSupport(base.TestLanguageSupport):
 
     def test_raises_runtime_error_in_fake_sandbox(self, lang, iospec):
         self.test_raises_timeout_error(lang, iospec, fake=True)
+
+
+def test_build_manager_compiles_code_once(tmpdir, monkeypatch):
+    # Test cases run in forked processes, hence calls are logged to a file
+    src = 'print(input())'
+    log = tmpdir.join('compile.log')
+    log.write('')
+    compile = builtins.compile
+
+    def logging_compile(source, *args, **kwargs):
+        if source == src:
+            with open(str(log), 'a') as fd:
+                fd.write('compile\n')
+        return compile(source, *args, **kwargs)
+
+    monkeypatch.setattr(builtins, 'compile', logging_compile)
+    monkeypatch.setattr(IntegratedExecutionManager, 'use_zygote', False)
+    manager = registry.build_manager('python', src)
+    manager.build()
+
+    results = []
+    for name in ['foo', 'bar', 'baz']:
+        ctrl = registry.execution_manager('python', manager, [name])
+        results.append(list(ctrl.run()))
+    assert results == [[name, name] for name in ['foo', 'bar', 'baz']]
+    assert log.readlines() == ['compile\n']
+
+
+def test_build_manager_with_code_can_be_pickled():
+    manager = registry.build_manager('python', 'x = 42')
+    manager.build()
+    manager = pickle.loads(pickle.dumps(manager))
+    ns = {}
+    exec(manager.code, ns)
+    assert ns['x'] == 42
+
+
+def test_builtins_module_is_not_patched():
+    src = 'import builtins\nprint(builtins.print is print)'
+    result = functions.run(src, [[]], lang='python', sandbox=False)
+    assert list(result[0]) == ['False']
+
+
+def test_in_process_executions_can_run_concurrently():
+    src = (
+        'name = input()\n'
+        'for i in range(2000):\n'
+        '    print(name, i)\n'
+    )
+    manager = registry.build_manager('python', src)
+    manager.build()
+    managers = [registry.execution_manager('python', manager, [name])
+                for name in ['foo', 'bar', 'baz']]
+    with ThreadPoolExecutor(3) as executor:
+        results = list(executor.map(lambda x: x.wrapped_exec(), managers))
+
+    for name, result in zip(['foo', 'bar', 'baz'], results):
+        expected = ''.join('%s %s\n' % (name, i) for i in range(2000))
+        assert list(result) == [name, expected]
@@ -0,0 +1,199 @@
+import time
+
+import pytest
+
+from ejudge import functions
+from ejudge.execution_manager import IntegratedExecutionManager
+
+busy_python = 'input()\nwhile True: pass'
+sleep_python = 'import time\ninput()\ntime.sleep(0.4)\nprint("done")'
+busy_c = (
+    '#include<stdio.h>\n'
+    'int main() { char s[10]; scanf("%s", s); while (1); }'
+)
+hungry_python = 'input()\nx = bytearray(200 * 2**20)\nprint(len(x))'
+hungry_c = (
+    '#include<stdio.h>\n'
+    '#include<stdlib.h>\n'
+    '#include<string.h>\n'
+    'int main() {\n'
+    '    char s[10]; scanf("%s", s);\n'
+    '    char *x = malloc(200 << 20);\n'
+    '    if (x == NULL) { puts("out of memory"); fflush(stdout); abort(); }\n'
+    '    memset(x, 1, 200 << 20); printf("%d", x[0]); return 0;\n'
+    '}'
+)
+chatty_python = 'input()\nwhile True: print("spam " * 100)'
+stubborn_python = (
+    'input()\n'
+    'while True:\n'
+    '    try:\n'
+    '        print("x" * 1000)\n'
+    '    except BaseException:\n'
+    '        pass'
+)
+chatty_c = (
+    '#include<stdio.h>\n'
+    'int main() { char s[10]; scanf("%s", s); while (1) puts(s); }'
+)
+
+
+def test_cpu_limit_python():
+    t0 = time.time()
+    result = functions.run(busy_python, ['foo'], lang='python', sandbox=False,
+                           cpu_limit=0.3)
+    assert result[0].error_type == 'timeout'
+    assert time.time() - t0 < 2
+
+
+def test_cpu_limit_does_not_count_sleep():
+    result = functions.run(sleep_python, ['foo'], lang='python', sandbox=False,
+                           cpu_limit=0.2)
+    assert not result[0].is_error_test_case
+
+
+@pytest.mark.parametrize('compare_streams', [False, True])
+def test_cpu_limit_c(compare_streams):
+    t0 = time.time()
+    result = functions.run(busy_c, ['foo'], lang='c', sandbox=False,
+                           cpu_limit=1, compare_streams=compare_streams)
+    assert result[0].error_type == 'timeout'
+    assert time.time() - t0 < 5
+
+
+def test_case_timeout():
+    result = functions.run(sleep_python, [['foo'], ['bar']], lang='python',
+                           sandbox=False, case_timeout=0.2)
+    assert [case.error_type for case in result] == ['timeout', 'timeout']
+
+
+def test_timeout_is_a_budget_for_all_test_cases():
+    t0 = time.time()
+    result = functions.run(sleep_python, [['foo'], ['bar'], ['baz']],
+                           lang='python', sandbox=False, timeout=0.6)
+    assert time.time() - t0 < 1.5
+    assert not result[0].is_error_test_case
+    assert result[1].error_type == 'timeout'
+    assert result[2].error_type == 'timeout'
+
+
+def test_invalid_limits():
+    with pytest.raises(ValueError):
+        functions.run('print(1)', [], lang='python', cpu_limit=0)
+
+
+def test_memory_limit_python():
+    result = functions.run(hungry_python, ['foo'], lang='python',
+                           sandbox=False, memory_limit=50 * 2**20)
+    assert result[0].error_type == 'runtime'
+    assert result[0].meta['error_kind'] == 'memory-limit'
+
+
+@pytest.mark.parametrize('compare_streams', [False, True])
+def test_memory_limit_c(compare_streams):
+    result = functions.run(hungry_c, ['foo'], lang='c', sandbox=False,
+                           memory_limit=50 * 2**20,
+                           compare_streams=compare_streams)
+    assert result[0].error_type == 'runtime'
+    assert result[0].meta['error_kind'] == 'memory-limit'
+
+
+def test_output_limit_python():
+    t0 = time.time()
+    result = functions.run(chatty_python, ['foo'], lang='python',
+                           sandbox=False, output_limit=2**20)
+    case = result[0]
+    assert case.error_type == 'runtime'
+    assert case.meta['error_kind'] == 'output-limit'
+    assert 'characters omitted' in case.source()
+    assert len(case.source()) < 20000
+    assert time.time() - t0 < 5
+
+
+@pytest.mark.parametrize('use_zygote', [True, False])
+def test_output_limit_cannot_be_caught(use_zygote, monkeypatch):
+    monkeypatch.setattr(IntegratedExecutionManager, 'use_zygote', use_zygote)
+    t0 = time.time()
+    result = functions.run(stubborn_python, ['foo'], lang='python',
+                           sandbox=False, output_limit=10000, timeout=1)
+    case = result[0]
+    assert case.meta['error_kind'] == 'output-limit'
+    assert len(case.source()) < 20000
+    if use_zygote:
+        assert time.time() - t0 < 0.5
+        assert case.meta['peak_rss'] < 100 * 2**20
+
+
+@pytest.mark.parametrize('compare_streams', [False, True])
+def test_output_limit_c(compare_streams):
+    t0 = time.time()
+    result = functions.run(chatty_c, ['foo'], lang='c', sandbox=False,
+                           output_limit=2**20, compare_streams=compare_streams)
+    case = result[0]
+    assert case.error_type == 'runtime'
+    assert case.meta['error_kind'] == 'output-limit'
+    assert len(case.source()) < 20000
+    assert time.time() - t0 < 5
+
+
+def test_output_limit_is_not_triggered_by_small_outputs():
+    result = functions.run('print(input())', ['foo'], lang='python',
+                           sandbox=False, output_limit=4)
+    assert not result[0].is_error_test_case
+
+
+@pytest.mark.parametrize('lang', ['python', 'c'])
+def test_peak_rss_is_recorded(lang):
+    source = hungry_python if lang == 'python' else hungry_c
+    result = functions.run(source, ['foo'], lang=lang, sandbox=False,
+                           compare_streams=True)
+    assert not result[0].is_error_test_case
+    assert result[0].meta['peak_rss'] >= 200 * 2**20
+
+
+def test_peak_rss_survives_fake_sandbox():
+    result = functions.run('print(input())', ['foo'], lang='python',
+                           sandbox=True, fake_sandbox=True)
+    assert result[0].meta['peak_rss'] > 0
+
+
+def test_usage_meta():
+    source = 'x = input("x: ")\nprint(x * 2)'
+    result = functions.run(source, [['foo'], ['ba']], lang='python',
+                           sandbox=False)
+    case = result[0]
+    assert case.meta['prompts'] == 1
+    assert case.meta['bytes_in'] == 4
+    assert case.meta['bytes_out'] == len('x: foofoo\n')
+    for key in ['wall_time', 'user_time', 'system_time']:
+        assert case.meta[key] >= 0
+    assert result.meta['prompts'] == 2
+    assert result.meta['bytes_in'] == 7
+    assert result.meta['peak_rss'] == max(x.meta['peak_rss'] for x in result)
+    assert result.meta['wall_time'] == pytest.approx(
+        sum(x.meta['wall_time'] for x in result))
+
+
+def test_usage_meta_c():
+    result = functions.run(busy_c, ['foo'], lang='c', sandbox=False,
+                           cpu_limit=0.5)
+    case = result[0]
+    assert case.meta['user_time'] + case.meta['system_time'] >= 0.3
+    assert case.meta['wall_time'] >= 0.3
+
+
+def test_limits_are_set_before_the_program_starts():
+    source = (
+        '#include<stdio.h>\n'
+        '#include<sys/resource.h>\n'
+        'int main() {\n'
+        '    struct rlimit cpu, mem;\n'
+        '    getrlimit(RLIMIT_CPU, &cpu); getrlimit(RLIMIT_AS, &mem);\n'
+        '    printf("%ld %ld", (long) cpu.rlim_cur, (long) mem.rlim_cur);\n'
+        '}'
+    )
+    for compare_streams in [False, True]:
+        result = functions.run(source, [[]], lang='c', sandbox=False,
+                               cpu_limit=2, memory_limit=2**30,
+                               compare_streams=compare_streams)
+        assert str(result[0][-1]) == '2 %s' % 2**30
@@ -0,0 +1,55 @@
+import json
+
+from ejudge.__main__ import make_parser
+
+iospec_source = 'name: <john>\nhello john!'
+ok = 'name = input("name: ")\nprint("hello %s!" % name)'
+
+
+def batch(*args):
+    args = make_parser().parse_args(['batch'] + [str(x) for x in args])
+    args.func(args)
+
+
+def read_jsonl(path):
+    with open(path) as F:
+        return [json.loads(line) for line in F]
+
+
+def test_batch_grades_directory(tmp_path):
+    (tmp_path / 'spec.io').write_text(iospec_source)
+    subs = tmp_path / 'subs'
+    subs.mkdir()
+    (subs / 'a.py').write_text(ok)
+    (subs / 'b.py').write_text('print(42)')
+    (subs / 'c.py').write_text('print(')
+    (subs / 'd.py').write_bytes(b'print("\xff")')
+    (subs / 'notes.unknown-ext').write_text('')
+    output = tmp_path / 'out.jsonl'
+
+    batch(tmp_path / 'spec.io', subs, '-j', 2, '-o', output)
+    records = {r['submission'].rpartition('/')[-1]: r
+               for r in read_jsonl(output)}
+    assert sorted(records) == ['a.py', 'b.py', 'c.py', 'd.py']
+    assert records['a.py']['status'] == 'ok'
+    assert records['a.py']['lang'] == 'python'
+    assert records['a.py']['wall_time'] > 0
+    assert records['b.py']['status'] == 'wrong-answer'
+    assert records['c.py']['error_type'] == 'build'
+    assert records['c.py']['lang'] == 'python'
+    assert records['d.py']['status'] == 'build-error'
+    assert records['d.py']['error_kind'] == 'encoding'
+
+
+def test_batch_resumes_interrupted_run(tmp_path):
+    (tmp_path / 'spec.io').write_text(iospec_source)
+    (tmp_path / 'a.py').write_text(ok)
+    (tmp_path / 'b.py').write_text(ok)
+    output = tmp_path / 'out.jsonl'
+    done = json.dumps({'submission': str(tmp_path / 'a.py'), 'status': 'ok'})
+    output.write_text(done + '\n{"submission": "trunc')
+
+    batch(tmp_path / 'spec.io', str(tmp_path / '*.py'), '-o', output)
+    records = read_jsonl(output)
+    assert [r['submission'] for r in records] == \
+        [str(tmp_path / 'a.py'), str(tmp_path / 'b.py')]
@@ -0,0 +1,138 @@
+import time
+
+import pytest
+
+import iospec
+from ejudge import functions
+from ejudge.matching import OutputMatcher, OutputDigest, output_digest
+from iospec import IoSpec, StandardTestCase, In, Out
+
+answer_key = iospec.parse(
+    'Name: <John>\n'
+    'Hello John!\n'
+    '\n'
+    'Name: <Mary>\n'
+    'Hello Mary!'
+)
+
+
+def test_matcher_accepts_presentation_errors():
+    matcher = OutputMatcher(answer_key[0])
+    assert matcher.feed_output('  NAME:')
+    assert matcher.feed_output('\t')
+    assert matcher.feed_input()
+    assert matcher.feed_output('hello')
+    assert matcher.feed_output('   john')
+    assert matcher.feed_output('!\n\n')
+
+
+def test_matcher_detects_wrong_outputs():
+    matcher = OutputMatcher(answer_key[0])
+    assert matcher.feed_output('Na')
+    assert not matcher.feed_output('nme: ')
+    assert not matcher.feed_output('Name: ')
+
+
+def test_matcher_detects_incomplete_outputs_before_input():
+    matcher = OutputMatcher(answer_key[0])
+    assert matcher.feed_output('Nam')
+    assert not matcher.feed_input()
+
+
+def test_matcher_detects_extra_outputs():
+    matcher = OutputMatcher(answer_key[0])
+    assert matcher.feed_output('Name: ')
+    assert matcher.feed_input()
+    assert not matcher.feed_output('Hello John!!')
+
+
+def test_matcher_in_stream_mode():
+    matcher = OutputMatcher(answer_key[0], stream=True)
+    assert matcher.feed_output('Name: ')
+    assert matcher.feed_input()
+    assert matcher.feed_output('Hello John!')
+    assert not matcher.feed_output('?')
+
+
+@pytest.mark.parametrize('lang', ['python', 'c'])
+def test_early_abort_grade(lang):
+    if lang == 'python':
+        ok = 'name = input("Name: ")\nprint("Hello %s!" % name)'
+        wrong = 'print("Bye")\nwhile True: pass'
+    else:
+        ok = (
+            '#include<stdio.h>\n'
+            'int main() { char s[100];\n'
+            '  printf("Name: "); scanf("%s", s); printf("Hello %s!\\n", s); }'
+        )
+        wrong = (
+            '#include<stdio.h>\n'
+            'int main() { printf("Bye\\n"); fflush(stdout); while (1); }'
+        )
+
+    kwargs = dict(lang=lang, timeout=5, early_abort=True)
+    if lang == 'c':
+        kwargs['compare_streams'] = False
+    assert functions.grade(ok, answer_key, **kwargs).grade == 1
+
+    t0 = time.time()
+    feedback = functions.grade(wrong, answer_key, **kwargs)
+    assert time.time() - t0 < 2
+    assert feedback.grade == 0
+    assert feedback.status == 'wrong-answer'
+
+
+def test_output_digest_ignores_trailing_spaces():
+    digest = output_digest('Hello John!\nBye')
+    assert output_digest('Hello John!  \nBye\n\n ') == digest
+    assert output_digest('Hello John!\r\nBye\r\n') == digest
+    assert output_digest('Hello John!\n\nBye') != digest
+    assert output_digest('Hello  John!\nBye') != digest
+
+
+def test_output_digest_is_incremental():
+    digest = OutputDigest()
+    for chunk in [b'Hello Jo', b'hn! \r', b'\nBy', b'e\n']:
+        digest.feed_bytes(chunk)
+    assert digest.hexdigest() == output_digest('Hello John!\nBye')
+
+
+def test_output_digest_rejects_other_line_breaks():
+    assert output_digest('Hello\rJohn!') is None
+
+
+def test_digest_handles_leading_newlines_like_iospec():
+    # IoSpec only keeps leading newlines of outputs of test cases with a
+    # single input
+    source = (
+        '#include<stdio.h>\n'
+        'int main() { char s[10]; while (scanf("%s", s) == 1);\n'
+        '  printf("\\nfoo\\n\\n"); }'
+    )
+    for inputs, output in [(['a'], '\nfoo'), (['a', 'b'], 'foo'), ([], 'foo')]:
+        result = functions.run(source, [inputs], 'c', sandbox=False,
+                               compare_streams=True)
+        assert str(result[0][-1]) == output
+        feedback = functions.grade(source, result, 'c', compare_streams=True)
+        assert feedback.grade == 1
+        assert feedback.testcase.meta['digest_match'] is True
+
+
+def test_grade_streams_by_digest():
+    source = (
+        '#include<stdio.h>\n'
+        'int main() { char s[100]; printf("Name: "); scanf("%s", s);\n'
+        '  for (int i = 0; i < 100000; i++) printf("Hello %s! \\n", s); }'
+    )
+    output = 'Hello John!\n' * 100000
+    expected = IoSpec([StandardTestCase([Out('Name: '), In('John'),
+                                         Out(output)])])
+    feedback = functions.grade(source, expected, 'c', compare_streams=True)
+    assert feedback.grade == 1
+    assert feedback.testcase.meta['digest_match'] is True
+
+    wrong = IoSpec([StandardTestCase([Out('Name: '), In('John'),
+                                      Out('Hello Mary!\n' + output)])])
+    feedback = functions.grade(source, wrong, 'c', compare_streams=True)
+    assert feedback.status == 'wrong-answer'
+    assert 'Hello John!' in str(feedback.testcase[-1])
@@ -0,0 +1,36 @@
+import subprocess
+
+import pytest
+
+from ejudge.pinteract import Pinteract, Process
+
+
+def test_pinteract_interaction():
+    process = Pinteract(['cat'], timeout=5)
+    try:
+        process.send('hello')
+        assert process.receive() == 'hello\n'
+        assert process.finish() == ''
+    finally:
+        process.close()
+    assert process.process.rusage is not None
+
+
+def test_process_records_resource_usage():
+    process = Process(['python3', '-c', 'print(input())'],
+                      stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+    assert process.communicate(b'hello\n', timeout=5) == b'hello\n'
+    assert process.returncode == 0
+    assert process.rusage.ru_maxrss > 0
+
+
+def test_process_communicate_timeout():
+    process = Process(['sleep', '10'], stdin=subprocess.PIPE,
+                      stdout=subprocess.PIPE)
+    try:
+        with pytest.raises(TimeoutError):
+            process.communicate(timeout=0.1)
+    finally:
+        process.kill()
+        process.wait()
+    assert process.returncode < 0
@@ -0,0 +1,44 @@
+import pytest
+
+from ejudge import functions
+from ejudge.recorder import InteractionRecorder, format_print
+from iospec import In, Out
+
+
+def test_recorder_joins_fragments():
+    interaction = []
+    recorder = InteractionRecorder(interaction)
+    recorder.write('foo')
+    recorder.write('bar\n')
+    assert interaction == []
+    recorder.add_input('x')
+    recorder.write('baz')
+    recorder.flush()
+    assert interaction == [Out('foobar\n'), In('x'), Out('baz')]
+
+
+@pytest.mark.parametrize('args, kwargs', [
+    ((), {}),
+    (('foo',), {}),
+    ((1, 2.5, None), {}),
+    ((1, 2), {'sep': ', ', 'end': '!'}),
+    ((1, 2), {'sep': None, 'end': None}),
+])
+def test_format_print(args, kwargs, capsys):
+    print(*args, **kwargs)
+    assert format_print(args, **kwargs) == capsys.readouterr().out
+
+
+def test_format_print_invalid_sep():
+    with pytest.raises(TypeError):
+        format_print([1, 2], sep=1)
+
+
+def test_many_prints():
+    source = 'for i in range(5000):\n    print(i)\nx = input("x: ")\nprint(x)'
+    result = functions.run(source, ['foo'], lang='python', sandbox=False)
+    case = result[0]
+    assert len(case) == 3
+    assert str(case[0]).splitlines() == [str(i) for i in range(5000)] + ['x: ']
+    assert case[1] == In('foo')
+    assert case[2] == Out('foo')
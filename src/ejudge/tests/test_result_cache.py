@@ -0,0 +1,146 @@
+import os
+import time
+
+import pytest
+
+from ejudge import functions, grade, run, BuildError
+from ejudge.result_cache import ResultCache, TEMP_PREFIX
+from iospec import ErrorTestCase, IoSpec
+
+source = 'name = input("name: ")\nprint("hello %s!" % name)'
+inputs = [['john'], ['mary']]
+
+
+@pytest.fixture
+def cache(tmpdir):
+    return ResultCache(str(tmpdir.join('cache')))
+
+
+@pytest.fixture
+def calls(monkeypatch):
+    calls = []
+    run_worker = functions.run_worker
+
+    def counting_run_worker(*args, **kwargs):
+        if kwargs.get('cache') is None:
+            calls.append(args[0])
+        return run_worker(*args, **kwargs)
+
+    monkeypatch.setattr(functions, 'run_worker', counting_run_worker)
+    return calls
+
+
+def test_run_uses_cache(cache, calls):
+    result = run(source, inputs, 'python', sandbox=False, cache=cache)
+    cached = run(source, inputs, 'python', sandbox=False, cache=cache)
+    assert len(calls) == 1
+    assert cached.to_json() == result.to_json()
+    assert cached.meta['cached'] is True
+    assert 'cached' not in result.meta
+    assert cache.stats() == {'hits': 1, 'misses': 1, 'hit_ratio': 0.5,
+                             'entries': 1}
+
+
+def test_cache_key_depends_on_options(cache, calls):
+    run(source, inputs, 'python', sandbox=False, cache=cache)
+    run(source, inputs, 'python', sandbox=False, cache=cache, fast=True)
+    run(source, [['john']], 'python', sandbox=False, cache=cache)
+    run(source, inputs, 'python', sandbox=False, cache=cache, workers=2)
+    assert len(calls) == 3
+
+
+def test_grade_uses_cache(cache, calls):
+    iospec = 'name: <john>\nhello john!'
+    for _ in range(2):
+        feedback = grade(source, iospec, 'python', cache=cache)
+        assert feedback.grade == 1
+    assert len(calls) == 1
+
+
+def test_disk_layer_is_shared(cache):
+    run(source, inputs, 'python', sandbox=False, cache=cache)
+    other = ResultCache(cache.path)
+    assert run(source, inputs, 'python', cache=other).meta['cached']
+    assert other.hits == 1
+
+
+def test_memory_only_cache(tmpdir):
+    cache = ResultCache(str(tmpdir.join('cache')), persistent=False)
+    run(source, inputs, 'python', sandbox=False, cache=cache)
+    assert run(source, inputs, 'python', sandbox=False, cache=cache)
+    assert cache.hits == 1
+    assert not os.path.exists(cache.path)
+
+
+def test_memory_layer_is_lru(tmpdir):
+    cache = ResultCache(str(tmpdir.join('cache')), max_entries=2,
+                        persistent=False)
+    for key in 'abc':
+        cache.put(key * 64, IoSpec())
+    assert cache.get('a' * 64) is None
+    assert cache.get('c' * 64) is not None
+
+
+def test_expired_results_are_discarded(cache):
+    cache.put('a' * 64, IoSpec())
+    cache.ttl = 0.01
+    time.sleep(0.02)
+    assert cache.get('a' * 64) is None
+    assert not os.path.exists(cache.entry_path('a' * 64))
+
+
+def test_timeouts_are_not_cached(cache):
+    assert not cache.put('a' * 64, IoSpec([ErrorTestCase.timeout()]))
+    assert cache.get('a' * 64) is None
+
+
+def test_invalidate_problem(cache, calls):
+    for problem in ['p1', 'p2']:
+        run(source, inputs, 'python', sandbox=False, cache=cache,
+            problem=problem)
+    cache.invalidate('p1')
+    for problem in ['p1', 'p2']:
+        run(source, inputs, 'python', sandbox=False, cache=cache,
+            problem=problem)
+    assert len(calls) == 3
+    assert cache.hits == 1
+
+
+def test_disk_layer_evicts_least_recently_used_entries(tmpdir):
+    cache = ResultCache(str(tmpdir.join('cache')), max_size=100)
+    cache.put('a' * 64, IoSpec())
+    os.utime(cache.entry_path('a' * 64), (0, 0))
+    cache.put('b' * 64, IoSpec())
+    cache.put('c' * 64, IoSpec())
+
+    assert not os.path.exists(cache.entry_path('a' * 64))
+    assert os.path.exists(cache.entry_path('c' * 64))
+
+
+def test_cached_build_errors_are_raised(cache):
+    invalid = 'print(('
+    result = run(invalid, inputs, 'python', sandbox=False, cache=cache)
+    assert result[0].error_type == 'build'
+    with pytest.raises(BuildError):
+        run(invalid, inputs, 'python', sandbox=False, raises=True,
+            cache=cache)
+
+
+def test_disk_errors_do_not_break_runs(tmpdir):
+    tmpdir.join('file').write('')
+    cache = ResultCache(str(tmpdir.join('file')))
+    result = run(source, inputs, 'python', sandbox=False, cache=cache)
+    assert not result[0].is_error_test_case
+    assert run(source, inputs, 'python', sandbox=False, cache=cache)
+    assert cache.hits == 1
+
+
+def test_eviction_skips_files_being_written(tmpdir):
+    cache = ResultCache(str(tmpdir.join('cache')), max_size=100)
+    cache.put('a' * 64, IoSpec())
+    tmp_path = os.path.join(os.path.dirname(cache.entry_path('a' * 64)),
+                            TEMP_PREFIX + 'entry')
+    with open(tmp_path, 'w') as fd:
+        fd.write('x' * 1000)
+    cache.evict()
+    assert os.path.exists(tmp_path)
@@ -0,0 +1,42 @@
+import os
+import pwd
+import sys
+
+import pytest
+
+from ejudge.sandbox_pool import SandboxPool
+
+pytestmark = pytest.mark.sandbox
+
+
+@pytest.fixture
+def pool():
+    pool = SandboxPool(max_jobs=2,
+                       command=[sys.executable, '-m', 'ejudge.sandbox_worker'])
+    yield pool
+    pool.close()
+
+
+def test_pool_runs_jobs_as_low_privilege_user(pool):
+    assert pool.run(os.getuid) == pwd.getpwnam('nobody').pw_uid
+
+
+def test_pool_reuses_and_recycles_workers(pool):
+    pool.prewarm(n=1)
+    worker = pool.acquire((os.getpid.__module__,))
+    pool.release(worker)
+
+    assert pool.run(os.getpid) != worker.process.pid
+    assert pool.acquire((os.getpid.__module__,)) is worker
+    pool.release(worker)
+    pool.run(os.getpid)
+    assert not worker.is_alive()
+
+
+def test_pool_forks_a_new_child_for_each_job(pool):
+    assert pool.run(os.getpid) != pool.run(os.getpid)
+
+
+def test_pool_raises_exceptions(pool):
+    with pytest.raises(ZeroDivisionError):
+        pool.run(divmod, args=(1, 0))
@@ -0,0 +1,76 @@
+import asyncio
+import json
+import socket
+import threading
+
+import pytest
+
+from ejudge.exceptions import ServerError
+from ejudge.server import Server, Client
+
+source = 'name = input("name: ")\nprint("hello %s!" % name)'
+iospec_source = 'name: <john>\nhello john!'
+
+
+@pytest.fixture
+def server(tmp_path):
+    server = Server(str(tmp_path / 'ejudge.sock'), queue_depth=2)
+    loop = asyncio.new_event_loop()
+    loop.run_until_complete(server.start())
+    task = loop.create_task(server.serve_forever())
+
+    def run():
+        try:
+            loop.run_until_complete(task)
+        except asyncio.CancelledError:
+            pass
+
+    thread = threading.Thread(target=run, daemon=True)
+    thread.start()
+    yield server
+    loop.call_soon_threadsafe(task.cancel)
+    thread.join()
+    loop.close()
+
+
+def test_server_run_and_grade(server):
+    with Client(server.path) as client:
+        assert client.ping()['pending'] == 0
+
+        result = client.run(source, [['john'], ['mary']], lang='python')
+        assert [list(case) for case in result] == [
+            ['name: ', 'john', 'hello john!'],
+            ['name: ', 'mary', 'hello mary!'],
+        ]
+        assert result.meta['lang'] == 'python'
+        assert result[0].meta['prompts'] == 1
+
+        feedback = client.grade(source, iospec_source, lang='python')
+        assert feedback.grade == 1
+        feedback = client.grade('print(42)', iospec_source, lang='python')
+        assert feedback.status == 'wrong-answer'
+
+
+def test_server_reports_errors(server):
+    with Client(server.path) as client:
+        with pytest.raises(ServerError):
+            client.request('invalid-command')
+        with pytest.raises(ServerError):
+            client.run(source, [['john']], lang='python', bad_option=True)
+
+
+def test_server_rejects_jobs_when_queue_is_full(server):
+    slow = 'import time\ntime.sleep(0.5)'
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    sock.connect(server.path)
+    with sock, sock.makefile('rwb') as conn:
+        for idx in range(3):
+            request = {'id': idx, 'command': 'run', 'source': slow,
+                       'lang': 'python', 'inputs': [[]]}
+            conn.write(json.dumps(request).encode('utf8') + b'\n')
+        conn.flush()
+        responses = [json.loads(conn.readline()) for _ in range(3)]
+
+    responses = {r['id']: r for r in responses}
+    assert responses[2] == {'id': 2, 'error': 'queue is full'}
+    assert 'result' in responses[0] and 'result' in responses[1]
@@ -0,0 +1,106 @@
+import os
+import signal
+import threading
+
+import pytest
+
+from ejudge import functions, registry
+from ejudge import zygote as zygote_module
+from ejudge.zygote import Zygote
+
+
+def test_zygote_runs_test_cases():
+    zygote = Zygote(['ejudge'])
+    try:
+        manager = registry.build_manager('python', 'print(input())')
+        manager.build()
+        for name in ['foo', 'bar']:
+            ctrl = registry.execution_manager('python', manager, [name])
+            status, result = zygote.run(ctrl)
+            assert status == 'result'
+            assert list(result) == [name, name + '\n']
+    finally:
+        zygote.close()
+    assert zygote.pid is None
+
+
+def test_zygote_isolates_global_state():
+    src = (
+        'import builtins\n'
+        'print(hasattr(builtins, "leaked"))\n'
+        'builtins.leaked = True'
+    )
+    result = functions.run(src, [[], []], lang='python', sandbox=False)
+    assert list(result[0]) == ['False']
+    assert list(result[1]) == ['False']
+
+
+def test_zygote_reports_abnormal_termination():
+    src = 'import os; print("bye"); os._exit(0)'
+    result = functions.run(src, [[]], lang='python', sandbox=False)
+    assert result[0].error_type == 'runtime'
+    assert 'terminated unexpectedly' in result[0].error_message
+
+
+def test_zygote_restarts_after_crash():
+    zygote = Zygote()
+    try:
+        manager = registry.build_manager('python', 'print(42)')
+        manager.build()
+        zygote.launch()
+        os.kill(zygote.pid, signal.SIGKILL)
+        os.waitpid(zygote.pid, 0)
+        ctrl = registry.execution_manager('python', manager, [])
+        status, result = zygote.run(ctrl)
+        assert status == 'result'
+    finally:
+        zygote.close()
+
+
+def test_zygote_is_spawned_while_threads_are_running():
+    stop = threading.Event()
+    thread = threading.Thread(target=stop.wait)
+    thread.start()
+    zygote = Zygote(['ejudge'])
+    try:
+        with pytest.raises(RuntimeError):
+            zygote.start()
+        manager = registry.build_manager('python', 'print(input())')
+        manager.build()
+        ctrl = registry.execution_manager('python', manager, ['foo'])
+        status, result = zygote.run(ctrl)
+        assert status == 'result'
+        assert list(result) == ['foo', 'foo\n']
+        assert zygote._process is not None
+    finally:
+        stop.set()
+        thread.join()
+        zygote.close()
+    assert zygote.pid is None
+
+
+def test_zygote_accepts_sys_exit():
+    src = 'import sys; print("bye"); sys.exit(0)'
+    result = functions.run(src, [[]], lang='python', sandbox=False)
+    assert not result[0].is_error_test_case
+    assert list(result[0]) == ['bye']
+
+
+def test_zygote_rebuilds_evicted_build_managers(monkeypatch, caplog):
+    monkeypatch.setattr(zygote_module, 'MAX_BUILD_MANAGERS', 2)
+    zygote = Zygote()
+    try:
+        managers = []
+        for i in range(3):
+            manager = registry.build_manager('python', 'print(%s)' % i)
+            manager.build()
+            managers.append(manager)
+        for _ in range(2):
+            for i, manager in enumerate(managers):
+                ctrl = registry.execution_manager('python', manager, [])
+                status, result = zygote.run(ctrl)
+                assert status == 'result'
+                assert list(result) == [str(i) + '\n']
+        assert 'died' not in caplog.text
+    finally:
+        zygote.close()
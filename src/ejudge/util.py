@@ -1,11 +1,16 @@
+import collections
 import contextlib
 import io
+import math
 import os
+import resource
 import sys
 import signal
 import traceback
 from threading import Thread
 
+import psutil
+
 
 #
 # Special IO functions for python script interactions
@@ -102,6 +107,310 @@ def timeout(func, args=(), kwargs={}, timeout=1.0, default=NOTGIVEN,
                 raise thread.exception
 
 
+def cpu_timeout(func, args=(), kwargs={}, cpu_limit=None):
+    """
+    Execute callable `func` with a limit on the CPU time (user + system) of the
+    current process. If cpu_limit is None, simply call func.
+
+    Raises a TimeoutError if the limit is exceeded. It uses signals, hence it
+    only works in the main thread.
+    """
+
+    if cpu_limit is None:
+        return func(*args, **kwargs)
+    if cpu_limit <= 0:
+        raise ValueError('cpu_limit must be positive')
+
+    def handler(*args):
+        raise TimeoutError
+
+    previous = signal.signal(signal.SIGPROF, handler)
+    signal.setitimer(signal.ITIMER_PROF, cpu_limit)
+    try:
+        return func(*args, **kwargs)
+    finally:
+        signal.setitimer(signal.ITIMER_PROF, 0)
+        signal.signal(signal.SIGPROF, previous)
+
+
+def set_cpu_rlimit(cpu_limit):
+    """
+    Limit the CPU time of the current process using RLIMIT_CPU.
+
+    The kernel sends SIGXCPU when the limit (rounded up to a whole second) is
+    reached and SIGKILL one second later.
+    """
+
+    soft = int(math.ceil(cpu_limit))
+    resource.setrlimit(resource.RLIMIT_CPU, (soft, soft + 1))
+
+
+def set_memory_rlimit(memory_limit):
+    """
+    Limit the address space (in bytes) of the current process using
+    RLIMIT_AS.
+    """
+
+    resource.setrlimit(resource.RLIMIT_AS, (memory_limit, memory_limit))
+
+
+def set_resource_limits(cpu_limit=None, memory_limit=None):
+    """
+    Apply the given CPU and memory limits to the current process.
+
+    This is used as the preexec_fn of child processes, so the limits are in
+    place before the program starts running.
+    """
+
+    if cpu_limit is not None:
+        set_cpu_rlimit(cpu_limit)
+    if memory_limit is not None:
+        set_memory_rlimit(memory_limit)
+
+
+@contextlib.contextmanager
+def address_space_limit(memory_limit=None):
+    """
+    Context manager that limits how much the address space of the current
+    process can grow (in bytes) inside the with block.
+
+    Allocations that exceed the limit raise MemoryError in Python code.
+    """
+
+    if memory_limit is None:
+        yield
+        return
+
+    soft, hard = resource.getrlimit(resource.RLIMIT_AS)
+    limit = psutil.Process().memory_info().vms + memory_limit
+    if hard != resource.RLIM_INFINITY:
+        limit = min(limit, hard)
+    resource.setrlimit(resource.RLIMIT_AS, (limit, hard))
+    try:
+        yield
+    finally:
+        resource.setrlimit(resource.RLIMIT_AS, (soft, hard))
+
+
+def rusage_to_dict(rusage, start=None):
+    """
+    Convert a resource.struct_rusage object to a dictionary with the resource
+    usage information recorded by ejudge.
+
+    If start is given, CPU times are measured from the start rusage. The
+    kernel only records the peak resident memory over the lifetime of a
+    process, hence peak_rss is never measured from start: it is the peak of
+    the whole process up to this point.
+    """
+
+    user_time, system_time = rusage.ru_utime, rusage.ru_stime
+    if start is not None:
+        user_time -= start.ru_utime
+        system_time -= start.ru_stime
+    return {
+        'peak_rss': rusage.ru_maxrss * 1024,
+        'user_time': user_time,
+        'system_time': system_time,
+    }
+
+
+#: Meta attributes with the resources used by each test case. Times are in
+#: seconds and memory in bytes.
+USAGE_META = ('wall_time', 'user_time', 'system_time', 'peak_rss', 'bytes_in',
+              'bytes_out', 'prompts')
+
+
+def aggregate_usage_meta(iospec):
+    """
+    Set the meta attributes of iospec with the resources used by all its
+    test cases.
+
+    All values are added, except for peak_rss, which is the maximum over all
+    test cases.
+    """
+
+    for key in USAGE_META:
+        values = [case.meta[key] for case in iospec if key in case.meta]
+        if values:
+            value = max(values) if key == 'peak_rss' else sum(values)
+            iospec.set_meta(key, value)
+    return iospec
+
+
+def strip_usage_meta(iospec):
+    """
+    Remove the resource usage meta attributes (see :data:`USAGE_META`) from
+    iospec and from all its test cases. Return the modified iospec.
+
+    Resource usage changes from one execution to another, so it must be
+    removed before comparing the serialized results of two runs.
+    """
+
+    for obj in [iospec, *iospec]:
+        for key in USAGE_META:
+            obj.meta.pop(key, None)
+    return iospec
+
+
+def is_cpu_limit_status(returncode):
+    """
+    Return True if a subprocess returncode signals that the process was killed
+    for exceeding its RLIMIT_CPU.
+    """
+
+    return returncode == -signal.SIGXCPU
+
+
+#: Messages printed by common runtimes when an allocation fails.
+OUT_OF_MEMORY_MESSAGES = (
+    'MemoryError', 'NoMemoryError', 'std::bad_alloc', 'OutOfMemoryError',
+    'Cannot allocate memory', 'out of memory',
+)
+
+
+def is_out_of_memory_output(data):
+    """
+    Return True if the output string contains a message that signals a failed
+    memory allocation.
+    """
+
+    return any(msg in data for msg in OUT_OF_MEMORY_MESSAGES)
+
+
+def truncate_output(interaction, keep, omitted=0):
+    """
+    Return a copy of a list of In/Out atoms keeping only the first and the last
+    keep characters of the output.
+
+    The omitted part is replaced by a short message. Inputs are always kept.
+    Output that was already shortened by an :class:`OutputBuffer` must pass
+    the number of characters it dropped right before the last keep characters
+    as the omitted argument.
+    """
+
+    total = sum(len(x) for x in interaction if isinstance(x, datatypes.Out))
+    if total > 2 * keep:
+        head_pos, tail_pos = keep, total - keep
+        omitted += total - 2 * keep
+    elif omitted:
+        head_pos = tail_pos = max(total - keep, 0)
+    else:
+        return list(interaction)
+
+    result = []
+    pos = 0
+    for atom in interaction:
+        if not isinstance(atom, datatypes.Out):
+            result.append(atom)
+            continue
+        data = str(atom)
+        start, pos = pos, pos + len(data)
+        parts = []
+        if start < head_pos:
+            parts.append(data[:head_pos - start])
+        if start <= head_pos < pos:
+            parts.append(omitted_message(omitted))
+        if pos > tail_pos:
+            parts.append(data[max(tail_pos - start, 0):])
+        if parts:
+            result.append(datatypes.Out(''.join(parts)))
+    return result
+
+
+def omitted_message(n):
+    """
+    Message that replaces n characters removed from the output.
+    """
+
+    return '\n... (%s characters omitted) ...\n' % n
+
+
+class OutputBuffer:
+    """
+    Accumulate the output chunks (strings or bytes) of a program.
+
+    Everything is kept until .truncate() is called, since the full output is
+    necessary to grade programs. After that, only the first keep items and a
+    ring buffer with the last keep items are kept, and the number of dropped
+    items is stored in the omitted attribute. Dropped items always come right
+    before the last keep items.
+    """
+
+    def __init__(self, keep, empty=''):
+        self.keep = keep
+        self.empty = empty
+        self.omitted = 0
+        self.is_truncated = False
+        self._chunks = []
+        self._head = empty
+        self._tail = collections.deque()
+        self._tail_size = 0
+
+    def write(self, data):
+        """
+        Add a chunk of output to the buffer.
+        """
+
+        if not self.is_truncated:
+            self._chunks.append(data)
+            return
+        if len(self._head) < self.keep:
+            n = self.keep - len(self._head)
+            self._head += data[:n]
+            data = data[n:]
+        self._tail.append(data)
+        self._tail_size += len(data)
+        while (len(self._tail) > 1
+               and self._tail_size - len(self._tail[0]) >= self.keep):
+            self._tail_size -= len(self._tail[0])
+            self.omitted += len(self._tail.popleft())
+        excess = self._tail_size - self.keep
+        if excess > 0:
+            self._tail[0] = self._tail[0][excess:]
+            self._tail_size -= excess
+            self.omitted += excess
+
+    def truncate(self):
+        """
+        Drop the middle of the buffered output and keep only a bounded prefix
+        and suffix of all data written from now on.
+        """
+
+        if self.is_truncated:
+            return
+        data = self.empty.join(self._chunks)
+        self._chunks.clear()
+        self.is_truncated = True
+        self.write(data)
+
+    def take(self):
+        """
+        Return the buffered output and remove it from the buffer.
+        """
+
+        data = self.empty.join([self.empty.join(self._chunks), self._head,
+                                self.empty.join(self._tail)])
+        self._chunks.clear()
+        self._head = self.empty
+        self._tail.clear()
+        self._tail_size = 0
+        return data
+
+
+def read_truncated(file, keep):
+    """
+    Read a binary file keeping only its first and last keep bytes.
+
+    Return a tuple with the data and the number of dropped bytes.
+    """
+
+    buffer = OutputBuffer(keep, b'')
+    buffer.truncate()
+    for chunk in iter(lambda: file.read(65536), b''):
+        buffer.write(chunk)
+    return buffer.take(), buffer.omitted
+
+
 #
 # Lazy evaluation
 #
@@ -185,6 +494,31 @@ def remove_trailing_newline_from_testcase(case):
     return case
 
 
+def iospec_from_json(data):
+    """
+    Decode the JSON representation of an IoSpec object.
+
+    Unlike IoSpec.from_json(), it preserves the meta information of each test
+    case.
+    """
+
+    return datatypes.IoSpec([testcase_from_json(case) for case in data])
+
+
+def testcase_from_json(data):
+    """
+    Decode the JSON representation of a TestCase object, preserving its meta
+    information.
+    """
+
+    data = dict(data)
+    meta = data.pop('meta', None) or {}
+    testcase = datatypes.TestCase.from_json(data)
+    for key, value in meta.items():
+        testcase.set_meta(key, value)
+    return testcase
+
+
 def format_traceback(ex, source):
     """
     Creates a error message string from an exception with a __traceback__
@@ -0,0 +1,521 @@
+"""
+Fork server for integrated execution managers.
+
+Integrated languages (e.g., Python) execute each test case in a separate
+process so global state introduced by the student's program never leaks into
+the main interpreter or to other test cases. Spawning a new multiprocessing
+Process with a Queue for every test case is expensive, hence we keep a
+long-lived "zygote" process with all relevant modules already imported. The
+zygote forks a fresh child for each test case and sends the results back
+through a pipe.
+
+Forking a process with several threads is unsafe, since locks held by other
+threads (e.g., by the logging module) are never released in the child. Zygotes
+are forked from the current process only while it is single threaded (call
+:func:`prewarm_zygotes` early to take advantage of this). Otherwise, they are
+spawned as fresh Python interpreters that import the requested modules.
+
+The protocol between the main process and the zygote is a sequence of
+pickled tuples:
+
+    ('build', key, build_manager):
+        Register a build manager under the given key. This is sent only once
+        per build manager.
+    ('run', key, manager_class, inputs, options, timeout):
+        Fork a child and execute the test case using the build manager
+        registered under key. Options is a dictionary of keyword arguments
+        passed to manager_class. If the build manager was evicted from the
+        zygote, it replies ('unknown', key) and the caller must register it
+        again. Otherwise, the zygote replies ('started', pid) and then
+        sends one of the following messages:
+
+        * ('result', testcase)
+        * ('timeout',)
+        * ('error', interaction, message)
+
+        followed by a dictionary with the resource usage of the child (see
+        :func:`ejudge.util.rusage_to_dict`).
+    None:
+        Terminates the zygote.
+"""
+
+import atexit
+import collections
+import gc
+import importlib
+import itertools
+import logging
+import os
+import pickle
+import select
+import signal
+import subprocess
+import sys
+import threading
+import time
+import traceback
+import weakref
+from multiprocessing import Pipe
+from multiprocessing.connection import Connection
+
+from ejudge.util import set_cpu_rlimit, rusage_to_dict
+
+logger = logging.getLogger('ejudge')
+
+#: Maximum number of build managers kept in the zygote memory.
+MAX_BUILD_MANAGERS = 16
+
+_zygotes = {}
+_zygotes_pid = None
+
+
+_zygotes_lock = threading.Lock()
+
+
+def get_zygote(modules=()):
+    """
+    Return a Zygote instance that has all given modules imported.
+
+    Zygotes are shared by all callers in the same process. Each zygote
+    executes a single test case at a time, hence this function returns an idle
+    zygote or creates a new one if all zygotes for the given modules are busy.
+    """
+
+    global _zygotes_pid
+
+    with _zygotes_lock:
+        if _zygotes_pid != os.getpid():
+            _zygotes.clear()
+            _zygotes_pid = os.getpid()
+
+        zygotes = _zygotes.setdefault(tuple(modules), [])
+        for zygote in zygotes:
+            if not zygote.is_busy():
+                break
+        else:
+            zygote = Zygote(modules)
+            zygotes.append(zygote)
+        zygote.reserve()
+        return zygote
+
+
+def prewarm_zygotes(modules=(), n=1):
+    """
+    Start zygotes for the given modules ahead of time until there are at
+    least n of them.
+    """
+
+    global _zygotes_pid
+
+    with _zygotes_lock:
+        if _zygotes_pid != os.getpid():
+            _zygotes.clear()
+            _zygotes_pid = os.getpid()
+        zygotes = _zygotes.setdefault(tuple(modules), [])
+        while len(zygotes) < n:
+            zygotes.append(Zygote(modules))
+        for zygote in zygotes:
+            if not zygote.is_alive():
+                zygote.launch()
+
+
+def close_zygotes():
+    """
+    Terminate all zygote processes started by the current process.
+    """
+
+    if _zygotes_pid == os.getpid():
+        for zygotes in _zygotes.values():
+            for zygote in zygotes:
+                zygote.close()
+    _zygotes.clear()
+
+
+atexit.register(close_zygotes)
+
+
+class Zygote:
+    """
+    A pre-forked process that executes test cases of integrated execution
+    managers in forked children.
+
+    Args:
+        modules (list):
+            List of module names imported by the zygote before forking any
+            children.
+    """
+
+    def __init__(self, modules=()):
+        self.modules = tuple(modules)
+        self.pid = None
+        self._conn = None
+        self._owner = None
+        self._process = None
+        self._lock = threading.Lock()
+        self._keys = weakref.WeakKeyDictionary()
+        self._counter = itertools.count()
+        self._reserved = 0
+
+    def __repr__(self):
+        return '<Zygote pid=%s modules=%r>' % (self.pid, self.modules)
+
+    def is_alive(self):
+        """
+        Return True if zygote process is running.
+        """
+
+        if self.pid is None or self._owner != os.getpid():
+            return False
+        if self._process is not None:
+            return self._process.poll() is None
+        try:
+            pid, _ = os.waitpid(self.pid, os.WNOHANG)
+        except ChildProcessError:
+            return False
+        return pid == 0
+
+    def is_busy(self):
+        """
+        Return True if zygote is running or was reserved to run a test case.
+        """
+
+        return self._reserved > 0
+
+    def reserve(self):
+        """
+        Mark zygote as busy until the next call to .run() finishes.
+        """
+
+        self._reserved += 1
+
+    def launch(self):
+        """
+        Start the zygote process with :meth:`start` if the current process has
+        a single thread, or with :meth:`spawn` otherwise.
+        """
+
+        if threading.active_count() > 1:
+            self.spawn()
+        else:
+            self.start()
+
+    def start(self):
+        """
+        Start the zygote process by forking the current process.
+
+        Raises a RuntimeError if other threads are running.
+        """
+
+        if threading.active_count() > 1:
+            raise RuntimeError(
+                'cannot fork zygote while other threads are running: %s'
+                % ', '.join(t.name for t in threading.enumerate())
+            )
+
+        conn, child_conn = Pipe()
+        pid = os.fork()
+        if pid == 0:
+            status = 0
+            try:
+                conn.close()
+                close_inherited_fds(child_conn.fileno())
+                zygote_main(child_conn, self.modules)
+            except BaseException:
+                status = 1
+            finally:
+                os._exit(status)
+
+        child_conn.close()
+        self._started(pid, conn, None)
+
+    def spawn(self):
+        """
+        Start the zygote process in a new Python interpreter.
+
+        This is slower than :meth:`start`, but it is safe to call while other
+        threads are running.
+        """
+
+        conn, child_conn = Pipe()
+        fd = child_conn.fileno()
+        env = dict(os.environ)
+        env['PYTHONPATH'] = os.pathsep.join(filter(None, sys.path))
+        cmd = [
+            sys.executable, '-c',
+            'from ejudge.zygote import spawned_zygote_main as main; main()',
+            str(fd),
+        ]
+        try:
+            process = subprocess.Popen(cmd + list(self.modules),
+                                       pass_fds=[fd], env=env)
+        finally:
+            child_conn.close()
+        self._started(process.pid, conn, process)
+
+    def _started(self, pid, conn, process):
+        self.pid = pid
+        self._conn = conn
+        self._owner = os.getpid()
+        self._process = process
+        self._keys = weakref.WeakKeyDictionary()
+        logger.debug('zygote started with pid %s' % pid)
+
+    def close(self):
+        """
+        Terminate the zygote process.
+        """
+
+        if self.pid is None or self._owner != os.getpid():
+            self.pid = None
+            return
+        try:
+            self._conn.send(None)
+            self._conn.close()
+        except OSError:
+            pass
+        try:
+            if self._process is not None:
+                self._process.kill()
+                self._process.wait()
+            else:
+                os.kill(self.pid, signal.SIGKILL)
+                os.waitpid(self.pid, 0)
+        except (ProcessLookupError, ChildProcessError):
+            pass
+        self.pid = self._process = None
+
+    def run(self, manager, timeout=None):
+        """
+        Execute the given execution manager in a fork of the zygote and return
+        a tuple with the status and the data sent by the zygote.
+
+        The process id of the child is registered with manager.set_pid() while
+        it runs.
+        """
+
+        try:
+            with self._lock:
+                try:
+                    return self._run(manager, timeout)
+                except (EOFError, OSError):
+                    # The zygote died: we restart it and try again
+                    logger.warning('zygote %s died: restarting' % self.pid)
+                    self.close()
+                    return self._run(manager, timeout)
+        finally:
+            with _zygotes_lock:
+                self._reserved = max(self._reserved - 1, 0)
+
+    def _run(self, manager, timeout):
+        if not self.is_alive():
+            self.launch()
+
+        build_manager = manager.build_manager
+        key = self._keys.get(build_manager)
+        if key is None:
+            key = next(self._counter)
+            self._conn.send(('build', key, build_manager))
+            self._keys[build_manager] = key
+
+        run_msg = ('run', key, type(manager), manager.inputs,
+                   manager.options(), timeout)
+        self._conn.send(run_msg)
+        status, pid = self._conn.recv()
+        if status == 'unknown':
+            # The zygote evicted the build manager to save memory
+            self._conn.send(('build', key, build_manager))
+            self._conn.send(run_msg)
+            status, pid = self._conn.recv()
+        manager.set_pid(pid)
+        try:
+            result = pickle.loads(self._conn.recv_bytes())
+            manager.resource_usage = self._conn.recv()
+            return result
+        finally:
+            manager.set_pid(None)
+
+
+def close_inherited_fds(keep):
+    """
+    Close all file descriptors inherited from the parent process except for
+    the standard streams and the given descriptor.
+
+    Otherwise the zygote would keep files and sockets of the parent open (e.g.,
+    client connections of an ejudge server) for its entire lifetime.
+    """
+
+    max_fd = os.sysconf('SC_OPEN_MAX')
+    os.closerange(3, keep)
+    os.closerange(keep + 1, max_fd)
+
+
+def spawned_zygote_main():
+    """
+    Entry point of zygotes started with :meth:`Zygote.spawn`.
+
+    Command line arguments are the file descriptor of the connection with the
+    parent followed by the modules that must be imported.
+    """
+
+    fd, *modules = sys.argv[1:]
+    status = 0
+    try:
+        zygote_main(Connection(int(fd)), modules)
+    except BaseException:
+        status = 1
+    finally:
+        os._exit(status)
+
+
+def zygote_main(conn, modules):
+    """
+    Main loop of the zygote process.
+    """
+
+    for mod in modules:
+        try:
+            importlib.import_module(mod)
+        except ImportError:
+            pass
+
+    # Objects created so far will be shared with all children. Freezing them
+    # prevents the garbage collector from touching their memory pages and
+    # triggering copy-on-write in each fork.
+    if hasattr(gc, 'freeze'):
+        gc.freeze()
+
+    build_managers = collections.OrderedDict()
+    while True:
+        try:
+            msg = conn.recv()
+        except EOFError:
+            break
+        if msg is None:
+            break
+
+        cmd, key, *args = msg
+        if cmd == 'build':
+            build_managers[key] = args[0]
+            while len(build_managers) > MAX_BUILD_MANAGERS:
+                build_managers.popitem(last=False)
+        elif cmd == 'run' and key not in build_managers:
+            conn.send(('unknown', key))
+        elif cmd == 'run':
+            build_manager = build_managers[key]
+            build_managers.move_to_end(key)
+            zygote_fork(conn, build_manager, *args)
+        else:
+            raise ValueError('invalid command: %r' % cmd)
+
+
+def zygote_fork(conn, build_manager, manager_class, inputs, options, timeout):
+    """
+    Fork a child process that executes a single test case and sends the
+    results back to conn.
+    """
+
+    read_fd, write_fd = os.pipe()
+    pid = os.fork()
+    if pid == 0:
+        os.close(read_fd)
+        conn.close()
+        zygote_child(write_fd, build_manager, manager_class, inputs, options)
+
+    os.close(write_fd)
+    conn.send(('started', pid))
+    if timeout is None:
+        deadline = None
+    else:
+        deadline = time.monotonic() + timeout
+
+    # Read all data sent by the child
+    chunks = []
+    is_timeout = False
+    while True:
+        if deadline is None:
+            wait = None
+        else:
+            wait = deadline - time.monotonic()
+            if wait <= 0:
+                is_timeout = True
+                break
+        ready, _, _ = select.select([read_fd], [], [], wait)
+        if ready:
+            chunk = os.read(read_fd, 65536)
+            if not chunk:
+                break
+            chunks.append(chunk)
+    os.close(read_fd)
+
+    if is_timeout:
+        try:
+            os.kill(pid, signal.SIGKILL)
+        except ProcessLookupError:
+            pass
+    _, status, rusage = os.wait4(pid, 0)
+
+    # Children killed by RLIMIT_CPU are also reported as timeouts
+    if os.WIFSIGNALED(status) and options.get('cpu_limit') is not None:
+        is_timeout = is_timeout or os.WTERMSIG(status) in (signal.SIGXCPU,
+                                                           signal.SIGKILL)
+    if is_timeout:
+        data = pickle.dumps(('timeout',))
+    elif chunks:
+        data = b''.join(chunks)
+    else:
+        message = 'process terminated unexpectedly'
+        if os.WIFSIGNALED(status):
+            message += ' (signal %s)' % os.WTERMSIG(status)
+        data = pickle.dumps(('error', [], message))
+    conn.send_bytes(data)
+    conn.send(rusage_to_dict(rusage))
+
+
+def zygote_child(fd, build_manager, manager_class, inputs, options):
+    """
+    Executed in the child process forked from the zygote.
+
+    Run the test case and write the pickled results to the given file
+    descriptor. Never returns. Timeouts are enforced by the zygote, which kills
+    the child process. CPU limits are enforced by the test case itself and by
+    RLIMIT_CPU, in case the program ignores the first signal. Programs that
+    exceed the output limit are terminated immediately, since they may catch
+    the OutputLimitError.
+    """
+
+    status = 0
+    ctrl = None
+    try:
+        if options.get('cpu_limit') is not None:
+            set_cpu_rlimit(options['cpu_limit'] + 1)
+        ctrl = manager_class(build_manager, inputs, **options)
+        ctrl.output_limit_hook = lambda: zygote_child_exit(
+            fd, ('result', ctrl.output_limit_error(ctrl.interaction)), 0)
+        result, _ = ctrl.interact_with_timeout()
+        data = ('result', result)
+    except BaseException as ex:
+        status = 1
+        interaction = ctrl.interaction if ctrl is not None else []
+        message = ''.join(traceback.format_exception_only(type(ex), ex))
+        data = ('error', interaction, message.strip())
+    zygote_child_exit(fd, data, status)
+
+
+def zygote_child_exit(fd, data, status):
+    """
+    Write the pickled data to the given file descriptor and terminate the
+    child process.
+    """
+
+    try:
+        try:
+            payload = pickle.dumps(data)
+        except Exception as ex:
+            status = 1
+            message = 'unpicklable result: %s' % ex
+            payload = pickle.dumps(('error', [], message))
+        view = memoryview(payload)
+        while view:
+            view = view[os.write(fd, view):]
+    finally:
+        os._exit(status)